@@ -0,0 +1,257 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from diagnosis_engine import CSV_FILE, BASE_DIR, DiagnosisEngine, fuse_scores, read_symptom_columns
+
+# ==========================================
+# Configuration
+# ==========================================
+SEED = 42
+MAX_SYMPTOMS = 6
+BATCH_SIZES = (1, 32, 256)
+TRAIN_SIZES = (100, 1000, 5000)
+TRAIN_ESTIMATORS = (50, 500)
+
+
+# ==========================================
+# Timing Helpers
+# ==========================================
+
+def summarize(samples):
+    """Latency summary in milliseconds for a list of durations in seconds."""
+    ms = np.asarray(samples) * 1000
+    return {
+        "n": int(len(ms)),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "min_ms": float(ms.min()),
+        "max_ms": float(ms.max()),
+    }
+
+
+def time_each(fn, inputs, warmup=3):
+    """Calls fn once per input and returns the per-call durations."""
+    for item in inputs[:warmup]:
+        fn(item)
+    samples = []
+    for item in inputs:
+        start = time.perf_counter()
+        fn(item)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+# ==========================================
+# Synthetic Workloads
+# ==========================================
+
+def symptom_workload(columns, n, seed=SEED, max_symptoms=MAX_SYMPTOMS):
+    """n random non-empty symptom sets drawn from the column schema."""
+    rng = random.Random(seed)
+    return [sorted(rng.sample(columns, rng.randint(1, max_symptoms))) for _ in range(n)]
+
+
+def synthetic_dataset(columns, n_rows, n_classes=8, seed=SEED):
+    """
+    A training DataFrame with the same schema as the symptom CSV: each synthetic disease
+    has its own symptom probabilities, so the forest has real structure to learn.
+    """
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    profiles = np.where(rng.random((n_classes, len(columns))) < 0.1, 0.7, 0.03)
+    labels = rng.integers(0, n_classes, n_rows)
+    X = (rng.random((n_rows, len(columns))) < profiles[labels]).astype(np.uint8)
+    df = pd.DataFrame(X, columns=columns)
+    df["disease"] = [f"disease-{label}" for label in labels]
+    return df
+
+
+# ==========================================
+# Stage Benchmarks
+# ==========================================
+
+def bench_input_vector(engine, workload):
+    import pandas as pd
+
+    columns = engine.symptom_columns
+
+    def dataframe_input(symptoms):
+        # The per-call DataFrame the GUI used to build before the engine existed
+        ml_input = {col: [1 if col in symptoms else 0] for col in columns}
+        return pd.DataFrame(ml_input, columns=columns)
+
+    return {
+        "dataframe_dict": summarize(time_each(dataframe_input, workload)),
+        "numpy_encode": summarize(time_each(lambda symptoms: engine.encode([symptoms]), workload)),
+    }
+
+
+def bench_predict_proba(engine, flat_engine, workload):
+    rows = [engine.encode([symptoms]) for symptoms in workload]
+    return {
+        "sklearn_single": summarize(time_each(engine.clf.predict_proba, rows)),
+        "flat_single": summarize(time_each(flat_engine.clf.predict_proba, rows)),
+    }
+
+
+def bench_clips(engine, workload):
+    """Times each step of get_clips_diagnosis() separately on one pooled environment."""
+    steps = {"reset": [], "assert_string": [], "run": [], "fact_scan": [], "total": []}
+    with engine.clips_pool.environment() as env:
+        for symptoms in workload:
+            t0 = time.perf_counter()
+            env.reset()
+            t1 = time.perf_counter()
+            for symptom in symptoms:
+                env.assert_string(f'(symptom (name {symptom}))')
+            t2 = time.perf_counter()
+            env.run()
+            t3 = time.perf_counter()
+            results = {}
+            for fact in env.facts():
+                if fact.template.name == "disease":
+                    cf = float(fact["confidence"]) * 100
+                    results[fact["name"]] = max(results.get(fact["name"], cf), cf)
+            t4 = time.perf_counter()
+            steps["reset"].append(t1 - t0)
+            steps["assert_string"].append(t2 - t1)
+            steps["run"].append(t3 - t2)
+            steps["fact_scan"].append(t4 - t3)
+            steps["total"].append(t4 - t0)
+    return {step: summarize(samples) for step, samples in steps.items()}
+
+
+def bench_compiled_rules(compiled_engine, workload):
+    rows = [compiled_engine.encode([symptoms]) for symptoms in workload]
+    X = compiled_engine.encode(workload)
+    start = time.perf_counter()
+    compiled_engine.compiled_rules.diagnose_batch(X)
+    batch = time.perf_counter() - start
+    return {
+        "single": summarize(time_each(compiled_engine.compiled_rules.diagnose_batch, rows)),
+        "batch_per_row_ms": batch / len(workload) * 1000,
+    }
+
+
+def bench_fusion(engine, workload):
+    scored = engine.score(workload)
+    return summarize(time_each(lambda pair: fuse_scores(*pair), scored))
+
+
+def bench_end_to_end(engines, workload):
+    results = {}
+    for name, engine in engines.items():
+        single = summarize(time_each(engine.diagnose, workload))
+        batches = {}
+        for size in BATCH_SIZES:
+            chunks = [workload[i:i + size] for i in range(0, len(workload) - size + 1, size)] or [workload[:size]]
+            samples = time_each(engine.diagnose_batch, chunks, warmup=1)
+            batches[str(size)] = {**summarize(samples), "rows_per_second": size / float(np.median(samples))}
+        results[name] = {"single": single, "batch": batches}
+    return results
+
+
+def bench_training(columns, sizes=TRAIN_SIZES, estimators=TRAIN_ESTIMATORS, repeats=1):
+    """Times train_and_save_model() on synthetic CSVs, writing all outputs to a temp dir."""
+    from train_model import train_and_save_model
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_rows in sizes:
+            csv_file = os.path.join(tmp, f"train_{n_rows}.csv")
+            synthetic_dataset(columns, n_rows).to_csv(csv_file, index=False)
+            for n_estimators in estimators:
+                samples = []
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        train_and_save_model(csv_file, os.path.join(tmp, "model.pkl"), n_estimators,
+                                             os.path.join(tmp, "artifact"), cv_cache_file=None)
+                    samples.append(time.perf_counter() - start)
+                results.append({"rows": n_rows, "n_estimators": n_estimators, **summarize(samples)})
+                print(f"  train rows={n_rows:6d} trees={n_estimators:4d}: {np.median(samples):.2f}s", file=sys.stderr)
+    return results
+
+
+# ==========================================
+# Runner
+# ==========================================
+
+def environment_info():
+    import sklearn
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "sklearn": sklearn.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run_benchmarks(queries=500, train=True, train_sizes=TRAIN_SIZES, train_estimators=TRAIN_ESTIMATORS,
+                   train_repeats=1):
+    columns = read_symptom_columns(CSV_FILE)
+    workload = symptom_workload(columns, queries)
+
+    print("Loading engines...", file=sys.stderr)
+    engine = DiagnosisEngine(quiet=True)
+    flat_engine = DiagnosisEngine(ml_backend="flat", quiet=True)
+    fast_engine = DiagnosisEngine(ml_backend="flat", rules_backend="compiled", quiet=True)
+
+    report = {"environment": environment_info(), "config": {"queries": queries, "seed": SEED,
+                                                            "max_symptoms": MAX_SYMPTOMS}, "stages": {}}
+    stages = report["stages"]
+    print("Timing stages...", file=sys.stderr)
+    stages["input_vector"] = bench_input_vector(engine, workload)
+    stages["predict_proba"] = bench_predict_proba(engine, flat_engine, workload)
+    stages["clips"] = bench_clips(engine, workload)
+    stages["compiled_rules"] = bench_compiled_rules(fast_engine, workload)
+    stages["fusion"] = bench_fusion(fast_engine, workload)
+    stages["end_to_end"] = bench_end_to_end({"sklearn_clips": engine, "flat_compiled": fast_engine}, workload)
+    if train:
+        print("Timing training...", file=sys.stderr)
+        stages["training"] = bench_training(columns, train_sizes, train_estimators, train_repeats)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the diagnosis and training pipeline.")
+    parser.add_argument("--queries", type=int, default=500, help="synthetic symptom sets per stage")
+    parser.add_argument("--no-train", action="store_true", help="skip the training benchmarks")
+    parser.add_argument("--train-sizes", type=int, nargs="+", default=list(TRAIN_SIZES))
+    parser.add_argument("--train-estimators", type=int, nargs="+", default=list(TRAIN_ESTIMATORS))
+    parser.add_argument("--train-repeats", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    result = run_benchmarks(args.queries, not args.no_train, args.train_sizes, args.train_estimators,
+                            args.train_repeats)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        print(text)
@@ -0,0 +1,166 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from diagnosis_engine import DiagnosisEngine
+
+# ==========================================
+# Configuration
+# ==========================================
+CHUNK_ROWS = 20000
+TOP_K = 3
+PROGRESS_SECONDS = 2.0
+
+
+# ==========================================
+# Workers
+# ==========================================
+# Each worker process builds its own engine once; chunks arrive as uint8 matrices, which
+# pickle compactly, and go back as plain result lists.
+
+_engine = None
+
+
+def init_worker(engine_options):
+    global _engine
+    _engine = DiagnosisEngine(**engine_options)
+
+
+def diagnose_chunk(X, top_k):
+    return [results[:top_k] for results in _engine.diagnose_matrix(X)]
+
+
+# ==========================================
+# Output Writers
+# ==========================================
+
+class CsvWriter:
+    """One row per input row: row number, then disease/ml/clips/fts for each of the top-k."""
+
+    def __init__(self, f, top_k):
+        self.writer = csv.writer(f)
+        header = ["row"]
+        for rank in range(1, top_k + 1):
+            header += [f"disease_{rank}", f"ml_{rank}", f"clips_{rank}", f"fts_{rank}"]
+        self.writer.writerow(header)
+        self.top_k = top_k
+
+    def write(self, row, results):
+        line = [row]
+        for result in results:
+            line += [result["disease"], f"{result['ml_conf']:.2f}", f"{result['clips_conf']:.2f}",
+                     f"{result['fts']:.2f}"]
+        line += [""] * (1 + 4 * self.top_k - len(line))
+        self.writer.writerow(line)
+
+
+class JsonlWriter:
+    """One JSON object per input row: {"row": n, "diagnoses": [...]}."""
+
+    def __init__(self, f, top_k):
+        self.f = f
+
+    def write(self, row, results):
+        self.f.write(json.dumps({"row": row, "diagnoses": results}) + "\n")
+
+
+# ==========================================
+# Streaming Pipeline
+# ==========================================
+
+def read_chunks(input_file, symptom_columns, chunk_rows):
+    """Yields uint8 symptom matrices of at most chunk_rows rows, in file order."""
+    header = pd.read_csv(input_file, nrows=0).columns
+    missing = [column for column in symptom_columns if column not in header]
+    if missing:
+        raise ValueError(f"Input is missing symptom column(s): {', '.join(missing)}")
+
+    dtypes = {column: np.uint8 for column in symptom_columns}
+    for chunk in pd.read_csv(input_file, usecols=symptom_columns, dtype=dtypes, chunksize=chunk_rows):
+        yield chunk[symptom_columns].to_numpy()
+
+
+def bulk_diagnose(input_file, output_file, workers=None, chunk_rows=CHUNK_ROWS, top_k=TOP_K,
+                  output_format=None, engine_options=None):
+    """
+    Streams input_file through the diagnosis engine in chunks and writes the top-k diagnoses
+    per row to output_file in input order. Chunks are fanned out over a process pool with at
+    most 2 x workers chunks in flight, so memory is bounded by the chunk size, not the file.
+    Returns (rows, seconds).
+    """
+    # sklearn's vectorised predict_proba beats the flat forest on large batches (~11k vs ~4k rows/s)
+    engine_options = engine_options or {"ml_backend": "sklearn", "rules_backend": "compiled", "quiet": True}
+    output_format = output_format or ("jsonl" if output_file.endswith((".jsonl", ".json")) else "csv")
+    workers = os.cpu_count() if workers is None else workers
+
+    # The parent only needs the schema; the engines live in the workers
+    init_worker(engine_options)
+    symptom_columns = _engine.symptom_columns
+
+    start = time.perf_counter()
+    last_report = start
+    rows_done = 0
+
+    def report(final=False):
+        elapsed = time.perf_counter() - start
+        rate = rows_done / elapsed if elapsed > 0 else 0.0
+        end = "\n" if final else "\r"
+        print(f"{rows_done:,} rows diagnosed, {rate:,.0f} rows/s, {elapsed:.1f}s", end=end, file=sys.stderr)
+
+    with open(output_file, "w", newline="", encoding="utf-8") as f:
+        writer = (JsonlWriter if output_format == "jsonl" else CsvWriter)(f, top_k)
+
+        def write_chunk(chunk_results):
+            nonlocal rows_done, last_report
+            for results in chunk_results:
+                writer.write(rows_done, results)
+                rows_done += 1
+            if time.perf_counter() - last_report >= PROGRESS_SECONDS:
+                last_report = time.perf_counter()
+                report()
+
+        chunks = read_chunks(input_file, symptom_columns, chunk_rows)
+        if workers <= 1:
+            for X in chunks:
+                write_chunk(diagnose_chunk(X, top_k))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                     initargs=(engine_options,)) as executor:
+                # Futures are drained in submission order, which keeps the output in input order
+                in_flight = deque()
+                for X in chunks:
+                    in_flight.append(executor.submit(diagnose_chunk, X, top_k))
+                    if len(in_flight) >= 2 * workers:
+                        write_chunk(in_flight.popleft().result())
+                while in_flight:
+                    write_chunk(in_flight.popleft().result())
+
+    report(final=True)
+    return rows_done, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Diagnose a bulk symptom CSV (same 0/1 layout as the dataset).")
+    parser.add_argument("input", help="CSV with one 0/1 column per symptom (extra columns are ignored)")
+    parser.add_argument("output", help="output .csv or .jsonl file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes (1 = in-process)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="defaults to the output file extension")
+    parser.add_argument("--rules-backend", choices=("clips", "compiled"), default="compiled")
+    parser.add_argument("--ml-backend", choices=("sklearn", "flat"), default="sklearn")
+    args = parser.parse_args()
+
+    options = {"ml_backend": args.ml_backend, "rules_backend": args.rules_backend, "quiet": True}
+    n_rows, seconds = bulk_diagnose(args.input, args.output, args.workers, args.chunk_rows, args.top_k,
+                                    args.format, options)
+    print(f"Wrote {n_rows:,} rows to {args.output} in {seconds:.1f}s ({n_rows / max(seconds, 1e-9):,.0f} rows/s)",
+          file=sys.stderr)
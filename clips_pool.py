@@ -0,0 +1,181 @@
+import argparse
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from diagnosis_engine import RULES_FILE, get_clips_diagnosis, load_rules
+
+
+# ==========================================
+# CLIPS Environment Pool
+# ==========================================
+
+class ClipsEnvironmentPool:
+    """
+    N preloaded CLIPS environments, each with rules_model.clp loaded once.
+
+    A CLIPS Environment must only be used by one thread at a time, so callers check
+    one out, run it and hand it back; get_clips_diagnosis() resets it before use.
+    When every environment is busy, callers block until one is returned (or the
+    timeout expires). wait time and busy time are tracked for sizing the pool.
+    """
+
+    def __init__(self, size=4, rules_file=RULES_FILE, quiet=True):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self.size = size
+        self.rules_file = rules_file
+        self._available = queue.LifoQueue()
+        for _ in range(size):
+            self._available.put(load_rules(rules_file, quiet=quiet))
+
+        self._lock = threading.Lock()
+        self._created = time.perf_counter()
+        self.checkouts = 0
+        self.waits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_busy = 0.0
+        self.in_use = 0
+        self.peak_in_use = 0
+
+    @contextmanager
+    def environment(self, timeout=None):
+        """Checks an environment out for the duration of the with-block."""
+        start = time.perf_counter()
+        try:
+            env = self._available.get_nowait()
+        except queue.Empty:
+            try:
+                env = self._available.get(timeout=timeout)
+            except queue.Empty:
+                raise TimeoutError(f"No CLIPS environment available within {timeout}s") from None
+            waited = True
+        else:
+            waited = False
+
+        checked_out = time.perf_counter()
+        wait = checked_out - start
+        with self._lock:
+            self.checkouts += 1
+            self.waits += waited
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+        try:
+            yield env
+        finally:
+            busy = time.perf_counter() - checked_out
+            with self._lock:
+                self.in_use -= 1
+                self.total_busy += busy
+            self._available.put(env)
+
+    def diagnose(self, selected_symptoms, timeout=None):
+        """Runs get_clips_diagnosis() on a pooled environment."""
+        with self.environment(timeout) as env:
+            return get_clips_diagnosis(env, selected_symptoms)
+
+    def stats(self):
+        """Pool size, checkout/wait counters and utilization (busy time / pool capacity)."""
+        with self._lock:
+            elapsed = time.perf_counter() - self._created
+            return {
+                "size": self.size,
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "mean_wait_ms": self.total_wait / self.checkouts * 1000 if self.checkouts else 0.0,
+                "max_wait_ms": self.max_wait * 1000,
+                "utilization": self.total_busy / (elapsed * self.size) if elapsed > 0 else 0.0,
+            }
+
+
+# ==========================================
+# Process Pool Workers
+# ==========================================
+# CLIPS environments cannot be pickled, so each worker process builds its own pool
+# in the executor initializer and diagnoses through the module-level functions below.
+
+_worker_pool = None
+
+
+def init_worker(size=1, rules_file=RULES_FILE):
+    """ProcessPoolExecutor initializer: loads the rules once per worker process."""
+    global _worker_pool
+    _worker_pool = ClipsEnvironmentPool(size, rules_file)
+
+
+def worker_diagnose(selected_symptoms):
+    return _worker_pool.diagnose(selected_symptoms)
+
+
+def worker_diagnose_many(symptom_sets):
+    return [_worker_pool.diagnose(symptoms) for symptoms in symptom_sets]
+
+
+def worker_stats():
+    return _worker_pool.stats()
+
+
+def process_executor(workers, rules_file=RULES_FILE):
+    """A ProcessPoolExecutor whose workers each hold one preloaded CLIPS environment."""
+    return ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(1, rules_file))
+
+
+# ==========================================
+# Throughput Comparison
+# ==========================================
+
+def compare(symptom_sets, workers, rules_file=RULES_FILE):
+    """Times the same workload on one environment, a thread pool and a process pool."""
+    timings = {}
+
+    env = load_rules(rules_file, quiet=True)
+    start = time.perf_counter()
+    for symptoms in symptom_sets:
+        get_clips_diagnosis(env, symptoms)
+    timings["single_env"] = time.perf_counter() - start
+
+    pool = ClipsEnvironmentPool(workers, rules_file)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        start = time.perf_counter()
+        list(executor.map(pool.diagnose, symptom_sets))
+        timings["thread_pool"] = time.perf_counter() - start
+    thread_stats = pool.stats()
+
+    chunk = max(1, len(symptom_sets) // (workers * 4))
+    chunks = [symptom_sets[i:i + chunk] for i in range(0, len(symptom_sets), chunk)]
+    with process_executor(workers, rules_file) as executor:
+        list(executor.map(worker_diagnose, symptom_sets[:workers]))  # warm up every worker
+        start = time.perf_counter()
+        list(executor.map(worker_diagnose_many, chunks))
+        timings["process_pool"] = time.perf_counter() - start
+
+    for name, seconds in timings.items():
+        print(f"{name:>13}: {len(symptom_sets) / seconds:10.1f} diagnoses/s ({seconds:.2f}s)")
+    print(f"thread pool stats: {thread_stats}")
+    return timings
+
+
+if __name__ == "__main__":
+    import os
+    import random
+
+    import pandas as pd
+
+    from diagnosis_engine import CSV_FILE
+
+    parser = argparse.ArgumentParser(description="Compare CLIPS throughput with pooled environments.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--queries", type=int, default=5000)
+    args = parser.parse_args()
+
+    columns = pd.read_csv(CSV_FILE, nrows=0).columns[:-1].tolist()
+    rng = random.Random(42)
+    workload = [rng.sample(columns, rng.randint(1, 6)) for _ in range(args.queries)]
+    compare(workload, args.workers)
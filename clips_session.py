@@ -0,0 +1,228 @@
+import argparse
+import random
+import threading
+import time
+
+from diagnosis_engine import CSV_FILE, RULES_FILE, get_clips_diagnosis, load_rules, read_symptom_columns
+from diagnosis_metrics import metrics
+from rule_compiler import rules_without_logical_support
+
+# ==========================================
+# Configuration
+# ==========================================
+# Fires once for every disease fact as it is asserted and hands it to Python, so the session
+# learns about new conclusions without scanning the fact list. The high salience makes it
+# run ahead of the diagnosis rules; it only reads the fact.
+TRACK_FUNCTION = "incremental-track-disease"
+TRACK_RULE = f"""
+(defrule incremental-track-disease
+   (declare (salience 10000))
+   ?fact <- (disease (name ?name) (confidence ?confidence))
+   =>
+   ({TRACK_FUNCTION} ?fact ?name ?confidence))
+"""
+
+
+# ==========================================
+# Incremental CLIPS Session
+# ==========================================
+
+class IncrementalClipsSession:
+    """
+    A CLIPS environment that keeps its symptom facts between queries.
+
+    get_clips_diagnosis() resets the environment and re-asserts every symptom, which throws
+    away the Rete network's partial matches. diagnose() here instead retracts the symptoms
+    that were deselected and asserts only the new ones before running. Because every rule's
+    conditions are inside (logical ...), CLIPS itself retracts a disease fact once no rule
+    supports it any more.
+
+    The max-CF-per-disease map is kept up to date from the delta alone: new disease facts
+    arrive through TRACK_RULE, and after a retraction only the tracked disease facts (not
+    the whole fact list) are checked for existence. Results are identical to
+    get_clips_diagnosis(); see verify_against_reset().
+
+    One session serves one caller at a time (calls are serialised by a lock), which suits
+    a single operator toggling symptoms in the GUI.
+    """
+
+    def __init__(self, rules_file=RULES_FILE, quiet=True):
+        with open(rules_file, encoding="utf-8") as f:
+            unsupported = rules_without_logical_support(f.read())
+        if unsupported:
+            raise ValueError("Incremental sessions need every rule's conditions inside (logical ...); "
+                             f"not the case for: {', '.join(unsupported)}")
+
+        self.rules_file = rules_file
+        # Built from source: a bloaded rule image cannot take the tracking rule
+        self.env = load_rules(rules_file, quiet=quiet, use_image=False)
+        self.env.define_function(self._track, TRACK_FUNCTION)
+        self.env.build(TRACK_RULE)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Drops every asserted symptom (a full CLIPS reset)."""
+        self.env.reset()
+        self.symptom_facts = {}  # symptom name -> its fact
+        self.disease_facts = {}  # disease name -> {fact: CF percentage}
+        self.max_cf = {}  # disease name -> max CF percentage over its live facts
+        self._new_facts = []
+
+    def _track(self, fact, name, confidence):
+        self._new_facts.append((fact, str(name), float(confidence) * 100))
+
+    def diagnose(self, selected_symptoms):
+        """Same result as get_clips_diagnosis(env, selected_symptoms), computed from the delta."""
+        with self._lock:
+            selected = list(dict.fromkeys(selected_symptoms))
+            wanted = set(selected)
+            removed = [symptom for symptom in self.symptom_facts if symptom not in wanted]
+            added = [symptom for symptom in selected if symptom not in self.symptom_facts]
+
+            with metrics.span("clips_retract"):
+                for symptom in removed:
+                    self.symptom_facts.pop(symptom).retract()
+
+            with metrics.span("clips_assert"):
+                for symptom in added:
+                    try:
+                        self.symptom_facts[symptom] = self.env.assert_string(f'(symptom (name {symptom}))')
+                    except Exception as e:
+                        print(f"Error asserting symptom {symptom}: {e}")
+
+            with metrics.span("clips_run"):
+                rules_fired = self.env.run()
+
+            with metrics.span("clips_update"):
+                facts_checked = self._drop_unsupported() if removed else 0
+                new_facts = self._add_new_facts()
+
+            if metrics.enabled:
+                metrics.count("symptoms_asserted", len(added))
+                metrics.count("rules_fired", (rules_fired or 0) - new_facts)
+                metrics.count("facts_scanned", facts_checked + new_facts)
+
+            return dict(self.max_cf)
+
+    def _drop_unsupported(self):
+        """Forgets disease facts CLIPS retracted through logical support. Returns facts checked."""
+        checked = 0
+        for disease in list(self.disease_facts):
+            facts = self.disease_facts[disease]
+            checked += len(facts)
+            stale = [fact for fact in facts if not fact.exists]
+            if not stale:
+                continue
+            for fact in stale:
+                del facts[fact]
+            if facts:
+                self.max_cf[disease] = max(facts.values())
+            else:
+                del self.disease_facts[disease]
+                del self.max_cf[disease]
+        return checked
+
+    def _add_new_facts(self):
+        """Folds the disease facts asserted by the last run into the max-CF map. Returns their count."""
+        new_facts, self._new_facts = self._new_facts, []
+        for fact, disease, cf in new_facts:
+            # A fact asserted and then retracted within the same run never reaches the map
+            if not fact.exists:
+                continue
+            self.disease_facts.setdefault(disease, {})[fact] = cf
+            self.max_cf[disease] = max(self.max_cf.get(disease, cf), cf)
+        return len(new_facts)
+
+
+# ==========================================
+# Equivalence Check Against Reset-and-Reassert
+# ==========================================
+
+def toggle_sequences(columns, n_sequences=50, steps=40, seed=42):
+    """
+    Random selection histories as an operator would produce them: mostly one or two symptoms
+    toggled per step, with the occasional jump to an unrelated selection or a clear.
+    """
+    rng = random.Random(seed)
+    sequences = []
+    for _ in range(n_sequences):
+        selected = set()
+        history = []
+        for _ in range(steps):
+            roll = rng.random()
+            if roll < 0.05:
+                selected = set()
+            elif roll < 0.15:
+                selected = set(rng.sample(columns, rng.randint(1, 8)))
+            else:
+                for symptom in rng.sample(columns, rng.randint(1, 2)):
+                    selected ^= {symptom}
+            history.append(sorted(selected))
+        sequences.append(history)
+    return sequences
+
+
+def rule_walk_sequences(rules_file=RULES_FILE, seed=42):
+    """Histories that build each rule's conditions one by one and then tear them down again."""
+    from rule_compiler import parse_rules
+
+    with open(rules_file, encoding="utf-8") as f:
+        rules = parse_rules(f.read())
+    rng = random.Random(seed)
+    sequences = []
+    for _, symptoms, _, _ in rules:
+        up = [sorted(symptoms[:i]) for i in range(1, len(symptoms) + 1)]
+        order = symptoms[:]
+        rng.shuffle(order)
+        down = [sorted(order[i:]) for i in range(1, len(order) + 1)]
+        sequences.append(up + down)
+    return sequences
+
+
+def verify_against_reset(rules_file=RULES_FILE, csv_file=CSV_FILE, n_sequences=50, steps=40, seed=42):
+    """
+    Replays random toggle sequences through one IncrementalClipsSession and through
+    get_clips_diagnosis() (full reset per step). Returns the mismatching steps and prints
+    the per-step time of both.
+    """
+    columns = read_symptom_columns(csv_file)
+    sequences = rule_walk_sequences(rules_file, seed) + toggle_sequences(columns, n_sequences, steps, seed)
+
+    session = IncrementalClipsSession(rules_file)
+    env = load_rules(rules_file, quiet=True)
+
+    mismatches = []
+    incremental_time = reset_time = 0.0
+    n_steps = 0
+    for sequence in sequences:
+        session.reset()
+        for selected in sequence:
+            start = time.perf_counter()
+            incremental = session.diagnose(selected)
+            middle = time.perf_counter()
+            expected = get_clips_diagnosis(env, selected)
+            incremental_time += middle - start
+            reset_time += time.perf_counter() - middle
+            n_steps += 1
+            if incremental != expected:
+                mismatches.append((selected, expected, incremental))
+
+    print(f"Checked {n_steps} steps over {len(sequences)} toggle sequences: {len(mismatches)} mismatch(es).")
+    print(f"Per step: incremental {incremental_time / n_steps * 1000:.3f} ms, "
+          f"reset-and-reassert {reset_time / n_steps * 1000:.3f} ms")
+    for selected, expected, incremental in mismatches[:10]:
+        print(f"  {selected}\n    reset:       {expected}\n    incremental: {incremental}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental CLIPS sessions that apply symptom deltas.")
+    parser.add_argument("--rules", default=RULES_FILE, help="CLIPS rules file")
+    parser.add_argument("--sequences", type=int, default=50, help="random toggle sequences to replay")
+    parser.add_argument("--steps", type=int, default=40, help="selections per sequence")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    raise SystemExit(1 if verify_against_reset(args.rules, n_sequences=args.sequences, steps=args.steps,
+                                               seed=args.seed) else 0)
@@ -0,0 +1,172 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def symptom_bitmask(indices):
+    """Packs symptom column indices into an integer key (bit i set = column i present)."""
+    mask = 0
+    for i in indices:
+        mask |= 1 << i
+    return mask
+
+
+def file_signature(path):
+    """(mtime_ns, size) of a file, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def file_digest(path):
+    """Short sha256 of a file's content, or None if it does not exist."""
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()[:12]
+    except OSError:
+        return None
+
+
+class ReloadLock:
+    """
+    Readers-writer lock between diagnoses and an in-place reload. Any number of threads
+    may diagnose at once (reading); a reload (writing) waits for the diagnoses in progress,
+    holds new ones back until it is done, and then runs alone. Reading is re-entrant per
+    thread, so a diagnosis may call into other reading methods of the engine.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._local = threading.local()
+
+    @contextmanager
+    def reading(self):
+        depth = getattr(self._local, "depth", 0)
+        if not depth:
+            with self._cond:
+                while self._writing:
+                    self._cond.wait()
+                self._readers += 1
+        self._local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self._local.depth = depth
+            if not depth:
+                with self._cond:
+                    self._readers -= 1
+                    if not self._readers:
+                        self._cond.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._cond:
+            while self._writing:
+                self._cond.wait()
+            # Claimed before waiting, so a stream of new diagnoses cannot starve the reload
+            self._writing = True
+            while self._readers:
+                self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+class DiagnosisCache:
+    """
+    Bounded LRU cache of per-symptom-set ML and CLIPS results, keyed by symptom bitmask.
+
+    The cache remembers the signature of the files its entries were computed from
+    (the model and the rules). check() compares them with what is on disk and drops
+    every entry when any of them changed, so a caller that runs check() before each
+    lookup never gets a result from an older model or rule set.
+    """
+
+    def __init__(self, max_size=4096, watched_files=()):
+        if max_size < 1:
+            raise ValueError("Cache size must be at least 1")
+        self.max_size = max_size
+        self.watched_files = list(watched_files)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._signature = self._current_signature()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _current_signature(self):
+        return tuple(file_signature(path) for path in self.watched_files)
+
+    def changed(self):
+        """The watched files' signature if it differs from the one last committed, otherwise None."""
+        signature = self._current_signature()
+        with self._lock:
+            return None if signature == self._signature else signature
+
+    def commit(self, signature):
+        """Records signature as the files now in effect and drops every entry."""
+        with self._lock:
+            self._signature = signature
+            self._entries.clear()
+            self.invalidations += 1
+
+    def check(self):
+        """Clears the cache if a watched file changed on disk. Returns True when it did."""
+        signature = self.changed()
+        if signature is None:
+            return False
+        self.commit(signature)
+        return True
+
+    def get(self, key):
+        """Returns the cached value for key (marking it most recently used), or None."""
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Stores value under key, evicting the least recently used entry when full."""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Counters as a plain dict (size, hits, misses, evictions, invalidations, hit_rate)."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,618 @@
+import hashlib
+import json
+import os
+import platform
+import warnings
+
+import numpy as np
+
+from diagnosis_cache import DiagnosisCache, ReloadLock, file_digest, file_signature, symptom_bitmask
+from diagnosis_metrics import metrics
+
+# ==========================================
+# Configuration
+# ==========================================
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_FILE = os.path.join(BASE_DIR, "tomato_disease_model.pkl")
+CSV_FILE = os.path.join(BASE_DIR, "tomato_disease_symptoms_extended.csv")
+RULES_FILE = os.path.join(BASE_DIR, "rules_model.clp")
+# Tuned fusion weights/thresholds (written by fusion_tuning.py); the constants below apply without it
+FUSION_CONFIG_FILE = os.path.join(BASE_DIR, "fusion_config.json")
+# Treatment/prevention text shown with each diagnosis
+DISEASE_INFO_FILE = os.path.join(BASE_DIR, "disease_info.json")
+
+# Final Trust Score (FTS) fusion weights
+W_ML = 0.6
+W_CF = 0.4
+
+# FTS thresholds: rows below MIN_FTS are dropped, the others are tagged high/medium/low
+MIN_FTS = 0.1
+HIGH_FTS = 75
+MEDIUM_FTS = 40
+FUSION_KEYS = ("w_ml", "w_cf", "min_fts", "high_fts", "medium_fts")
+
+# pandas, joblib/sklearn and clips are imported only by the loaders that need them, so a
+# process serving from the model artifact with compiled rules never pays for them.
+
+# The model is fitted on a DataFrame, but the engine feeds it a plain 0/1 matrix
+# whose columns are already in symptom_columns order.
+warnings.filterwarnings("ignore", message="X does not have valid feature names")
+
+# ==========================================
+# Disease Info
+# ==========================================
+
+def load_disease_info(info_file=DISEASE_INFO_FILE):
+    """
+    Treatment and prevention text per disease from info_file. Raises ValueError when the
+    file is not a {disease: {"treatment": str, "prevention": str}} mapping.
+    """
+    try:
+        with open(info_file, encoding="utf-8") as f:
+            info = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"cannot read disease info {info_file}: {e}") from None
+    if not isinstance(info, dict):
+        raise ValueError(f"{info_file} must map disease names to their info")
+    for disease, entry in info.items():
+        if not isinstance(entry, dict) or not all(isinstance(entry.get(key), str)
+                                                  for key in ("treatment", "prevention")):
+            raise ValueError(f"{info_file}: {disease} needs 'treatment' and 'prevention' text")
+    return info
+
+
+# Loaded once at import for callers without an engine; every DiagnosisEngine loads (and
+# reloads) its own copy as engine.disease_info
+try:
+    disease_info = load_disease_info()
+except ValueError as e:
+    print(f"Warning: {e}")
+    disease_info = {}
+
+
+# ==========================================
+# Loading
+# ==========================================
+
+def read_symptom_columns(csv_file=CSV_FILE):
+    """Reads only the header of the data file: all columns except 'disease'."""
+    import pandas as pd
+
+    return pd.read_csv(csv_file, nrows=0).columns[:-1].tolist()
+
+
+def load_model(model_file=MODEL_FILE, csv_file=CSV_FILE):
+    """Loads the trained classifier and the symptom columns it expects."""
+    import joblib
+
+    clf = joblib.load(model_file)
+
+    # The model records the columns it was fitted on; older pickles fall back to the data file
+    feature_names = getattr(clf, "feature_names_in_", None)
+    if feature_names is not None:
+        symptom_columns = [str(name) for name in feature_names]
+    else:
+        symptom_columns = read_symptom_columns(csv_file)
+
+    return clf, symptom_columns
+
+
+_QuietRouter = None
+
+
+def quiet_router():
+    """A CLIPS router that swallows the rules' printout output so batch runs do not flood stdout."""
+    global _QuietRouter
+    if _QuietRouter is None:
+        from clips import Router
+
+        class QuietRouter(Router):
+            def __init__(self):
+                super().__init__("quiet", 40)
+
+            def query(self, name):
+                return name in ("t", "stdout")
+
+            def write(self, name, message):
+                pass
+
+        _QuietRouter = QuietRouter
+    return _QuietRouter()
+
+
+def rules_image_path(rules_file=RULES_FILE):
+    """The binary rule image (CLIPS bsave) built next to rules_file by rule_build.py."""
+    return os.path.splitext(rules_file)[0] + ".bin"
+
+
+def rules_image_stamp(rules_file=RULES_FILE):
+    """What a binary image must have been built from: the rules source, CLIPS build and machine."""
+    import clips
+
+    with open(rules_file, "rb") as f:
+        source_sha256 = hashlib.sha256(f.read()).hexdigest()
+    return {"source_sha256": source_sha256, "clipspy": getattr(clips, "__version__", None),
+            "machine": platform.machine()}
+
+
+def rules_image_is_current(rules_file=RULES_FILE):
+    """True if the binary image exists and was built from the current rules source on this platform."""
+    image = rules_image_path(rules_file)
+    try:
+        with open(image + ".json", encoding="utf-8") as f:
+            stamp = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return os.path.exists(image) and stamp == rules_image_stamp(rules_file)
+
+
+def load_rules(rules_file=RULES_FILE, quiet=False, use_image=True):
+    """
+    Creates a CLIPS environment with the expert rules loaded. A current binary image
+    (see rule_build.py) is bloaded instead of parsing the source; a binary image cannot be
+    extended with further constructs, so callers that build their own pass use_image=False.
+    """
+    from clips import Environment
+
+    env = Environment()
+    if quiet:
+        env.add_router(quiet_router())
+    if use_image and rules_image_is_current(rules_file):
+        env.load(rules_image_path(rules_file), binary=True)
+    else:
+        env.load(rules_file)
+    return env
+
+
+# ==========================================
+# Core CLIPS Logic - Retrieves CF
+# ==========================================
+
+def get_clips_diagnosis(env, selected_symptoms):
+    """Asserts selected symptoms into CLIPS, runs, and retrieves CF for all asserted diseases."""
+    with metrics.span("clips_reset"):
+        env.reset()
+
+    with metrics.span("clips_assert"):
+        for symptom in selected_symptoms:
+            try:
+                env.assert_string(f'(symptom (name {symptom}))')
+            except Exception as e:
+                print(f"Error asserting symptom {symptom}: {e}")
+
+    with metrics.span("clips_run"):
+        rules_fired = env.run()
+
+    with metrics.span("clips_fact_scan"):
+        clips_results, facts_scanned = scan_disease_facts(env)
+
+    if metrics.enabled:
+        metrics.count("symptoms_asserted", len(selected_symptoms))
+        metrics.count("rules_fired", rules_fired or 0)
+        metrics.count("facts_scanned", facts_scanned)
+
+    return clips_results
+
+
+def scan_disease_facts(env):
+    """Max CF percentage per asserted disease fact, plus the number of facts scanned."""
+    clips_results = {}
+    facts_scanned = 0
+
+    for fact in env.facts():
+        facts_scanned += 1
+        if fact.template.name == "disease":
+            disease_name = fact["name"]
+
+            try:
+                # CF is 0.0 to 1.0, convert to percentage (0-100%)
+                confidence_factor = float(fact["confidence"]) * 100
+
+                # Take the MAX confidence (the strongest evidence)
+                if disease_name in clips_results:
+                    clips_results[disease_name] = max(clips_results[disease_name], confidence_factor)
+                else:
+                    clips_results[disease_name] = confidence_factor
+
+            except Exception as e:
+                print(f"Error processing CLIPS fact for {disease_name}: {e}")
+                clips_results[disease_name] = 0
+
+    return clips_results, facts_scanned
+
+
+# ==========================================
+# Final Trust Score (FTS) Fusion
+# ==========================================
+
+def trust_level(fts, high_fts=HIGH_FTS, medium_fts=MEDIUM_FTS):
+    """Maps a Final Trust Score to the 'high'/'medium'/'low' display tag."""
+    if fts >= high_fts:
+        return "high"
+    if fts >= medium_fts:
+        return "medium"
+    return "low"
+
+
+def healthy_result():
+    """The single result reported when no symptoms are selected."""
+    return [{"disease": "healthy", "ml_conf": 100.0, "clips_conf": 100.0, "fts": 100.0, "level": "high"}]
+
+
+def fuse_scores(ml_results, clips_results, w_ml=W_ML, w_cf=W_CF, min_fts=MIN_FTS, high_fts=HIGH_FTS,
+                medium_fts=MEDIUM_FTS):
+    """
+    Combines ML and CLIPS percentages into Final Trust Scores.
+    Returns the diseases scoring at least min_fts, highest FTS first.
+    """
+    combined_results = []
+
+    all_unique_diseases = list(ml_results) + [d for d in clips_results if d not in ml_results]
+
+    for disease in all_unique_diseases:
+        if disease == "healthy":
+            continue
+
+        ml_conf = ml_results.get(disease, 0.0)
+        clips_conf = clips_results.get(disease, 0.0)
+
+        # Calculate Final Trust Score (FTS)
+        fts = (ml_conf * w_ml) + (clips_conf * w_cf)
+
+        if fts >= min_fts:
+            combined_results.append({
+                "disease": disease,
+                "ml_conf": ml_conf,
+                "clips_conf": clips_conf,
+                "fts": fts,
+                "level": trust_level(fts, high_fts, medium_fts)
+            })
+
+    # Sort results by Final Trust Score (highest first); ties by name, so the order does not
+    # depend on which rules backend produced clips_results or in what order
+    combined_results.sort(key=lambda x: (-x["fts"], x["disease"]))
+    return combined_results
+
+
+def default_fusion_config():
+    return {"w_ml": W_ML, "w_cf": W_CF, "min_fts": MIN_FTS, "high_fts": HIGH_FTS, "medium_fts": MEDIUM_FTS}
+
+
+def load_fusion_config(config_file=FUSION_CONFIG_FILE):
+    """
+    The fuse_scores() keyword arguments from config_file, falling back to the module
+    constants for a missing file or key. A malformed file is reported and ignored.
+    """
+    config = default_fusion_config()
+    if not config_file or not os.path.exists(config_file):
+        return config
+    try:
+        with open(config_file, encoding="utf-8") as f:
+            stored = json.load(f)
+        for key in FUSION_KEYS:
+            if key in stored:
+                config[key] = float(stored[key])
+        if config["w_ml"] < 0 or config["w_cf"] < 0 or config["medium_fts"] > config["high_fts"]:
+            raise ValueError("weights must be >= 0 and medium_fts <= high_fts")
+    except (OSError, ValueError, TypeError) as e:
+        print(f"Warning: ignoring fusion config {config_file}: {e}")
+        return default_fusion_config()
+    return config
+
+
+# ==========================================
+# Diagnosis Engine
+# ==========================================
+
+def normalize_symptoms(symptoms, symptom_columns, column_index):
+    """Validates symptom names and returns them de-duplicated in symptom_columns order."""
+    indices = set()
+    for symptom in symptoms:
+        try:
+            indices.add(column_index[symptom])
+        except KeyError:
+            raise ValueError(f"Unknown symptom: {symptom}") from None
+    return [symptom_columns[i] for i in sorted(indices)]
+
+
+class DiagnosisEngine:
+    """
+    Headless ML + CLIPS diagnosis pipeline.
+
+    diagnose() takes one collection of symptom names, diagnose_batch() takes a list of them and
+    evaluates the whole batch with a single predict_proba call. Each diagnosis is a list of
+    {"disease", "ml_conf", "clips_conf", "fts", "level"} dicts sorted by FTS; an empty list
+    means symptoms were given but nothing matched.
+
+    rules_backend selects how rules_model.clp is evaluated: "clips" runs the CLIPS
+    environment once per row, "compiled" scores the whole batch with the NumPy rule
+    matrix from rule_compiler (same results, see rule_compiler.py --verify), and
+    "incremental" keeps one CLIPS session whose symptom facts persist between calls, so
+    each diagnosis only retracts/asserts what changed since the previous one (suited to
+    a GUI operator toggling symptoms, see clips_session.py).
+
+    ml_backend selects the forest implementation: "sklearn" uses the pickled model,
+    "flat" uses the NumPy node arrays from forest_export (same probabilities, see
+    forest_export.py --verify, and far less per-call overhead on small inputs). The flat
+    backend memory-maps the model artifact from model_artifact when it exists (artifact_dir,
+    by default next to model_file), which also carries the symptom schema, so neither the
+    pickle nor the CSV is read. An artifact built from another pickle than model_file is
+    rebuilt from model_file first.
+
+    CLIPS runs on a pool of clips_pool_size preloaded environments, so diagnose() may be
+    called from several threads at once.
+
+    load() validates the rules against the model schema (see rule_build.py); the findings
+    are kept in rule_report and printed unless quiet. It also reads the treatment text from
+    info_file into disease_info.
+
+    With a cache, the engine reloads itself in place when one of watched_files changes.
+    The reload waits for the diagnoses in progress and holds new ones back until the new
+    state is swapped in whole (see ReloadLock), so no batch sees a half-loaded engine.
+    auto_reload=False leaves reloading to the caller (see hot_reload.py, which loads a new
+    engine in the background and swaps it in instead).
+
+    Fusion weights and thresholds come from fusion_config_file when it exists (see
+    fusion_tuning.py), otherwise from W_ML/W_CF/MIN_FTS/HIGH_FTS/MEDIUM_FTS.
+    """
+
+    def __init__(self, model_file=MODEL_FILE, csv_file=CSV_FILE, rules_file=RULES_FILE,
+                 rules_backend="clips", ml_backend="sklearn", quiet=False, cache_size=0,
+                 clips_pool_size=1, artifact_dir=None, fusion_config_file=FUSION_CONFIG_FILE,
+                 info_file=DISEASE_INFO_FILE, auto_reload=True):
+        if rules_backend not in ("clips", "compiled", "incremental"):
+            raise ValueError(f"Unknown rules backend: {rules_backend}")
+        if ml_backend not in ("sklearn", "flat"):
+            raise ValueError(f"Unknown ML backend: {ml_backend}")
+
+        self.model_file = model_file
+        self.csv_file = csv_file
+        self.rules_file = rules_file
+        self.rules_backend = rules_backend
+        self.ml_backend = ml_backend
+        self.quiet = quiet
+        self.clips_pool_size = clips_pool_size
+        self.fusion_config_file = fusion_config_file
+        self.info_file = info_file
+        if artifact_dir is None:
+            from model_artifact import artifact_dir_for
+            artifact_dir = artifact_dir_for(model_file)
+        self.artifact_dir = artifact_dir
+
+        # The cache snapshots the file signatures before loading, so a change made
+        # while load() runs is still detected on the next lookup.
+        self.watched_files = [model_file, rules_file, info_file]
+        if fusion_config_file:
+            self.watched_files.append(fusion_config_file)
+        if ml_backend == "flat":
+            from model_artifact import manifest_path
+            self.watched_files.append(manifest_path(artifact_dir))
+        if cache_size:
+            self.cache = DiagnosisCache(cache_size, self.watched_files if auto_reload else [])
+        else:
+            self.cache = None
+        self._reload_lock = ReloadLock()
+        self.load()
+
+    def load(self):
+        """
+        (Re)loads the model, symptom columns, rules, fusion config and disease info from disk.
+        Everything is built first and then swapped in with one update, so a failed load
+        leaves the engine as it was. Returns the signatures of the watched files it loaded.
+        """
+        # A file replaced mid-load would pair the version with other content than was loaded
+        while True:
+            signatures = tuple(file_signature(path) for path in self.watched_files)
+            state = self._load_state()
+            if tuple(file_signature(path) for path in self.watched_files) == signatures:
+                break
+        self.__dict__.update(state)
+        return signatures
+
+    def _load_state(self):
+        fusion = load_fusion_config(self.fusion_config_file)
+        disease_info = load_disease_info(self.info_file)
+        model_id = None
+        if self.ml_backend == "flat":
+            from model_artifact import build_from_model, load_artifact, manifest_path, matches_source
+
+            if os.path.exists(manifest_path(self.artifact_dir)):
+                clf, symptom_columns, manifest = load_artifact(self.artifact_dir)
+                if not matches_source(manifest, self.model_file):
+                    # e.g. a retrained pickle copied into place: serve it, not the old export
+                    print(f"Warning: {self.artifact_dir} was not built from {self.model_file}; rebuilding it")
+                    csv_file = self.csv_file if self.csv_file and os.path.exists(self.csv_file) else None
+                    build_from_model(self.model_file, self.artifact_dir, csv_file)
+                    clf, symptom_columns, manifest = load_artifact(self.artifact_dir)
+                model_id = manifest["model_id"]
+            else:
+                from forest_export import load_forest
+                clf = load_forest(model_file=self.model_file)
+                symptom_columns = clf.feature_names or read_symptom_columns(self.csv_file)
+            if clf.feature_names and clf.feature_names != symptom_columns:
+                raise ValueError("Exported forest features do not match the symptom columns")
+        else:
+            clf, symptom_columns = load_model(self.model_file, self.csv_file)
+        classes = clf.classes_.tolist()
+
+        clips_pool = None
+        clips_session = None
+        compiled_rules = None
+        if self.rules_backend == "clips":
+            from clips_pool import ClipsEnvironmentPool
+            clips_pool = ClipsEnvironmentPool(self.clips_pool_size, self.rules_file, quiet=self.quiet)
+        elif self.rules_backend == "incremental":
+            from clips_session import IncrementalClipsSession
+            clips_session = IncrementalClipsSession(self.rules_file, quiet=self.quiet)
+        else:
+            from rule_compiler import compile_rules
+            compiled_rules = compile_rules(symptom_columns, self.rules_file)
+
+        # Rule symptoms/diseases that do not line up with the model score 0% silently; say so
+        from rule_build import print_report, validate_rules
+        rule_report = validate_rules(self.rules_file, symptom_columns, classes, disease_info, self.rules_backend)
+        if not self.quiet:
+            print_report(rule_report)
+
+        return dict(
+            fusion=fusion, disease_info=disease_info, model_id=model_id, clf=clf, symptom_columns=symptom_columns,
+            classes=classes, column_index={name: i for i, name in enumerate(symptom_columns)},
+            clips_pool=clips_pool, clips_session=clips_session, compiled_rules=compiled_rules,
+            rule_report=rule_report,
+            # The model and rules in effect, recorded with each diagnosis by diagnosis_history.py
+            version={"model": model_id or file_digest(self.model_file), "rules": file_digest(self.rules_file)},
+        )
+
+    def reload_if_changed(self):
+        """
+        Reloads in place if a watched file changed (auto_reload). Returns True when it did.
+        A failed reload is raised to the caller and tried again on the next call, so the
+        previous model and rules are never served silently after a change.
+        """
+        if self.cache is None or self.cache.changed() is None:
+            return False
+        with self._reload_lock.writing():
+            if self.cache.changed() is None:  # another thread reloaded while this one waited
+                return False
+            try:
+                signatures = self.load()
+            except Exception as e:
+                print(f"Warning: reload failed, retrying on the next diagnosis: {type(e).__name__}: {e}")
+                raise
+            # Committed only now; diagnoses that began before the change may also have cached old results
+            self.cache.commit(signatures)
+        return True
+
+    def reading(self):
+        """
+        Context in which no reload swaps the loaded model and rules, for callers that use
+        them directly (see symptom_advisor.py). Must not diagnose with auto_reload inside.
+        """
+        return self._reload_lock.reading()
+
+    def normalize(self, symptoms):
+        """Validates symptom names and returns them de-duplicated in column order."""
+        return normalize_symptoms(symptoms, self.symptom_columns, self.column_index)
+
+    def encode(self, symptom_sets):
+        """Builds the 0/1 input matrix (one row per symptom set) over symptom_columns."""
+        X = np.zeros((len(symptom_sets), len(self.symptom_columns)), dtype=np.uint8)
+        for row, symptoms in enumerate(symptom_sets):
+            for symptom in symptoms:
+                X[row, self.column_index[symptom]] = 1
+        return X
+
+    def decode(self, X):
+        """Symptom name lists for the rows of a 0/1 matrix over symptom_columns."""
+        return [[self.symptom_columns[i] for i in np.flatnonzero(row)] for row in X]
+
+    def diagnose(self, symptoms):
+        """Diagnoses a single collection of symptom names."""
+        return self.diagnose_batch([symptoms])[0]
+
+    def diagnose_batch(self, symptom_sets):
+        """Diagnoses a list of symptom collections, returning one result list per entry."""
+        return self.diagnose_batch_versioned(symptom_sets)[0]
+
+    def diagnose_batch_versioned(self, symptom_sets):
+        """diagnose_batch() plus the version and disease_info of the model/rules that produced it."""
+        # Reload before anything is served if the model or rules changed on disk
+        self.reload_if_changed()
+        with self._reload_lock.reading(), metrics.span("diagnose"):
+            return self._diagnose_batch(symptom_sets), self.version, self.disease_info
+
+    def _diagnose_batch(self, symptom_sets):
+        with metrics.span("normalize"):
+            symptom_sets = [self.normalize(symptoms) for symptoms in symptom_sets]
+        results = [healthy_result() for _ in symptom_sets]
+        if metrics.enabled:
+            metrics.count("diagnoses", len(symptom_sets))
+
+        # Rows without symptoms are reported as healthy and skip both stages
+        rows = [i for i, symptoms in enumerate(symptom_sets) if symptoms]
+        if not rows:
+            return results
+
+        scores = self.score([symptom_sets[i] for i in rows])
+        with metrics.span("fusion"):
+            for row, (ml_results, clips_results) in zip(rows, scores):
+                results[row] = fuse_scores(ml_results, clips_results, **self.fusion)
+
+        return results
+
+    def diagnose_matrix(self, X):
+        """
+        Diagnoses the rows of a matrix already laid out over symptom_columns (e.g. a chunk of a
+        field-survey CSV); any non-zero value counts as present. Skips name validation and encoding.
+        """
+        X = (np.asarray(X) != 0).astype(np.uint8)
+        if X.ndim != 2 or X.shape[1] != len(self.symptom_columns):
+            raise ValueError(f"Expected {len(self.symptom_columns)} symptom columns, got shape {X.shape}")
+        if self.cache is not None:
+            return self.diagnose_batch(self.decode(X))
+
+        with self._reload_lock.reading(), metrics.span("diagnose"):
+            if metrics.enabled:
+                metrics.count("diagnoses", len(X))
+            results = [healthy_result() for _ in range(len(X))]
+            rows = np.flatnonzero(X.any(axis=1))
+            if rows.size:
+                scores = self._score_matrix(X[rows])
+                with metrics.span("fusion"):
+                    for row, (ml_results, clips_results) in zip(rows, scores):
+                        results[row] = fuse_scores(ml_results, clips_results, **self.fusion)
+            return results
+
+    def score(self, symptom_sets):
+        """
+        Returns (ml_results, clips_results) percentage dicts for each normalized, non-empty
+        symptom set, serving repeated symptom combinations from the cache when enabled.
+        """
+        with self._reload_lock.reading():
+            return self._cached_score(symptom_sets)
+
+    def _cached_score(self, symptom_sets):
+        if self.cache is None:
+            return self._score(symptom_sets)
+
+        keys = [symptom_bitmask(self.column_index[s] for s in symptoms) for symptoms in symptom_sets]
+        scores = [self.cache.get(key) for key in keys]
+
+        # Compute each distinct missing combination once, in a single batch
+        missing = {}
+        for key, symptoms, cached in zip(keys, symptom_sets, scores):
+            if cached is None:
+                missing.setdefault(key, symptoms)
+        if not missing:
+            return scores
+
+        fresh = dict(zip(missing, self._score(list(missing.values()))))
+        for key, value in fresh.items():
+            self.cache.put(key, value)
+        return [cached if cached is not None else fresh[key] for key, cached in zip(keys, scores)]
+
+    def _score(self, symptom_sets):
+        """Runs the ML and rule stages for a batch of normalized, non-empty symptom sets."""
+        with metrics.span("encode"):
+            X = self.encode(symptom_sets)
+        return self._score_matrix(X, symptom_sets)
+
+    def _score_matrix(self, X, symptom_sets=None):
+        """Runs the ML and rule stages for the rows of an encoded 0/1 matrix."""
+        with metrics.span("predict_proba"):
+            probabilities = self.clf.predict_proba(X)
+
+        if self.compiled_rules is not None:
+            with metrics.span("compiled_rules"):
+                all_clips_results = self.compiled_rules.diagnose_batch(X)
+            if metrics.enabled:
+                metrics.count("symptoms_asserted", int(np.count_nonzero(X)))
+                metrics.count("rules_fired", int(np.count_nonzero(self.compiled_rules.fired(X))))
+        else:
+            if symptom_sets is None:
+                symptom_sets = self.decode(X)
+            clips = self.clips_session or self.clips_pool
+            all_clips_results = [clips.diagnose(symptoms) for symptoms in symptom_sets]
+
+        return [({disease: float(prob) * 100 for disease, prob in zip(self.classes, proba)}, clips_results)
+                for proba, clips_results in zip(probabilities, all_clips_results)]
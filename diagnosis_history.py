@@ -0,0 +1,681 @@
+import argparse
+import atexit
+import json
+import math
+import os
+import queue
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from diagnosis_engine import BASE_DIR, CSV_FILE, DiagnosisEngine, healthy_result
+from diagnosis_metrics import metrics
+
+# ==========================================
+# Configuration
+# ==========================================
+HISTORY_FILE = os.path.join(BASE_DIR, "diagnosis_history.db")
+
+WRITE_BATCH_ROWS = 5000  # most diagnoses written per transaction
+FLUSH_INTERVAL = 0.5  # seconds the writer waits for a batch to fill before writing it anyway
+# Diagnoses waiting for the writer. record() drops (and counts) rather than block when full
+MAX_PENDING = 100_000
+BUSY_TIMEOUT_MS = 5000
+
+HOUR = 3600
+DAY = 24 * HOUR
+# Rollup bucket lengths, aligned to the Unix epoch (UTC). A query window is covered by the
+# longest whole buckets that fit, then shorter ones, then raw rows for what is left
+DISEASE_SPANS = (HOUR, DAY, 30 * DAY)
+PAIR_SPANS = (DAY, 30 * DAY)
+NO_MATCH = "no-match"  # top disease of a diagnosis where nothing passed MIN_FTS
+MAX_SYMPTOM_BITS = 63  # the symptom bitmask is a signed 64-bit SQLite integer
+
+OUTBREAK_WINDOW = 7 * DAY
+OUTBREAK_BASELINE_WINDOWS = 4
+OUTBREAK_RATIO = 2.0  # window count vs the mean of the baseline windows
+OUTBREAK_MIN_COUNT = 10
+
+BENCHMARK_ROWS = 10_000_000
+BENCHMARK_DAYS = 365
+BENCHMARK_SITES = 4
+BENCHMARK_POOL = 5000  # distinct symptom sets the synthetic history is drawn from
+BENCHMARK_REPEATS = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS symptoms (bit INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS diseases (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS sites (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS versions (
+    id INTEGER PRIMARY KEY,
+    model TEXT NOT NULL,
+    rules TEXT NOT NULL,
+    UNIQUE (model, rules)
+);
+
+-- One row per diagnosis. scores is a JSON list of [disease id, ML %, CLIPS %, FTS] in
+-- display order; symptom_mask has bit symptoms.bit set for each symptom present.
+CREATE TABLE IF NOT EXISTS diagnoses (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    site_id INTEGER NOT NULL,
+    version_id INTEGER NOT NULL,
+    symptom_mask INTEGER NOT NULL,
+    top_disease_id INTEGER NOT NULL,
+    top_fts REAL,
+    scores TEXT NOT NULL
+);
+-- Covers the partial-bucket edges of the aggregation queries without touching the table
+CREATE INDEX IF NOT EXISTS diagnoses_time ON diagnoses (ts, site_id, top_disease_id, symptom_mask);
+
+-- Rollups per bucket of span seconds (DISEASE_SPANS, PAIR_SPANS), maintained in the same
+-- transaction as the diagnoses they count. Bucket n covers [n * span, (n + 1) * span).
+CREATE TABLE IF NOT EXISTS disease_rollup (
+    span INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    site_id INTEGER NOT NULL,
+    disease_id INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (span, bucket, site_id, disease_id)
+) WITHOUT ROWID;
+-- Diagnoses with both symptom bits a <= b; a = b counts diagnoses with that symptom
+CREATE TABLE IF NOT EXISTS symptom_pair_rollup (
+    span INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    site_id INTEGER NOT NULL,
+    a INTEGER NOT NULL,
+    b INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (span, bucket, site_id, a, b)
+) WITHOUT ROWID;
+"""
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # WAL with synchronous=NORMAL stays consistent on a crash and may only lose the last commits
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def mask_bits(masks, n_bits):
+    """(rows x n_bits) 0/1 float matrix of the bits set in each mask (float for a BLAS bits.T @ bits)."""
+    masks = np.asarray(masks, dtype=np.int64)
+    return ((masks[:, None] >> np.arange(n_bits, dtype=np.int64)) & 1).astype(np.float64)
+
+
+def cover(start, end, spans):
+    """
+    Splits [start, end) into runs of whole epoch-aligned buckets, longest span first.
+    Returns ([(span, first bucket, end bucket)], [(start, end) edges no bucket covers]).
+    """
+    runs = []
+
+    def split(low, high, spans):
+        if low >= high:
+            return []
+        if not spans:
+            return [(low, high)]
+        span = spans[0]
+        first, last = math.ceil(low / span), math.floor(high / span)
+        if first >= last:
+            return split(low, high, spans[1:])
+        runs.append((span, first, last))
+        return split(low, first * span, spans[1:]) + split(last * span, high, spans[1:])
+
+    edges = split(start, end, sorted(spans, reverse=True))
+    return runs, edges
+
+
+# ==========================================
+# History Store
+# ==========================================
+
+class HistoryStore:
+    """
+    Diagnosis history in a SQLite database (WAL mode) written by a background thread.
+
+    record() only queues the diagnosis, so it adds no measurable latency to the caller.
+    The writer collects up to WRITE_BATCH_ROWS diagnoses (or whatever arrives within
+    FLUSH_INTERVAL) and writes them in one transaction. That transaction also updates two
+    rollups: top-disease counts per site and hour/day/30 days, and symptom pair counts per
+    site and day/30 days. The aggregation queries read whole buckets from the rollups and
+    only the partial buckets at the window edges from the diagnoses index, so their cost
+    depends on the window and bucket lengths, not on the number of diagnoses.
+
+    Times are Unix seconds and buckets are aligned to UTC. Symptom bits are assigned by
+    the store on first use, so masks stay comparable when the model's columns change.
+    """
+
+    def __init__(self, path=HISTORY_FILE, site="", batch_rows=WRITE_BATCH_ROWS, flush_interval=FLUSH_INTERVAL,
+                 max_pending=MAX_PENDING):
+        self.path = path
+        self.site = site
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.pending = queue.Queue(max_pending)
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.write_seconds = 0.0
+        self._local = threading.local()
+
+        conn = connect(path)
+        conn.executescript(SCHEMA)
+        conn.close()
+        # Name -> id lookups, only used (and extended) by the thread that writes
+        self._ids = None
+
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ------------------------------------------
+    # Writing
+    # ------------------------------------------
+
+    def record(self, symptoms, results, version=None, timestamp=None, site=None):
+        """
+        Queues one diagnosis: the symptom names, the result list from diagnose() and the
+        engine's version dict. Returns False if it was dropped because the writer is
+        MAX_PENDING diagnoses behind. An empty symptom set is recorded too (symptom mask 0,
+        healthy), as audits need every diagnosis and rates need the healthy ones.
+        """
+        if not symptoms and not results:
+            results = healthy_result()
+        row = (time.time() if timestamp is None else timestamp, symptoms, results, version,
+               self.site if site is None else site)
+        try:
+            self.pending.put_nowait(row)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def flush(self):
+        """Blocks until every diagnosis queued so far is written."""
+        self.pending.join()
+
+    def close(self):
+        """Writes what is queued and stops the writer."""
+        if self._thread.is_alive():
+            self.pending.put(None)
+            self._thread.join()
+
+    def _run(self):
+        conn = connect(self.path)
+        stop = False
+        while not stop:
+            item = self.pending.get()
+            if item is None:
+                self.pending.task_done()
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_rows:
+                try:
+                    item = self.pending.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.pending.task_done()
+                    stop = True
+                    break
+                batch.append(item)
+
+            try:
+                start = time.perf_counter()
+                self.write_rows(batch, conn)
+                self.write_seconds += time.perf_counter() - start
+                self.batches += 1
+                if metrics.enabled:
+                    metrics.observe("history_write", time.perf_counter() - start)
+            except Exception as e:
+                print(f"Error writing {len(batch)} diagnoses to {self.path}: {e}")
+            finally:
+                for _ in batch:
+                    self.pending.task_done()
+        conn.close()
+
+    def _load_ids(self, conn):
+        ids = {"symptoms": {}, "diseases": {}, "sites": {}, "versions": {}}
+        for table, key in (("symptoms", "bit"), ("diseases", "id"), ("sites", "id")):
+            ids[table] = {name: i for i, name in conn.execute(f"SELECT {key}, name FROM {table}")}
+        versions = conn.execute("SELECT id, model, rules FROM versions")
+        ids["versions"] = {(model, rules): i for i, model, rules in versions}
+        return ids
+
+    def _id(self, conn, table, name):
+        ids = self._ids[table]
+        if name not in ids:
+            if table == "symptoms":
+                if len(ids) >= MAX_SYMPTOM_BITS:
+                    raise ValueError(f"More than {MAX_SYMPTOM_BITS} distinct symptoms do not fit the bitmask")
+                ids[name] = len(ids)
+                conn.execute("INSERT INTO symptoms (bit, name) VALUES (?, ?)", (ids[name], name))
+            elif table == "versions":
+                ids[name] = conn.execute("INSERT INTO versions (model, rules) VALUES (?, ?)", name).lastrowid
+            else:
+                ids[name] = conn.execute(f"INSERT INTO {table} (name) VALUES (?)", (name,)).lastrowid
+        return ids[name]
+
+    def write_rows(self, rows, conn=None):
+        """
+        Writes (timestamp, symptoms, results, version, site) rows and their rollups in one
+        transaction on the calling thread. The writer thread uses it for each batch; bulk
+        imports may call it directly with a connection of their own.
+        """
+        own = conn is None
+        conn = connect(self.path) if own else conn
+        try:
+            with conn:
+                if self._ids is None or own:
+                    self._ids = self._load_ids(conn)
+                records = []
+                disease_counts = Counter()
+                symptom_bits = self._ids["symptoms"]
+                disease_ids = self._ids["diseases"]
+                for timestamp, symptoms, results, version, site in rows:
+                    mask = 0
+                    for symptom in symptoms:
+                        bit = symptom_bits.get(symptom)
+                        mask |= 1 << (self._id(conn, "symptoms", symptom) if bit is None else bit)
+                    scores = []
+                    for r in results:
+                        disease_id = disease_ids.get(r["disease"]) or self._id(conn, "diseases", r["disease"])
+                        scores.append(f"[{disease_id},{r['ml_conf']:.2f},{r['clips_conf']:.2f},{r['fts']:.2f}]")
+                    if results:
+                        top_id, top_fts = disease_ids[results[0]["disease"]], results[0]["fts"]
+                    else:
+                        top_id, top_fts = self._id(conn, "diseases", NO_MATCH), None
+                    version = version or {}
+                    version_id = self._id(conn, "versions", (str(version.get("model") or ""),
+                                                             str(version.get("rules") or "")))
+                    site_id = self._id(conn, "sites", site)
+                    records.append((timestamp, site_id, version_id, mask, top_id, top_fts, f"[{','.join(scores)}]"))
+                    for span in DISEASE_SPANS:
+                        disease_counts[span, int(timestamp // span), site_id, top_id] += 1
+
+                conn.executemany("INSERT INTO diagnoses (ts, site_id, version_id, symptom_mask, top_disease_id, "
+                                 "top_fts, scores) VALUES (?, ?, ?, ?, ?, ?, ?)", records)
+                conn.executemany("INSERT INTO disease_rollup VALUES (?, ?, ?, ?, ?) ON CONFLICT (span, bucket, "
+                                 "site_id, disease_id) DO UPDATE SET count = count + excluded.count",
+                                 [(*key, n) for key, n in disease_counts.items()])
+                conn.executemany("INSERT INTO symptom_pair_rollup VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (span, "
+                                 "bucket, site_id, a, b) DO UPDATE SET count = count + excluded.count",
+                                 self._pair_counts(records))
+        except Exception:
+            # Ids handed out in the rolled-back transaction do not exist
+            self._ids = None
+            raise
+        finally:
+            if own:
+                conn.close()
+        self.written += len(rows)
+
+    def _pair_counts(self, records):
+        """(span, bucket, site_id, a, b, count) rollup rows for the symptom pairs a <= b in the records."""
+        if not records:
+            return []
+        n_bits = len(self._ids["symptoms"])
+        upper = np.triu(np.ones((n_bits, n_bits), dtype=bool))
+        masks = np.array([record[3] for record in records], dtype=np.int64)
+        timestamps = np.array([record[0] for record in records], dtype=np.float64)
+        site_ids = np.array([record[1] for record in records], dtype=np.int64)
+
+        # Count each (day, site) group once, then add the days up into the longer spans
+        shortest = min(PAIR_SPANS)
+        keys = np.stack([timestamps // shortest, site_ids], axis=1).astype(np.int64)
+        groups, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        pairs = Counter()
+        for g, (bucket, site_id) in enumerate(groups):
+            bits = mask_bits(masks[inverse == g], n_bits)
+            counts = np.rint(bits.T @ bits).astype(np.int64)
+            a_bits, b_bits = np.nonzero(upper & (counts > 0))
+            start = int(bucket) * shortest
+            for span in PAIR_SPANS:
+                key = (span, start // span, int(site_id))
+                for a, b in zip(a_bits.tolist(), b_bits.tolist()):
+                    pairs[(*key, a, b)] += int(counts[a, b])
+        return [(*key, n) for key, n in pairs.items()]
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "written": self.written,
+            "pending": self.pending.qsize(),
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "write_ms_per_batch": self.write_seconds * 1000 / self.batches if self.batches else 0.0,
+        }
+
+    # ------------------------------------------
+    # Queries
+    # ------------------------------------------
+
+    def _reader(self):
+        """A connection for the calling thread (WAL readers never block the writer)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect(self.path)
+        return conn
+
+    def _names(self, table):
+        key = "bit" if table == "symptoms" else "id"
+        return dict(self._reader().execute(f"SELECT {key}, name FROM {table}"))
+
+    def _site_filter(self, site):
+        """(SQL condition, params) restricting a query to one site, or ("", ()) for all sites."""
+        if site is None:
+            return "", ()
+        return " AND site_id = (SELECT id FROM sites WHERE name = ?)", (site,)
+
+    def _disease_counter(self, start, end, bucket=None, site=None):
+        """
+        Counter of (bucket start, disease id) -> diagnoses in [start, end), with bucket=None
+        one total per disease (keyed by start).
+        """
+        conn = self._reader()
+        condition, params = self._site_filter(site)
+        # A rollup bucket can only be used whole when it lies inside a single output bucket
+        spans = DISEASE_SPANS if bucket is None else [span for span in DISEASE_SPANS if bucket % span == 0]
+        runs, edges = cover(start, end, spans)
+        counts = Counter()
+        for span, first, last in runs:
+            for b, disease_id, n in conn.execute(
+                    f"SELECT CAST(bucket * {span} / ? AS INTEGER), disease_id, SUM(count) FROM disease_rollup "
+                    f"WHERE span = ? AND bucket >= ? AND bucket < ?{condition} GROUP BY 1, 2",
+                    (bucket or 1 << 62, span, first, last, *params)):
+                counts[start if bucket is None else b * bucket, disease_id] += n
+        for low, high in edges:
+            for b, disease_id, n in conn.execute(
+                    f"SELECT CAST(ts / ? AS INTEGER), top_disease_id, COUNT(*) FROM diagnoses "
+                    f"WHERE ts >= ? AND ts < ?{condition} GROUP BY 1, 2", (bucket or 1 << 62, low, high, *params)):
+                counts[start if bucket is None else b * bucket, disease_id] += n
+        return counts
+
+    def disease_counts(self, start, end, bucket=DAY, site=None):
+        """
+        Top-disease counts per bucket in [start, end): {bucket start: {disease: count}}.
+        Buckets are epoch-aligned; lengths that are whole hours are read from the rollups.
+        """
+        diseases = self._names("diseases")
+        table = {}
+        for (b, disease_id), n in sorted(self._disease_counter(start, end, bucket, site).items()):
+            table.setdefault(b, {})[diseases[disease_id]] = n
+        return table
+
+    def disease_totals(self, start, end, site=None):
+        """Top-disease counts over the whole of [start, end): {disease: count}."""
+        diseases = self._names("diseases")
+        counts = self._disease_counter(start, end, None, site)
+        return {diseases[disease_id]: n for (_, disease_id), n in counts.most_common()}
+
+    def symptom_cooccurrence(self, start, end, site=None, symptom=None, top=20):
+        """
+        The symptom pairs seen together most often in [start, end), optionally only pairs
+        with the given symptom. Each row has the count, the share of diagnoses with both
+        (support) and the lift: how much more often they co-occur than if independent.
+        """
+        conn = self._reader()
+        condition, params = self._site_filter(site)
+        names = self._names("symptoms")
+        n_bits = len(names)
+        bit = None
+        if symptom is not None:
+            bit = {name: i for i, name in names.items()}.get(symptom)
+            if bit is None:
+                return []
+
+        counts = np.zeros((n_bits, n_bits), dtype=np.int64)
+        runs, edges = cover(start, end, PAIR_SPANS)
+        for span, first, last in runs:
+            for a, b, n in conn.execute(
+                    f"SELECT a, b, SUM(count) FROM symptom_pair_rollup WHERE span = ? AND bucket >= ? "
+                    f"AND bucket < ?{condition} GROUP BY a, b", (span, first, last, *params)):
+                counts[a, b] += n
+        for low, high in edges:
+            masks = [mask for mask, in conn.execute(
+                f"SELECT symptom_mask FROM diagnoses WHERE ts >= ? AND ts < ?{condition}", (low, high, *params))]
+            if masks:
+                bits = mask_bits(masks, n_bits)
+                counts += np.triu(np.rint(bits.T @ bits).astype(np.int64))
+
+        total = sum(self.disease_totals(start, end, site).values())
+        singles = np.diag(counts)
+        rows = []
+        for a, b in zip(*np.nonzero(np.triu(counts, 1))):
+            if bit is not None and bit not in (a, b):
+                continue
+            n = int(counts[a, b])
+            rows.append({"symptoms": (names[a], names[b]), "count": n, "support": n / total,
+                         "lift": n * total / (singles[a] * singles[b])})
+        rows.sort(key=lambda row: (-row["count"], row["symptoms"]))
+        return rows[:top]
+
+    def outbreaks(self, end=None, window=OUTBREAK_WINDOW, baseline_windows=OUTBREAK_BASELINE_WINDOWS,
+                  ratio=OUTBREAK_RATIO, min_count=OUTBREAK_MIN_COUNT, site=None):
+        """
+        Diseases diagnosed at least ratio times as often in the window ending at end as in
+        the mean of the baseline_windows before it, most increased first.
+        """
+        end = time.time() if end is None else end
+        start = end - window * (baseline_windows + 1)
+        per_window = Counter()
+        for offset in range(baseline_windows + 1):
+            low = start + offset * window
+            for disease, n in self.disease_totals(low, low + window, site).items():
+                per_window[disease, offset] += n
+
+        found = []
+        for disease in {disease for disease, _ in per_window}:
+            if disease in (NO_MATCH, "healthy"):
+                continue
+            current = per_window[disease, baseline_windows]
+            baseline = sum(per_window[disease, offset] for offset in range(baseline_windows)) / baseline_windows
+            if current >= min_count and current >= ratio * max(baseline, 1.0):
+                found.append({"disease": disease, "count": current, "baseline": baseline,
+                              "ratio": current / max(baseline, 1.0)})
+        found.sort(key=lambda row: -row["ratio"])
+        return found
+
+    def recent(self, limit=20, site=None):
+        """The latest diagnoses, newest first, decoded for audits."""
+        condition, params = self._site_filter(site)
+        diseases = self._names("diseases")
+        symptoms = self._names("symptoms")
+        sites = self._names("sites")
+        rows = []
+        for ts, site_id, model, rules, mask, scores in self._reader().execute(
+                f"SELECT ts, site_id, model, rules, symptom_mask, scores FROM diagnoses "
+                f"JOIN versions ON versions.id = version_id WHERE 1{condition} ORDER BY ts DESC LIMIT ?",
+                (*params, limit)):
+            rows.append({
+                "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts)),
+                "site": sites[site_id],
+                "version": {"model": model, "rules": rules},
+                "symptoms": [name for bit, name in sorted(symptoms.items()) if mask >> bit & 1],
+                "results": [{"disease": diseases[d], "ml_conf": ml, "clips_conf": cf, "fts": fts}
+                            for d, ml, cf, fts in json.loads(scores)],
+            })
+        return rows
+
+
+# ==========================================
+# Benchmark
+# ==========================================
+
+def synthetic_pool(engine, size=BENCHMARK_POOL, seed=42):
+    """Distinct symptom sets near the CSV rows (some symptoms missed, some extra) and their diagnoses."""
+    import pandas as pd
+
+    data = pd.read_csv(CSV_FILE)
+    columns = engine.symptom_columns
+    rows = [[s for s in columns if s in data.columns and row[s] == 1] for _, row in data.iterrows()]
+    rng = random.Random(seed)
+    pool = {}
+    while len(pool) < size:
+        symptoms = {s for s in rng.choice(rows) if rng.random() > 0.2}
+        while rng.random() < 0.5:
+            symptoms.add(rng.choice(columns))
+        if symptoms:
+            pool.setdefault(tuple(engine.normalize(symptoms)), None)
+    symptom_sets = [list(symptoms) for symptoms in pool]
+    return symptom_sets, engine.diagnose_batch(symptom_sets)
+
+
+def median_ms(function, repeats=BENCHMARK_REPEATS):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples) * 1000), result
+
+
+def benchmark(n_rows=BENCHMARK_ROWS, path=None, days=BENCHMARK_DAYS, sites=BENCHMARK_SITES, seed=42):
+    """
+    Fills a history with n_rows synthetic diagnoses over days (with a two-week outbreak of
+    one disease at one site), then times record() against diagnose(), the writer's
+    throughput, and the aggregation queries against the same queries on the raw rows.
+    """
+    engine = DiagnosisEngine(ml_backend="flat", rules_backend="compiled", quiet=True)
+    symptom_sets, pool_results = synthetic_pool(engine)
+    tops = Counter(results[0]["disease"] for results in pool_results if results)
+    outbreak_disease = tops.most_common(3)[-1][0]
+    outbreak_pool = [i for i, results in enumerate(pool_results)
+                     if results and results[0]["disease"] == outbreak_disease]
+    site_names = [f"greenhouse-{i + 1}" for i in range(sites)]
+
+    tmp = None
+    if path is None:
+        tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(tmp.name, "history.db")
+    store = HistoryStore(path)
+    now = math.floor(time.time() / DAY) * DAY + 0.37 * DAY
+    start = now - days * DAY
+    outbreak = (now - 14 * DAY, now, site_names[-1])
+
+    # Bulk fill, timestamps in order as a live history would be written
+    rng = np.random.default_rng(seed)
+    chunk = 100_000
+    fill_start = time.perf_counter()
+    conn = connect(path)
+    for offset in range(0, n_rows, chunk):
+        n = min(chunk, n_rows - offset)
+        times = start + (offset + np.arange(n) + rng.random(n)) * (now - start) / n_rows
+        picks = rng.integers(len(symptom_sets), size=n)
+        site_ids = rng.integers(sites, size=n)
+        in_outbreak = (times >= outbreak[0]) & (site_ids == sites - 1) & (rng.random(n) < 0.3)
+        picks[in_outbreak] = rng.choice(outbreak_pool, size=int(in_outbreak.sum()))
+        versions = [engine.version, {**engine.version, "rules": "previous"}]
+        store.write_rows([(float(t), symptom_sets[p], pool_results[p], versions[int(t < now - days * DAY / 2)],
+                           site_names[s]) for t, p, s in zip(times, picks, site_ids)], conn)
+    conn.close()
+    fill_seconds = time.perf_counter() - fill_start
+    size_mb = sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix)) / 1e6
+    print(f"Filled {n_rows:,} diagnoses in {fill_seconds:.1f} s ({n_rows / fill_seconds:,.0f}/s), "
+          f"{size_mb:,.0f} MB")
+
+    # Logging cost on the diagnosis path: record() only enqueues
+    live = 20_000
+    record_start = time.perf_counter()
+    for i in range(live):
+        store.record(symptom_sets[i % len(symptom_sets)], pool_results[i % len(symptom_sets)], engine.version,
+                     timestamp=now + i * 0.001, site=site_names[0])
+    record_us = (time.perf_counter() - record_start) / live * 1e6
+    flush_start = time.perf_counter()
+    store.flush()
+    flush_seconds = time.perf_counter() - flush_start
+    diagnose_us = median_ms(lambda: [engine.diagnose(symptom_sets[i]) for i in range(200)])[0] / 200 * 1000
+    print(f"record(): {record_us:.1f} us per diagnosis vs {diagnose_us:.0f} us for diagnose() "
+          f"({record_us / diagnose_us:.1%}); writer drained {live:,} in {flush_seconds:.2f} s, "
+          f"{store.dropped} dropped")
+
+    # Queries: rollups vs the raw rows, over windows whose edges fall mid-bucket
+    conn = store._reader()
+    end = now - 0.25 * DAY
+    print(f"{'query':>34} {'indexed':>10} {'raw scan':>10}")
+    for label, window, bucket in (("counts, 1 day by hour", DAY, HOUR), ("counts, 30 days by day", 30 * DAY, DAY),
+                                  ("counts, 365 days by day", 365 * DAY, DAY)):
+        low = end - window
+        fast_ms, fast = median_ms(lambda: store.disease_counts(low, end, bucket))
+        raw_ms, raw = median_ms(lambda: conn.execute(
+            "SELECT CAST(ts / ? AS INTEGER), top_disease_id, COUNT(*) FROM diagnoses NOT INDEXED "
+            "WHERE ts >= ? AND ts < ? GROUP BY 1, 2", (bucket, low, end)).fetchall(), repeats=1)
+        same = sum(n for per in fast.values() for n in per.values()) == sum(n for _, _, n in raw)
+        print(f"{label:>34} {fast_ms:8.1f}ms {raw_ms:8.0f}ms {'ok' if same else 'MISMATCH'}")
+
+    for label, window in (("co-occurrence, 7 days", 7 * DAY), ("co-occurrence, 365 days", 365 * DAY)):
+        low = end - window
+        fast_ms, fast = median_ms(lambda: store.symptom_cooccurrence(low, end, top=10))
+
+        def raw_pairs():
+            masks = [m for m, in conn.execute("SELECT symptom_mask FROM diagnoses NOT INDEXED "
+                                              "WHERE ts >= ? AND ts < ?", (low, end))]
+            n_bits = len(store._names("symptoms"))
+            counts = np.zeros((n_bits, n_bits), dtype=np.int64)
+            for i in range(0, len(masks), 1_000_000):
+                bits = mask_bits(masks[i:i + 1_000_000], n_bits)
+                counts += np.rint(bits.T @ bits).astype(np.int64)
+            return counts
+
+        raw_ms, raw = median_ms(raw_pairs, repeats=1)
+        names = {name: i for i, name in store._names("symptoms").items()}
+        same = all(raw[names[a], names[b]] == row["count"] for row in fast for a, b in [row["symptoms"]])
+        print(f"{label:>34} {fast_ms:8.1f}ms {raw_ms:8.0f}ms {'ok' if same else 'MISMATCH'}")
+
+    found_ms, found = median_ms(lambda: store.outbreaks(now, site=outbreak[2]))
+    rising = ", ".join(f"{row['disease']} x{row['ratio']:.1f}" for row in found) or "none"
+    print(f"outbreaks() at {outbreak[2]} in {found_ms:.1f} ms: {rising} (injected: {outbreak_disease})")
+
+    store.close()
+    if tmp is not None:
+        tmp.cleanup()
+    return found
+
+
+def print_table(counts):
+    for bucket_start, per_disease in counts.items():
+        top = ", ".join(f"{disease} {n}" for disease, n in sorted(per_disease.items(), key=lambda item: -item[1]))
+        print(f"{time.strftime('%Y-%m-%d %H:%M', time.gmtime(bucket_start))}  {top}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Diagnosis history: audits, outbreak queries and benchmark.")
+    parser.add_argument("--db", default=HISTORY_FILE, help="history database")
+    parser.add_argument("--site", help="only this site's diagnoses")
+    parser.add_argument("--recent", type=int, metavar="N", help="show the latest N diagnoses")
+    parser.add_argument("--counts", type=float, metavar="DAYS", help="top-disease counts per day over the last DAYS")
+    parser.add_argument("--cooccurrence", type=float, metavar="DAYS", help="symptom pairs over the last DAYS")
+    parser.add_argument("--outbreaks", action="store_true", help="diseases rising over the last week")
+    parser.add_argument("--benchmark", action="store_true", help="time writes and queries on a synthetic history")
+    parser.add_argument("--rows", type=int, default=BENCHMARK_ROWS, help="benchmark history size")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        # The default --db is the real history; the benchmark only writes to a path given explicitly
+        benchmark(args.rows, None if args.db == HISTORY_FILE else args.db)
+    else:
+        history = HistoryStore(args.db)
+        today = time.time()
+        if args.recent:
+            for entry in history.recent(args.recent, args.site):
+                print(json.dumps(entry))
+        if args.counts:
+            print_table(history.disease_counts(today - args.counts * DAY, today, DAY, args.site))
+        if args.cooccurrence:
+            for pair in history.symptom_cooccurrence(today - args.cooccurrence * DAY, today, args.site):
+                print(f"{' + '.join(pair['symptoms']):>50}  {pair['count']:8,}  lift {pair['lift']:.2f}")
+        if args.outbreaks:
+            for rising in history.outbreaks(today, site=args.site):
+                print(f"{rising['disease']}: {rising['count']} this week vs {rising['baseline']:.1f} "
+                      f"(x{rising['ratio']:.1f})")
+        history.close()
@@ -0,0 +1,280 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+# ==========================================
+# Configuration
+# ==========================================
+# Histogram bucket upper bounds in seconds (Prometheus "le" labels)
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+COUNTERS = ("diagnoses", "symptoms_asserted", "rules_fired", "facts_scanned", "slow_diagnoses")
+METRIC_PREFIX = "tomato_diagnosis"
+
+# Environment switches, so the GUI and scripts can be instrumented without code changes
+ENABLE_ENV = "TOMATO_METRICS"  # "1" enables the spans and counters
+SLOW_MS_ENV = "TOMATO_SLOW_MS"  # slow-diagnosis threshold in milliseconds
+SLOW_LOG_ENV = "TOMATO_SLOW_LOG"  # JSON-lines file for slow diagnoses (default: stderr)
+
+
+# ==========================================
+# Spans
+# ==========================================
+# Stages recorded on the diagnosis path:
+#   diagnose         whole DiagnosisEngine.diagnose_batch / diagnose_matrix call
+#   normalize        symptom name validation
+#   encode           building the 0/1 input matrix
+#   predict_proba    the random forest
+#   compiled_rules   NumPy rule evaluation (compiled backend)
+#   clips_reset, clips_assert, clips_run, clips_fact_scan   get_clips_diagnosis() steps
+#   fusion           FTS fusion and sorting
+#   gui_diagnose, gui_render   the Tkinter handler and its Treeview updates
+
+class _NullSpan:
+    """Returned by Metrics.span() while disabled: entering and leaving it does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        local = self.metrics._local
+        self.outermost = not getattr(local, "depth", 0)
+        if self.outermost:
+            # Per-thread breakdown of the current top-level call, used by the slow log
+            local.trace = {"stages": {}, "counters": {}}
+        local.depth = getattr(local, "depth", 0) + 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        metrics = self.metrics
+        local = metrics._local
+        local.depth -= 1
+        stages = local.trace["stages"]
+        stages[self.stage] = stages.get(self.stage, 0.0) + seconds
+        metrics.observe(self.stage, seconds)
+
+        if self.outermost and metrics.slow_ms is not None and seconds * 1000 >= metrics.slow_ms:
+            metrics._log_slow(self.stage, seconds, local.trace)
+        return False
+
+
+# ==========================================
+# Metrics Registry
+# ==========================================
+
+class Metrics:
+    """
+    Thread-safe stage timings (histograms) and counters for the diagnosis path.
+
+    Disabled by default: span() then hands back a shared no-op context manager and the
+    instrumented code guards its counter updates with `if metrics.enabled`, so an
+    uninstrumented run pays one attribute check per stage.
+
+    With slow_ms set, every top-level span (a diagnose call, or the GUI handler around it)
+    that takes at least slow_ms milliseconds is written as one JSON line, with its per-stage
+    breakdown and counters, to slow_log (a path) or stderr.
+    """
+
+    def __init__(self, enabled=False, slow_ms=None, slow_log=None, buckets=BUCKETS):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.slow_log = slow_log
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def enable(self, slow_ms=None, slow_log=None):
+        self.slow_ms = slow_ms
+        self.slow_log = slow_log
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}  # stage -> [count, sum_seconds, max_seconds, per-bucket counts]
+            self.counters = dict.fromkeys(COUNTERS, 0)
+            self.started_at = time.time()
+
+    def span(self, stage):
+        """Context manager timing one stage; a no-op while disabled."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, stage)
+
+    def observe(self, stage, seconds):
+        bucket = 0
+        while bucket < len(self.buckets) and seconds > self.buckets[bucket]:
+            bucket += 1
+        with self._lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                entry = self.stages[stage] = [0, 0.0, 0.0, [0] * (len(self.buckets) + 1)]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            entry[3][bucket] += 1
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+        trace = getattr(self._local, "trace", None)
+        if trace is not None and getattr(self._local, "depth", 0):
+            trace["counters"][name] = trace["counters"].get(name, 0) + n
+
+    def _log_slow(self, stage, seconds, trace):
+        self.count("slow_diagnoses")
+        record = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "span": stage,
+            "ms": seconds * 1000,
+            "threshold_ms": self.slow_ms,
+            "stages_ms": {name: s * 1000 for name, s in trace["stages"].items()},
+            "counters": trace["counters"],
+        }
+        line = json.dumps(record) + "\n"
+        try:
+            if self.slow_log:
+                with self._lock, open(self.slow_log, "a", encoding="utf-8") as f:
+                    f.write(line)
+            else:
+                sys.stderr.write(line)
+        except OSError as e:
+            print(f"Warning: could not write slow-diagnosis log: {e}")
+
+    # ==========================================
+    # Export
+    # ==========================================
+
+    def snapshot(self):
+        """JSON-serialisable view of every stage histogram and counter."""
+        with self._lock:
+            stages = {}
+            for stage, (count, total, peak, bucket_counts) in sorted(self.stages.items()):
+                stages[stage] = {
+                    "count": count,
+                    "sum_ms": total * 1000,
+                    "mean_ms": total / count * 1000 if count else 0.0,
+                    "max_ms": peak * 1000,
+                    "buckets": {("+Inf" if i == len(self.buckets) else repr(self.buckets[i])): n
+                                for i, n in enumerate(bucket_counts)},
+                }
+            return {
+                "enabled": self.enabled,
+                "slow_ms": self.slow_ms,
+                "uptime_seconds": time.time() - self.started_at,
+                "stages": stages,
+                "counters": dict(self.counters),
+            }
+
+    def prometheus(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = [f"# HELP {METRIC_PREFIX}_stage_seconds Wall time per diagnosis stage.",
+                 f"# TYPE {METRIC_PREFIX}_stage_seconds histogram"]
+        with self._lock:
+            for stage, (count, total, _, bucket_counts) in sorted(self.stages.items()):
+                cumulative = 0
+                for i, n in enumerate(bucket_counts):
+                    cumulative += n
+                    le = "+Inf" if i == len(self.buckets) else repr(self.buckets[i])
+                    lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {total!r}')
+                lines.append(f'{METRIC_PREFIX}_stage_seconds_count{{stage="{stage}"}} {count}')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {METRIC_PREFIX}_{name}_total counter")
+                lines.append(f"{METRIC_PREFIX}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+
+def from_environment():
+    """A Metrics registry configured from TOMATO_METRICS / TOMATO_SLOW_MS / TOMATO_SLOW_LOG."""
+    slow_ms = os.environ.get(SLOW_MS_ENV)
+    return Metrics(enabled=os.environ.get(ENABLE_ENV, "") not in ("", "0"),
+                   slow_ms=float(slow_ms) if slow_ms else None,
+                   slow_log=os.environ.get(SLOW_LOG_ENV) or None)
+
+
+# The process-wide registry the engine, CLIPS helpers, GUI and service report to
+metrics = from_environment()
+
+
+# ==========================================
+# Overhead Check
+# ==========================================
+
+def measure_overhead(queries=2000, repeats=5):
+    """
+    Median per-diagnosis time with metrics disabled and enabled, on the default (sklearn +
+    CLIPS) and fast (flat + compiled) engines. Returns {engine: {"disabled_ms", "enabled_ms"}}.
+    """
+    import random
+
+    from diagnosis_engine import DiagnosisEngine
+
+    was_enabled = metrics.enabled
+    results = {}
+    for name, options in (("sklearn_clips", {}), ("flat_compiled", {"ml_backend": "flat",
+                                                                     "rules_backend": "compiled"})):
+        engine = DiagnosisEngine(quiet=True, **options)
+        rng = random.Random(42)
+        workload = [rng.sample(engine.symptom_columns, rng.randint(1, 6)) for _ in range(queries)]
+        n = queries if name == "flat_compiled" else queries // 10
+        timings = {"disabled_ms": [], "enabled_ms": []}
+        for _ in range(repeats):
+            for key, enabled in (("disabled_ms", False), ("enabled_ms", True)):
+                metrics.enabled = enabled
+                start = time.perf_counter()
+                for symptoms in workload[:n]:
+                    engine.diagnose(symptoms)
+                timings[key].append((time.perf_counter() - start) / n * 1000)
+        results[name] = {key: sorted(samples)[len(samples) // 2] for key, samples in timings.items()}
+
+    metrics.enabled = was_enabled
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exercise the diagnosis metrics and print an export.")
+    parser.add_argument("--queries", type=int, default=200, help="random diagnoses to record")
+    parser.add_argument("--format", choices=("prometheus", "json"), default="prometheus")
+    parser.add_argument("--slow-ms", type=float, help="log diagnoses slower than this to stderr")
+    parser.add_argument("--overhead", action="store_true", help="compare disabled vs enabled per-call time")
+    args = parser.parse_args()
+
+    # Run as a script this file is __main__; the engine reports to the imported module's registry
+    from diagnosis_metrics import measure_overhead, metrics
+
+    if args.overhead:
+        for engine_name, row in measure_overhead().items():
+            print(f"{engine_name:>14}: disabled {row['disabled_ms']:.4f} ms  enabled {row['enabled_ms']:.4f} ms  "
+                  f"(+{(row['enabled_ms'] / row['disabled_ms'] - 1) * 100:.1f}%)")
+        raise SystemExit(0)
+
+    import random
+
+    from diagnosis_engine import DiagnosisEngine
+
+    metrics.enable(slow_ms=args.slow_ms)
+    demo_engine = DiagnosisEngine(quiet=True)
+    demo_rng = random.Random(42)
+    for _ in range(args.queries):
+        demo_engine.diagnose(demo_rng.sample(demo_engine.symptom_columns, demo_rng.randint(1, 6)))
+    print(metrics.prometheus() if args.format == "prometheus" else json.dumps(metrics.snapshot(), indent=2))
@@ -0,0 +1,399 @@
+import argparse
+import asyncio
+import json
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from diagnosis_history import HISTORY_FILE, HistoryStore
+from diagnosis_metrics import metrics
+from hot_reload import ReloadableEngine
+
+# ==========================================
+# Configuration
+# ==========================================
+HOST = "127.0.0.1"
+PORT = 8080
+
+# Requests arriving within BATCH_WINDOW_MS of the first queued one share a predict_proba call
+BATCH_WINDOW_MS = 5.0
+MAX_BATCH_SIZE = 64
+# A batch is closed early when waiting longer would push its oldest request past this budget
+LATENCY_BUDGET_MS = 50.0
+
+MAX_BODY_BYTES = 64 * 1024
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict",
+           413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+def with_info(results, disease_info):
+    """Adds the treatment/prevention text to each diagnosis row."""
+    rows = []
+    for result in results:
+        info = disease_info.get(result["disease"], {"treatment": "-", "prevention": "-"})
+        rows.append({**result, "treatment": info["treatment"], "prevention": info["prevention"]})
+    return rows
+
+
+# ==========================================
+# Micro-Batching
+# ==========================================
+
+class BatchError(Exception):
+    """The engine failed a batch: a server-side error, whatever the original exception type."""
+
+
+class MicroBatcher:
+    """
+    Merges concurrent diagnosis requests into batched engine.diagnose_batch() calls.
+
+    The first queued request opens a batch; it closes once MAX_BATCH_SIZE requests are
+    collected, the window elapses, or the oldest request's wait plus the expected batch
+    time would exceed the latency budget. Batches run one at a time on a worker thread,
+    so the engine (and its CLIPS environment) is never used concurrently; with a prefork
+    pool as the engine, up to concurrency batches run at once, one per worker process.
+
+    submit() validates the symptoms before queueing them, so bad input raises ValueError
+    there; anything raised by the engine for a batch reaches its requests as BatchError.
+    """
+
+    def __init__(self, engine, window_ms=BATCH_WINDOW_MS, max_batch_size=MAX_BATCH_SIZE,
+                 latency_budget_ms=LATENCY_BUDGET_MS, concurrency=1):
+        self.engine = engine
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.latency_budget = latency_budget_ms / 1000
+        self.queue = asyncio.Queue()
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="diagnosis")
+        self._task = None
+        self._slots = None
+        self._batches = set()
+
+        # Exponential moving average of batch processing time, used against the budget
+        self.batch_time = 0.0
+        self.batches = 0
+        self.requests = 0
+        self.largest_batch = 0
+
+    def start(self):
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._batches:
+            await asyncio.gather(*self._batches, return_exceptions=True)
+        self.executor.shutdown(wait=True)
+
+    async def submit(self, symptoms):
+        """
+        Queues one symptom set and waits for its diagnosis. Returns (results, version,
+        disease_info), the last two from the same engine as the results even across a reload.
+        """
+        symptoms = self.engine.normalize(symptoms)  # reject bad input before it can fail a batch
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((time.perf_counter(), symptoms, future))
+        return await future
+
+    async def _collect(self):
+        first = await self.queue.get()
+        batch = [first]
+        deadline = min(first[0] + self.window, first[0] + self.latency_budget - self.batch_time)
+
+        while len(batch) < self.max_batch_size:
+            # Requests that queued up while the previous batch ran join without waiting
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            # Wait for a free slot first, so requests keep queueing into the next batch meanwhile
+            await self._slots.acquire()
+            batch = await self._collect()
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        symptom_sets = [symptoms for _, symptoms, _ in batch]
+        start = time.perf_counter()
+        try:
+            results, version, info = await loop.run_in_executor(self.executor, self.engine.diagnose_batch_versioned,
+                                                                symptom_sets)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    error = BatchError(f"{type(e).__name__}: {e}")
+                    error.__cause__ = e
+                    future.set_exception(error)
+            return
+        finally:
+            self._slots.release()
+        elapsed = time.perf_counter() - start
+
+        self.batch_time = elapsed if not self.batches else 0.8 * self.batch_time + 0.2 * elapsed
+        self.batches += 1
+        self.requests += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result((result, version, info))
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "mean_batch_ms": self.batch_time * 1000,
+            "queued": self.queue.qsize(),
+        }
+
+
+# ==========================================
+# HTTP/JSON Front End
+# ==========================================
+
+class DiagnosisService:
+    """
+    Minimal HTTP/1.1 JSON server (keep-alive, Content-Length bodies) on asyncio streams.
+
+    POST /diagnose   {"symptoms": [...]}        -> {"results": [...]}
+    GET  /health                                -> {"status": "ok", "symptoms": [...]}
+    GET  /stats                                 -> batching and cache counters (and prefork
+                                                   worker jobs and memory with --workers)
+    GET  /metrics                               -> stage timings and counters, Prometheus text
+    GET  /metrics.json                          -> the same as a JSON snapshot
+    GET  /version                               -> model/rules/info version in effect
+    POST /admin/reload                          -> reload and validate the files now (409 if
+                                                   rejected; the current version stays)
+    POST /admin/rollback                        -> put the previous version back
+
+    With a ReloadableEngine, SIGHUP also triggers a background reload. With a history
+    store, every diagnosis served is recorded in it (see diagnosis_history.py).
+    """
+
+    def __init__(self, engine, host=HOST, port=PORT, history=None, **batch_options):
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.history = history
+        self.batcher = MicroBatcher(engine, **batch_options)
+        self.server = None
+
+    async def start(self):
+        self.batcher.start()
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        return self.server
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        await self.batcher.stop()
+
+    async def serve_forever(self):
+        await self.start()
+        loop = asyncio.get_running_loop()
+        if hasattr(self.engine, "request_reload"):
+            loop.add_signal_handler(signal.SIGHUP, self.engine.request_reload, "SIGHUP")
+        # SIGTERM shuts down like Ctrl+C, so the caller can close the engine and flush the history
+        loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        print(f"Diagnosis service listening on http://{self.host}:{self.port}")
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "malformed request line"}, keep_alive=False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get("content-length", 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._respond(writer, 400, {"error": "invalid Content-Length"}, keep_alive=False)
+                    break
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, {"error": "request body too large"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                keep_alive = headers.get("connection", "").lower() != "close"
+                status, payload = await self._route(method, path.split("?", 1)[0], body)
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, body):
+        if path == "/diagnose":
+            if method != "POST":
+                return 405, {"error": "use POST"}
+            try:
+                payload = json.loads(body or b"{}")
+                symptoms = payload["symptoms"]
+                if isinstance(symptoms, str) or not isinstance(symptoms, list):
+                    raise ValueError("'symptoms' must be a list of symptom names")
+                results, version, info = await self.batcher.submit(symptoms)
+            except BatchError as e:
+                if metrics.enabled:
+                    metrics.count("diagnose_failed")
+                return 500, {"error": str(e)}
+            except (ValueError, KeyError, TypeError) as e:
+                if metrics.enabled:
+                    metrics.count("diagnose_rejected")
+                return 400, {"error": str(e)}
+            except Exception as e:
+                if metrics.enabled:
+                    metrics.count("diagnose_failed")
+                return 500, {"error": str(e)}
+            if self.history:
+                self.history.record(symptoms, results, version)
+            return 200, {"results": with_info(results, info)}
+
+        if path == "/health":
+            return 200, {"status": "ok", "symptoms": self.engine.symptom_columns}
+
+        if path == "/stats":
+            stats = {"batching": self.batcher.stats()}
+            if self.engine.cache is not None:
+                stats["cache"] = self.engine.cache.stats()
+            if hasattr(self.engine, "memory_report"):
+                stats["prefork"] = {**self.engine.stats(), "memory": self.engine.memory_report()}
+            if hasattr(self.engine, "reload"):
+                stats["reload"] = self.engine.stats()
+            if self.history:
+                stats["history"] = self.history.stats()
+            return 200, stats
+
+        if path in ("/version", "/admin/reload", "/admin/rollback"):
+            if not hasattr(self.engine, "reload"):
+                return 404, {"error": "hot reload is not available with --workers"}
+            if path == "/version":
+                return 200, self.engine.current.describe()
+            if method != "POST":
+                return 405, {"error": "use POST"}
+            # Loading and validating takes a while; the event loop keeps serving meanwhile
+            loop = asyncio.get_running_loop()
+            if path == "/admin/rollback":
+                record = await loop.run_in_executor(None, self.engine.rollback)
+                if record is None:
+                    return 409, {"error": "no previous version to roll back to"}
+                return 200, record
+            record = await loop.run_in_executor(None, self.engine.reload, "api")
+            return (409 if record["status"] == "rejected" else 200), record
+
+        if path == "/metrics":
+            return 200, metrics.prometheus()
+
+        if path == "/metrics.json":
+            return 200, metrics.snapshot()
+
+        return 404, {"error": f"no route for {path}"}
+
+    async def _respond(self, writer, status, payload, keep_alive=True):
+        # Strings (the Prometheus exposition) go out as plain text, everything else as JSON
+        if isinstance(payload, str):
+            body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            body, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+        head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve tomato disease diagnoses over local HTTP/JSON.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--window-ms", type=float, default=BATCH_WINDOW_MS, help="micro-batch collection window")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH_SIZE, help="maximum requests per batch")
+    parser.add_argument("--budget-ms", type=float, default=LATENCY_BUDGET_MS, help="per-request latency budget")
+    parser.add_argument("--cache-size", type=int, default=4096, help="result cache entries (0 disables)")
+    parser.add_argument("--rules-backend", choices=("clips", "compiled"), default="compiled")
+    parser.add_argument("--ml-backend", choices=("sklearn", "flat"), default="sklearn")
+    parser.add_argument("--metrics", action="store_true", help="record stage timings for /metrics")
+    parser.add_argument("--slow-ms", type=float, help="log diagnosis batches slower than this (implies --metrics)")
+    parser.add_argument("--slow-log", help="JSON-lines file for the slow-diagnosis log (default: stderr)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="prefork worker processes sharing one model (flat forest, compiled rules); "
+                             "0 diagnoses in this process")
+    parser.add_argument("--watch", action="store_true",
+                        help="reload the model, rules and disease info when their files change "
+                             "(without --workers)")
+    parser.add_argument("--history", nargs="?", const=HISTORY_FILE, metavar="DB",
+                        help=f"record every diagnosis in a history database (default {HISTORY_FILE})")
+    args = parser.parse_args()
+    if args.watch and args.workers:
+        parser.error("--watch cannot be combined with --workers; the prefork workers share one fixed model")
+
+    if args.metrics or args.slow_ms is not None:
+        metrics.enable(slow_ms=args.slow_ms, slow_log=args.slow_log)
+
+    if args.workers:
+        from prefork_pool import PreforkPool
+
+        service_engine = PreforkPool(args.workers)
+        print(f"Started {args.workers} prefork worker(s) on a "
+              f"{service_engine.block.size / 1024:.0f} kB shared model block")
+    else:
+        service_engine = ReloadableEngine(watch=args.watch, rules_backend=args.rules_backend,
+                                          ml_backend=args.ml_backend, cache_size=args.cache_size)
+    history = HistoryStore(args.history) if args.history else None
+    service = DiagnosisService(service_engine, args.host, args.port, history=history, window_ms=args.window_ms,
+                               max_batch_size=args.max_batch, latency_budget_ms=args.budget_ms,
+                               concurrency=max(1, args.workers))
+    try:
+        asyncio.run(service.serve_forever())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        service_engine.close()
+        if history:
+            history.close()
@@ -0,0 +1,229 @@
+import argparse
+import os
+
+import numpy as np
+
+from diagnosis_cache import file_digest
+
+# ==========================================
+# Configuration
+# ==========================================
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FOREST_FILE = os.path.join(BASE_DIR, "tomato_disease_forest.npz")
+
+# Rows evaluated per traversal pass; bounds the (rows x trees x classes) gather
+CHUNK_ROWS = 256
+
+ARRAY_FIELDS = ("feature", "threshold", "left", "right", "value", "roots")
+
+
+# ==========================================
+# Flattened Forest
+# ==========================================
+
+class FlatForest:
+    """
+    A fitted RandomForestClassifier flattened into contiguous NumPy node arrays.
+
+    All trees share one set of node arrays; roots holds the index of each tree's root.
+    Leaves point back at themselves (feature 0, threshold +inf, left = right = self).
+    value holds each node's normalized class distribution over classes_.
+
+    Exposes classes_ and predict_proba() like the sklearn model, so the diagnosis
+    engine can use either one. Only NumPy is needed to load and evaluate it.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, roots, classes, feature_names=None,
+                 max_depth=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.classes_ = np.asarray(classes)
+        self.feature_names = list(feature_names) if feature_names is not None else None
+        self.n_features_in_ = len(self.feature_names) if self.feature_names else int(feature.max()) + 1
+        self.is_leaf = left == np.arange(len(left))
+        self.max_depth = int(max_depth) if max_depth is not None else self._depth()
+
+    @property
+    def n_estimators(self):
+        return len(self.roots)
+
+    def _depth(self):
+        """Longest root-to-leaf path, found by stepping every root until all reach a leaf."""
+        nodes = self.roots.copy()
+        depth = 0
+        while True:
+            step = self.left[nodes]
+            if np.array_equal(step, nodes):
+                return depth
+            nodes = step
+            depth += 1
+
+    @classmethod
+    def from_sklearn(cls, clf):
+        """Exports the fitted trees of a RandomForestClassifier."""
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+
+        for estimator in clf.estimators_:
+            tree = estimator.tree_
+            n_nodes = tree.node_count
+            nodes = np.arange(n_nodes)
+            is_leaf = tree.children_left == -1
+
+            feature = np.where(is_leaf, 0, tree.feature).astype(np.int32)
+            threshold = np.where(is_leaf, np.inf, tree.threshold).astype(np.float64)
+            left = np.where(is_leaf, nodes, tree.children_left) + offset
+            right = np.where(is_leaf, nodes, tree.children_right) + offset
+
+            # Same normalization DecisionTreeClassifier.predict_proba applies
+            value = tree.value[:, 0, :].astype(np.float64)
+            normalizer = value.sum(axis=1, keepdims=True)
+            normalizer[normalizer == 0.0] = 1.0
+            value = value / normalizer
+
+            features.append(feature)
+            thresholds.append(threshold)
+            lefts.append(left.astype(np.int32))
+            rights.append(right.astype(np.int32))
+            values.append(value)
+            roots.append(offset)
+            offset += n_nodes
+
+        feature_names = getattr(clf, "feature_names_in_", None)
+        return cls(np.concatenate(features), np.concatenate(thresholds), np.concatenate(lefts),
+                   np.concatenate(rights), np.concatenate(values), np.array(roots, dtype=np.int32),
+                   clf.classes_, feature_names=feature_names,
+                   max_depth=max(estimator.tree_.max_depth for estimator in clf.estimators_))
+
+    def to_arrays(self):
+        """All node arrays and metadata as a dict of NumPy arrays."""
+        arrays = {field: getattr(self, field) for field in ARRAY_FIELDS}
+        arrays["classes"] = self.classes_.astype(str)
+        arrays["feature_names"] = np.array(self.feature_names or [], dtype=str)
+        arrays["max_depth"] = np.array(self.max_depth)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        feature_names = [str(name) for name in arrays["feature_names"]] or None
+        return cls(*(arrays[field] for field in ARRAY_FIELDS), [str(c) for c in arrays["classes"]],
+                   feature_names=feature_names, max_depth=int(arrays["max_depth"]))
+
+    def save(self, path=FOREST_FILE, source_model=None):
+        """Writes the arrays to an .npz, recording the digest of source_model if given."""
+        arrays = self.to_arrays()
+        if source_model:
+            arrays["source_digest"] = np.array(file_digest(source_model))
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path=FOREST_FILE):
+        with np.load(path) as data:
+            return cls.from_arrays({name: data[name] for name in data.files})
+
+    def apply(self, X):
+        """
+        Returns the (rows x trees) leaf index each row reaches in each tree.
+        Each step only advances the (row, tree) pairs that have not reached a leaf yet,
+        so shallow trees stop costing anything once they are done.
+        """
+        X = np.asarray(X, dtype=np.float32)
+        n_rows, n_trees = len(X), len(self.roots)
+        X_flat = X.ravel()
+
+        nodes = np.tile(self.roots, n_rows)
+        row_offset = np.repeat(np.arange(n_rows, dtype=np.intp) * X.shape[1], n_trees)
+        active = np.flatnonzero(~self.is_leaf[nodes])
+        while active.size:
+            current = nodes[active]
+            go_left = X_flat[row_offset[active] + self.feature[current]] <= self.threshold[current]
+            step = np.where(go_left, self.left[current], self.right[current])
+            nodes[active] = step
+            active = active[~self.is_leaf[step]]
+        return nodes.reshape(n_rows, n_trees)
+
+    def predict_proba(self, X):
+        """Mean of the per-tree leaf class distributions, like RandomForestClassifier.predict_proba."""
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected a 2D input with {self.n_features_in_} columns, got shape {X.shape}")
+
+        proba = np.empty((len(X), len(self.classes_)), dtype=np.float64)
+        for start in range(0, len(X), CHUNK_ROWS):
+            leaves = self.apply(X[start:start + CHUNK_ROWS])
+            proba[start:start + CHUNK_ROWS] = self.value[leaves].sum(axis=1) / self.n_estimators
+        return proba
+
+
+def forest_source(forest_file=FOREST_FILE):
+    """Digest of the pickled model an .npz export was made from, or None if not recorded."""
+    with np.load(forest_file) as data:
+        return str(data["source_digest"]) if "source_digest" in data.files else None
+
+
+def load_forest(forest_file=FOREST_FILE, model_file=None):
+    """
+    Loads the flattened forest. With model_file, the export is only used if it was made
+    from that model as it is on disk now; otherwise the forest is exported from model_file.
+    """
+    if os.path.exists(forest_file) and (
+            model_file is None or not os.path.exists(model_file)
+            or forest_source(forest_file) == file_digest(model_file)):
+        return FlatForest.load(forest_file)
+
+    import joblib
+    return FlatForest.from_sklearn(joblib.load(model_file))
+
+
+# ==========================================
+# Agreement Check Against sklearn
+# ==========================================
+
+def verify_against_sklearn(model_file, csv_file, n_random=2000, seed=42, atol=1e-9):
+    """
+    Compares FlatForest.predict_proba with clf.predict_proba on the dataset rows plus
+    random 0/1 rows. Returns the maximum absolute difference.
+    """
+    import joblib
+    import pandas as pd
+
+    clf = joblib.load(model_file)
+    forest = FlatForest.from_sklearn(clf)
+
+    df = pd.read_csv(csv_file)
+    X_data = df.drop("disease", axis=1).to_numpy(dtype=np.uint8)
+    rng = np.random.default_rng(seed)
+    X_random = (rng.random((n_random, X_data.shape[1])) < 0.1).astype(np.uint8)
+    X = np.vstack([X_data, X_random])
+
+    expected = clf.predict_proba(pd.DataFrame(X, columns=df.columns[:-1]))
+    actual = forest.predict_proba(X)
+    max_diff = float(np.abs(expected - actual).max())
+
+    print(f"Checked {len(X)} rows over {forest.n_estimators} trees: max |diff| = {max_diff:.3e} "
+          f"({'OK' if max_diff <= atol else 'FAILED'}, tolerance {atol:g})")
+    return max_diff
+
+
+if __name__ == "__main__":
+    from diagnosis_engine import CSV_FILE, MODEL_FILE
+
+    parser = argparse.ArgumentParser(description="Export the trained forest to flat NumPy node arrays.")
+    parser.add_argument("--model", default=MODEL_FILE, help="pickled RandomForestClassifier")
+    parser.add_argument("--output", default=FOREST_FILE, help="exported .npz file")
+    parser.add_argument("--verify", action="store_true", help="check predict_proba agreement with sklearn")
+    args = parser.parse_args()
+
+    if args.verify:
+        raise SystemExit(0 if verify_against_sklearn(args.model, CSV_FILE) <= 1e-9 else 1)
+
+    import joblib
+
+    forest = FlatForest.from_sklearn(joblib.load(args.model))
+    forest.save(args.output, source_model=args.model)
+    print(f"Exported {forest.n_estimators} trees ({len(forest.feature)} nodes, max depth {forest.max_depth}) "
+          f"to {args.output}")
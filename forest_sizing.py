@@ -0,0 +1,197 @@
+import argparse
+import copy
+import json
+import os
+import pickle
+import shutil
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import train_test_split
+
+from diagnosis_engine import CSV_FILE, MODEL_FILE
+from forest_export import FlatForest
+from model_artifact import artifact_dir_for, load_manifest, load_symptom_stats, save_artifact
+
+# ==========================================
+# Configuration
+# ==========================================
+SIZES = (5, 10, 25, 50, 75, 100, 150, 200, 300, 400, 500)
+MIN_AGREEMENT = 0.99  # top-1 agreement with the full deployed forest
+MAX_PROBA_DIFF = 5.0  # max |probability difference| vs the full forest, in percentage points
+ACCURACY_TOLERANCE = 0.0  # allowed held-out accuracy drop vs the full-size forest
+PRUNED_MODEL_FILE = os.path.splitext(MODEL_FILE)[0] + ".pruned.pkl"
+TIMING_CALLS = 50
+
+
+# ==========================================
+# Cumulative Per-Tree Probabilities
+# ==========================================
+
+def cumulative_proba(clf, X):
+    """
+    (n_trees x rows x classes) array whose k-1'th slice is predict_proba of the first k trees.
+    Each tree is evaluated once, so every forest size comes out of one cumulative sum.
+    """
+    X = np.asarray(X, dtype=np.float32)
+    per_tree = np.stack([estimator.predict_proba(X) for estimator in clf.estimators_])
+    counts = np.arange(1, len(per_tree) + 1)[:, None, None]
+    return np.cumsum(per_tree, axis=0) / counts
+
+
+def prune(clf, n_trees):
+    """A copy of the forest keeping only its first n_trees trees."""
+    pruned = copy.deepcopy(clf)
+    pruned.estimators_ = pruned.estimators_[:n_trees]
+    pruned.n_estimators = n_trees
+    return pruned
+
+
+def median_latency_ms(fn, x, calls=TIMING_CALLS):
+    fn(x)
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        fn(x)
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples) * 1000)
+
+
+# ==========================================
+# Sizing Evaluation
+# ==========================================
+
+def load_data(csv_file, classes):
+    """Feature matrix and labels for the rows whose disease the model knows."""
+    df = pd.read_csv(csv_file)
+    df = df[df["disease"].isin(classes)]
+    return df.drop("disease", axis=1).to_numpy(dtype=np.uint8), df["disease"].to_numpy()
+
+
+def evaluate_sizes(clf, X, y, sizes=SIZES, n_random=2000, seed=42):
+    """
+    For each forest size k, reports:
+    - held-out accuracy of the first k trees of a forest trained (same params) on a 75% split
+    - top-1 agreement and max probability difference between the first k deployed trees
+      and the full deployed forest, over the dataset plus random symptom rows
+    - single-row predict_proba latency (sklearn and flat) and model size in bytes
+    """
+    sizes = sorted(k for k in set(sizes) if k <= clf.n_estimators)
+
+    # Held-out accuracy: the deployed forest has seen every row, so refit on a split
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.25, random_state=seed, stratify=y)
+    params = {k: v for k, v in clf.get_params().items() if k not in ("n_jobs", "warm_start")}
+    held_out = RandomForestClassifier(**params, n_jobs=-1).fit(X_train, y_train)
+    heldout_proba = cumulative_proba(held_out, X_test)
+
+    # Agreement with the deployed forest on realistic and random inputs
+    rng = np.random.default_rng(seed)
+    X_eval = np.vstack([X, (rng.random((n_random, X.shape[1])) < 0.1).astype(np.uint8)])
+    deployed_proba = cumulative_proba(clf, X_eval)
+    full = deployed_proba[-1]
+    full_top1 = full.argmax(axis=1)
+
+    one_row = X[:1]
+    results = []
+    for k in sizes:
+        proba = deployed_proba[k - 1]
+        pruned = prune(clf, k)
+        flat = FlatForest.from_sklearn(pruned)
+        results.append({
+            "n_trees": k,
+            "heldout_accuracy": float(np.mean(held_out.classes_[heldout_proba[k - 1].argmax(axis=1)] == y_test)),
+            "top1_agreement": float(np.mean(proba.argmax(axis=1) == full_top1)),
+            "max_proba_diff_pct": float(np.abs(proba - full).max() * 100),
+            "mean_proba_diff_pct": float(np.abs(proba - full).mean() * 100),
+            "sklearn_ms": median_latency_ms(pruned.predict_proba, one_row),
+            "flat_ms": median_latency_ms(flat.predict_proba, one_row),
+            "pickle_bytes": len(pickle.dumps(pruned)),
+            "flat_bytes": int(sum(array.nbytes for array in flat.to_arrays().values())),
+        })
+    return results
+
+
+def choose_size(results, min_agreement=MIN_AGREEMENT, max_proba_diff=MAX_PROBA_DIFF,
+                accuracy_tolerance=ACCURACY_TOLERANCE):
+    """Smallest size meeting the agreement, probability and accuracy targets (None if none does)."""
+    best_accuracy = results[-1]["heldout_accuracy"]
+    for row in results:
+        if (row["top1_agreement"] >= min_agreement and row["max_proba_diff_pct"] <= max_proba_diff
+                and row["heldout_accuracy"] >= best_accuracy - accuracy_tolerance):
+            return row["n_trees"]
+    return None
+
+
+def print_table(results, chosen):
+    print(f"{'trees':>6} {'accuracy':>9} {'agree':>7} {'maxdiff%':>9} {'sklearn ms':>11} {'flat ms':>8} "
+          f"{'pickle KB':>10}")
+    for row in results:
+        marker = "  <- chosen" if row["n_trees"] == chosen else ""
+        print(f"{row['n_trees']:>6} {row['heldout_accuracy']:>9.3f} {row['top1_agreement']:>7.3f} "
+              f"{row['max_proba_diff_pct']:>9.2f} {row['sklearn_ms']:>11.2f} {row['flat_ms']:>8.2f} "
+              f"{row['pickle_bytes'] / 1024:>10.0f}{marker}")
+
+
+def save_pruned(clf, n_trees, output_file, swap=False, model_file=MODEL_FILE):
+    """
+    Writes the pruned model to output_file. With swap, it also replaces model_file (keeping
+    a .bak copy of the previous one) and rewrites the serving artifact next to it.
+    """
+    pruned = prune(clf, n_trees)
+    joblib.dump(pruned, output_file)
+    print(f"Pruned model ({n_trees} trees) saved as {output_file}")
+
+    if swap:
+        artifact_dir = artifact_dir_for(model_file)
+        shutil.copy2(model_file, model_file + ".bak")
+        tmp_file = model_file + ".tmp"
+        joblib.dump(pruned, tmp_file)
+        os.replace(tmp_file, model_file)
+
+        try:
+            metadata = load_manifest(artifact_dir).get("metadata", {})
+            # Same training data, so the symptom counts carry over to the pruned model
+            stats = load_symptom_stats(artifact_dir)
+        except (OSError, ValueError):
+            metadata = {}
+            stats = None
+        if stats is not None and stats["symptom_columns"] != list(pruned.feature_names_in_):
+            stats = None
+        metadata["pruned_from"] = clf.n_estimators
+        manifest = save_artifact(FlatForest.from_sklearn(pruned), pruned.feature_names_in_, metadata, artifact_dir,
+                                 stats, model_file)
+        print(f"Swapped in as {model_file} (previous model kept as {model_file}.bak); "
+              f"artifact {manifest['model_id']} written.")
+    return pruned
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure accuracy vs latency for smaller forests and prune.")
+    parser.add_argument("--model", default=MODEL_FILE)
+    parser.add_argument("--csv", default=CSV_FILE)
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--min-agreement", type=float, default=MIN_AGREEMENT)
+    parser.add_argument("--max-proba-diff", type=float, default=MAX_PROBA_DIFF, help="percentage points")
+    parser.add_argument("--accuracy-tolerance", type=float, default=ACCURACY_TOLERANCE)
+    parser.add_argument("--output", default=PRUNED_MODEL_FILE, help="where to write the pruned model")
+    parser.add_argument("--swap", action="store_true", help="replace the deployed model with the pruned one")
+    parser.add_argument("--json", help="also write the per-size results as JSON")
+    args = parser.parse_args()
+
+    deployed = joblib.load(args.model)
+    X_all, y_all = load_data(args.csv, deployed.classes_)
+    sizing = evaluate_sizes(deployed, X_all, y_all, args.sizes + [deployed.n_estimators])
+    n_chosen = choose_size(sizing, args.min_agreement, args.max_proba_diff, args.accuracy_tolerance)
+    print_table(sizing, n_chosen)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"results": sizing, "chosen": n_chosen}, f, indent=2)
+
+    if n_chosen is None or n_chosen >= deployed.n_estimators:
+        print("No smaller forest meets the targets; the deployed model is kept.")
+    else:
+        save_pruned(deployed, n_chosen, args.output, args.swap, args.model)
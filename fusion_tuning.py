@@ -0,0 +1,299 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from diagnosis_engine import (BASE_DIR, CSV_FILE, FUSION_CONFIG_FILE, MODEL_FILE, RULES_FILE,
+                              default_fusion_config)
+
+# ==========================================
+# Configuration
+# ==========================================
+INPUTS_FILE = os.path.join(BASE_DIR, "fusion_inputs.npz")  # cached aligned ML/CF arrays
+W_GRID = np.round(np.linspace(0.0, 1.0, 21), 4)  # candidate values for both W_ML and W_CF
+MIN_FTS_GRID = (0.1, 1.0, 2.5, 5.0, 7.5, 10.0, 15.0, 20.0, 25.0, 30.0, 40.0)
+TAG_GRID = np.arange(5.0, 100.0, 2.5)  # candidate high/medium tag thresholds
+HIGH_PRECISION = 0.9  # a "high" tag should be right at least this often
+MEDIUM_PRECISION = 0.6
+N_SPLITS = 5
+MAX_CELLS = 20_000_000  # weight pairs x rows x diseases evaluated per vectorized block
+
+
+# ==========================================
+# Aligned Inputs
+# ==========================================
+# ml[n, d] and cf[n, d] are the ML probability and max rule CF (both in percent) of disease
+# diseases[d] for dataset row n: the model's classes_ first, then the diseases only the rules
+# know. They are computed once and cached, so searching the grid never touches the model.
+
+def inputs_signature(model_file, rules_file, csv_file, ml_mode):
+    digest = hashlib.sha256(ml_mode.encode())
+    for path in (model_file, rules_file, csv_file):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def out_of_fold_proba(clf, X, y, n_splits=N_SPLITS, seed=42):
+    """
+    Probabilities for each row from a forest (same parameters as clf) that never saw it, so
+    the ML side is not scored on its own training rows. Columns follow clf.classes_.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.model_selection import KFold
+
+    classes = list(clf.classes_)
+    params = {k: v for k, v in clf.get_params().items() if k not in ("n_jobs", "warm_start")}
+    proba = np.zeros((len(X), len(classes)))
+    known = np.isin(y, classes)
+    for train_idx, test_idx in KFold(n_splits, shuffle=True, random_state=seed).split(X):
+        train_idx = train_idx[known[train_idx]]
+        fold_clf = RandomForestClassifier(**params, n_jobs=-1).fit(X[train_idx], y[train_idx])
+        columns = [classes.index(c) for c in fold_clf.classes_]
+        proba[np.ix_(test_idx, columns)] = fold_clf.predict_proba(X[test_idx])
+    return proba
+
+
+def compute_inputs(model_file=MODEL_FILE, rules_file=RULES_FILE, csv_file=CSV_FILE, ml_mode="oof"):
+    """Builds the aligned arrays: {"diseases", "ml", "cf", "labels", "empty"}."""
+    import joblib
+    import pandas as pd
+
+    from rule_compiler import compile_rules
+
+    clf = joblib.load(model_file)
+    df = pd.read_csv(csv_file)
+    columns = [str(c) for c in getattr(clf, "feature_names_in_", df.columns[:-1])]
+    X = df[columns].to_numpy(dtype=np.uint8)
+    y = np.array(df["disease"].astype(str).tolist())
+
+    # The compiled rules give the same CFs as CLIPS (rule_compiler.py --verify) for the whole matrix at once
+    rules = compile_rules(columns, rules_file)
+    diseases = [str(c) for c in clf.classes_] + [d for d in rules.diseases if d not in clf.classes_]
+    diseases = [d for d in diseases if d != "healthy"]  # fuse_scores() never ranks 'healthy'
+    index = {d: i for i, d in enumerate(diseases)}
+
+    ml = np.zeros((len(X), len(diseases)))
+    proba = out_of_fold_proba(clf, X, y) if ml_mode == "oof" else clf.predict_proba(X)
+    for c, name in enumerate(clf.classes_):
+        if name in index:
+            ml[:, index[name]] = proba[:, c] * 100
+
+    cf = np.zeros_like(ml)
+    rule_cf, _ = rules.evaluate(X)
+    for d, name in enumerate(rules.diseases):
+        cf[:, index[name]] = rule_cf[:, d]
+
+    return {
+        "diseases": np.array(diseases),
+        "ml": ml,
+        "cf": cf,
+        "labels": y,
+        "empty": ~X.any(axis=1),
+    }
+
+
+def load_inputs(model_file=MODEL_FILE, rules_file=RULES_FILE, csv_file=CSV_FILE, ml_mode="oof",
+                cache_file=INPUTS_FILE):
+    """compute_inputs(), reusing cache_file while the model, rules and data are unchanged."""
+    signature = inputs_signature(model_file, rules_file, csv_file, ml_mode)
+    if cache_file and os.path.exists(cache_file):
+        with np.load(cache_file, allow_pickle=False) as cached:
+            if str(cached["signature"]) == signature:
+                return {key: cached[key] for key in cached.files if key != "signature"}
+
+    inputs = compute_inputs(model_file, rules_file, csv_file, ml_mode)
+    if cache_file:
+        np.savez(cache_file, signature=np.array(signature), **inputs)
+    return inputs
+
+
+# ==========================================
+# Vectorized Grid Evaluation
+# ==========================================
+
+def true_ranks(inputs, weights):
+    """
+    For each (w_ml, w_cf) pair and row: the FTS of the row's true disease and its 0-based rank
+    among all diseases (ties broken by name, as fuse_scores() does), plus the top FTS.
+    Shapes (pairs x rows); the true FTS is -inf for labels no stage can produce.
+    """
+    diseases = list(inputs["diseases"])
+    label_index = np.array([diseases.index(label) if label in diseases else -1 for label in inputs["labels"]])
+    known = label_index >= 0
+    name_rank = np.argsort(np.argsort(inputs["diseases"]))
+    rows = np.arange(len(label_index))
+    safe_index = np.where(known, label_index, 0)
+
+    w_ml = weights[:, 0][:, None, None]
+    w_cf = weights[:, 1][:, None, None]
+    fts = w_ml * inputs["ml"][None] + w_cf * inputs["cf"][None]  # pairs x rows x diseases
+
+    true_fts = fts[:, rows, safe_index]
+    beats = (fts > true_fts[:, :, None]) | ((fts == true_fts[:, :, None])
+                                             & (name_rank[None, None, :] < name_rank[safe_index][None, :, None]))
+    ranks = beats.sum(axis=2)
+    true_fts = np.where(known[None, :], true_fts, -np.inf)
+    return true_fts, ranks, fts.max(axis=2)
+
+
+def evaluate_grid(inputs, w_grid=W_GRID, min_fts_grid=MIN_FTS_GRID, max_cells=MAX_CELLS):
+    """
+    Scores every (w_ml, w_cf, min_fts) combination over the dataset rows. Returns a dict of
+    equally long arrays: w_ml, w_cf, min_fts, top1, top3 (accuracy) and no_result (share of
+    rows with symptoms where no disease reaches min_fts). Rows without symptoms are
+    diagnosed 'healthy' by the engine and count as correct only for a 'healthy' label.
+    """
+    weights = np.array([(a, b) for a in w_grid for b in w_grid if a + b > 0])
+    thresholds = np.asarray(min_fts_grid, dtype=float)
+    empty = inputs["empty"].astype(bool)
+    healthy_hits = np.sum(empty & (inputs["labels"] == "healthy"))
+    n_rows = len(empty)
+
+    top1, top3, no_result = [], [], []
+    block = max(1, max_cells // max(1, inputs["ml"].size))
+    for start in range(0, len(weights), block):
+        true_fts, ranks, best_fts = true_ranks(inputs, weights[start:start + block])
+        reached = (true_fts[:, None, :] >= thresholds[None, :, None]) & ~empty  # pairs x thresholds x rows
+        top1.append(((ranks[:, None, :] < 1) & reached).sum(axis=2) + healthy_hits)
+        top3.append(((ranks[:, None, :] < 3) & reached).sum(axis=2) + healthy_hits)
+        no_result.append(((best_fts[:, None, :] < thresholds[None, :, None]) & ~empty).sum(axis=2))
+
+    n_with_symptoms = max(1, n_rows - empty.sum())
+    return {
+        "w_ml": np.repeat(weights[:, 0], len(thresholds)),
+        "w_cf": np.repeat(weights[:, 1], len(thresholds)),
+        "min_fts": np.tile(thresholds, len(weights)),
+        "top1": np.concatenate(top1).ravel() / n_rows,
+        "top3": np.concatenate(top3).ravel() / n_rows,
+        "no_result": np.concatenate(no_result).ravel() / n_with_symptoms,
+    }
+
+
+def choose_best(grid, current=None):
+    """
+    Index of the best combination: highest top-1, then top-3, then fewest empty results.
+    Remaining ties go to the combination closest to the current config.
+    """
+    current = current or default_fusion_config()
+    distance = (np.abs(grid["w_ml"] - current["w_ml"]) + np.abs(grid["w_cf"] - current["w_cf"])
+                + np.abs(grid["min_fts"] - current["min_fts"]) / 100)
+    order = np.lexsort((distance, grid["no_result"], -grid["top3"], -grid["top1"]))
+    return int(order[0])
+
+
+def tag_thresholds(inputs, w_ml, w_cf, min_fts, tag_grid=TAG_GRID, high_precision=HIGH_PRECISION,
+                   medium_precision=MEDIUM_PRECISION):
+    """
+    Picks the high/medium FTS tag thresholds for the chosen weights: the lowest thresholds at
+    which the top-ranked disease is right at least high_precision / medium_precision of the
+    time. Returns (high, medium, table), with None where no threshold qualifies.
+    """
+    true_fts, ranks, best_fts = true_ranks(inputs, np.array([[w_ml, w_cf]]))
+    shown = (best_fts[0] >= min_fts) & ~inputs["empty"].astype(bool)
+    correct = shown & (ranks[0] == 0) & (true_fts[0] >= min_fts)
+
+    tagged = shown[None, :] & (best_fts[0][None, :] >= tag_grid[:, None])  # thresholds x rows
+    count = tagged.sum(axis=1)
+    precision = np.where(count > 0, (tagged & correct[None, :]).sum(axis=1) / np.maximum(count, 1), np.nan)
+    coverage = count / max(1, shown.sum())
+
+    def lowest(target, upper=np.inf):
+        # Lowest threshold (up to upper) from which every higher threshold with tagged rows also meets the target
+        ok = np.where(count > 0, precision >= target, True)
+        for i in range(len(tag_grid)):
+            if tag_grid[i] <= upper and count[i] > 0 and ok[i:].all():
+                return float(tag_grid[i])
+        return None
+
+    high = lowest(high_precision)
+    medium = lowest(medium_precision, high if high is not None else np.inf)
+    table = [{"threshold": float(t), "precision": None if np.isnan(p) else float(p), "coverage": float(c)}
+             for t, p, c in zip(tag_grid, precision, coverage)]
+    return high, medium, table
+
+
+# ==========================================
+# Runner
+# ==========================================
+
+def print_table(grid, best, current_index, top=15):
+    order = np.lexsort((grid["no_result"], -grid["top3"], -grid["top1"]))[:top]
+    print(f"{'w_ml':>6} {'w_cf':>6} {'min_fts':>8} {'top-1':>7} {'top-3':>7} {'no result':>10}")
+    for i in list(order) + ([current_index] if current_index is not None and current_index not in order else []):
+        marker = "  <- best" if i == best else ("  <- current" if i == current_index else "")
+        print(f"{grid['w_ml'][i]:>6.2f} {grid['w_cf'][i]:>6.2f} {grid['min_fts'][i]:>8.1f} {grid['top1'][i]:>7.3f} "
+              f"{grid['top3'][i]:>7.3f} {grid['no_result'][i]:>10.3f}{marker}")
+
+
+def tune(model_file=MODEL_FILE, rules_file=RULES_FILE, csv_file=CSV_FILE, ml_mode="oof",
+         output_file=FUSION_CONFIG_FILE, json_file=None, cache_file=INPUTS_FILE):
+    """Searches the grid, prints the leaders and writes the best config to output_file (if given)."""
+    start = time.perf_counter()
+    inputs = load_inputs(model_file, rules_file, csv_file, ml_mode, cache_file)
+    prepared = time.perf_counter()
+    grid = evaluate_grid(inputs)
+    searched = time.perf_counter()
+
+    print(f"Inputs: {inputs['ml'].shape[0]} rows x {inputs['ml'].shape[1]} diseases "
+          f"(ML probabilities: {'out-of-fold' if ml_mode == 'oof' else 'in-sample'}), {prepared - start:.2f}s")
+    print(f"Scored {len(grid['top1']):,} weight/threshold combinations in {searched - prepared:.3f}s\n")
+
+    current = default_fusion_config()
+    matches = np.flatnonzero(np.isclose(grid["w_ml"], current["w_ml"]) & np.isclose(grid["w_cf"], current["w_cf"])
+                             & np.isclose(grid["min_fts"], current["min_fts"]))
+    current_index = int(matches[0]) if len(matches) else None
+    best = choose_best(grid, current)
+    print_table(grid, best, current_index)
+
+    config = {key: float(grid[key][best]) for key in ("w_ml", "w_cf", "min_fts")}
+    high, medium, tag_table = tag_thresholds(inputs, config["w_ml"], config["w_cf"], config["min_fts"])
+    config["high_fts"] = high if high is not None else current["high_fts"]
+    config["medium_fts"] = medium if medium is not None else min(current["medium_fts"], config["high_fts"])
+    print(f"\nTag thresholds: high >= {config['high_fts']:.1f} (target precision {HIGH_PRECISION}), "
+          f"medium >= {config['medium_fts']:.1f} (target {MEDIUM_PRECISION})"
+          + ("" if high is not None and medium is not None else "; targets not reachable, kept current"))
+
+    record = {
+        **config,
+        "tuned": {
+            "top1": float(grid["top1"][best]),
+            "top3": float(grid["top3"][best]),
+            "no_result": float(grid["no_result"][best]),
+            "rows": int(inputs["ml"].shape[0]),
+            "ml_mode": ml_mode,
+            "source_file": os.path.basename(csv_file),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+    }
+    if output_file:
+        tmp_file = output_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=2)
+        os.replace(tmp_file, output_file)
+        print(f"Wrote {output_file}")
+    if json_file:
+        with open(json_file, "w", encoding="utf-8") as f:
+            json.dump({"best": record, "tags": tag_table,
+                       "grid": {key: values.tolist() for key, values in grid.items()}}, f)
+    return record
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Grid-search the FTS fusion weights and thresholds.")
+    parser.add_argument("--model", default=MODEL_FILE)
+    parser.add_argument("--rules", default=RULES_FILE)
+    parser.add_argument("--csv", default=CSV_FILE)
+    parser.add_argument("--in-sample", action="store_true",
+                        help="score the deployed model on its own training rows instead of out-of-fold forests")
+    parser.add_argument("--output", default=FUSION_CONFIG_FILE, help="config file the engine loads")
+    parser.add_argument("--dry-run", action="store_true", help="report only, do not write the config")
+    parser.add_argument("--json", help="also write every combination's scores as JSON")
+    parser.add_argument("--no-cache", action="store_true", help="recompute the aligned ML/CF arrays")
+    args = parser.parse_args()
+
+    tune(args.model, args.rules, args.csv, "in-sample" if args.in_sample else "oof",
+         None if args.dry_run else args.output, args.json, None if args.no_cache else INPUTS_FILE)
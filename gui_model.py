@@ -1,89 +1,52 @@
-import os
+import queue
+import threading
 import tkinter as tk
 from tkinter import ttk
-from clips import Environment
-from PIL import Image, ImageTk
-import pandas as pd
-import joblib
-import numpy as np
+
+from diagnosis_engine import DiagnosisEngine
+from diagnosis_history import HistoryStore
+from diagnosis_metrics import metrics
+from symptom_advisor import SymptomAdvisor
 
 # ==========================================
-# Load ML model and columns
+# Configuration
 # ==========================================
-try:
-    # Load ML model
-    clf = joblib.load("tomato_disease_model.pkl")
+DEBOUNCE_MS = 150  # live mode waits this long after the last listbox change before diagnosing
+POLL_MS = 20  # how often the main loop checks for finished background diagnoses
+SUGGESTIONS_SHOWN = 3  # next symptoms to ask about, most informative first
+# Diagnose clicks are recorded in the history right away; a live-mode result only once the
+# selection has stayed on screen this long, so intermediate selections are not counted
+HISTORY_SETTLE_MS = 5000
 
-    # Load columns from the data file
-    df = pd.read_csv("tomato_disease_symptoms_extended.csv")
-    symptom_columns = df.columns[:-1].tolist()  # all columns except 'disease'
+# ==========================================
+# Load ML model, columns and CLIPS rules
+# ==========================================
+try:
+    # Incremental rules: each toggle only asserts/retracts the changed symptom in CLIPS
+    engine = DiagnosisEngine(ml_backend="flat", rules_backend="incremental", cache_size=1024)
+    # Ranks the unselected symptoms to ask about next (see symptom_advisor.py)
+    advisor = SymptomAdvisor(engine)
+    clf = engine.clf
+    symptom_columns = engine.symptom_columns
 
     # Get all possible disease names from the model's classes
-    all_diseases = clf.classes_.tolist()
+    all_diseases = engine.classes
 
 except Exception as e:
-    # Fallback/error handling if the model/data is missing
-    print(f"Error loading model or data: {e}")
+    # Fallback/error handling if the model/data/rules are missing
+    print(f"Error loading model, data or rules: {e}")
+    engine = None
+    advisor = None
     clf = None
     symptom_columns = []
     all_diseases = []
 
-# ==========================================
-# Initialize CLIPS environment
-# ==========================================
-env = Environment()
 try:
-    env.load("rules_model.clp")
+    # Every diagnosis shown is logged for audits and outbreak queries (see diagnosis_history.py)
+    history = HistoryStore() if engine else None
 except Exception as e:
-    print(f"Error loading CLIPS rules: {e}")
-
-# ==========================================
-# Disease Info
-# ==========================================
-disease_info = {
-    "early-blight": {"treatment": "Use copper-based fungicide. Remove affected leaves.",
-                     "prevention": "Avoid overhead watering and rotate crops annually."},
-    "late-blight": {"treatment": "Apply fungicides with chlorothalonil. Remove infected plants.",
-                    "prevention": "Avoid wet conditions. Use resistant tomato varieties."},
-    "septoria-leaf-spot": {"treatment": "Spray with copper fungicide weekly until controlled.",
-                           "prevention": "Use disease-free seeds and practice crop rotation."},
-    "bacterial-spot": {"treatment": "Use copper-based bactericide. Remove infected plants.",
-                       "prevention": "Avoid working with wet plants and sanitize tools."},
-    "tomato-mosaic-virus": {"treatment": "No chemical cure. Remove and destroy infected plants immediately.",
-                            "prevention": "Sanitize tools regularly. Use virus-free seeds."},
-    "leaf-mold": {"treatment": "Improve air circulation. Use approved fungicides (e.g., chlorothalonil).",
-                  "prevention": "Ventilate greenhouses. Avoid high humidity."},
-    "powdery-mildew": {"treatment": "Apply sulfur-based or copper-based fungicides.",
-                       "prevention": "Ensure good air circulation and avoid excess nitrogen fertilization."},
-    "bacterial-canker": {"treatment": "Remove and destroy infected plants. Use copper sprays for management.",
-                         "prevention": "Plant certified disease-free seeds/transplants. Strict sanitation."},
-    "fusarium-wilt": {"treatment": "No cure. Remove infected plants. Solarize soil.",
-                      "prevention": "Use Fusarium wilt-resistant varieties (look for 'F' on labels)."},
-    "verticillium-wilt": {"treatment": "No chemical cure. Remove and destroy infected plants.",
-                          "prevention": "Use Verticillium wilt-resistant varieties (look for 'V' on labels)."},
-    "alternaria-leaf-spot": {"treatment": "Use fungicides containing chlorothalonil.",
-                             "prevention": "Practice crop rotation. Ensure adequate plant spacing."},
-    "damping-off": {"treatment": "Apply a fungicide drench to the soil surface.",
-                    "prevention": "Use sterile potting mix and avoid overwatering seedlings."},
-    "tomato-yellow-leaf-curl-virus": {"treatment": "No cure. Remove and destroy infected plants.",
-                                      "prevention": "Control whiteflies (the vector) using insecticides or netting."},
-    "pith-necrosis": {"treatment": "No chemical treatment. Prune affected stems to promote recovery.",
-                      "prevention": "Avoid excessive nitrogen fertilization and high humidity."},
-    "root-knot-nematode": {"treatment": "Soil solarization or application of biological nematicides.",
-                           "prevention": "Plant resistant varieties or practice crop rotation with non-hosts."},
-    "blossom-end-rot": {"treatment": "Apply calcium foliar sprays immediately. Adjust soil pH.",
-                        "prevention": "Ensure consistent watering and proper soil calcium levels."},
-    "southern-blight": {"treatment": "Remove infected plants and apply fungicides to the soil.",
-                        "prevention": "Deep plowing or soil solarization to reduce fungal spores."},
-    "gray-leaf-spot": {"treatment": "Apply fungicides like chlorothalonil or maneb.",
-                       "prevention": "Rotate crops and use drip irrigation."},
-    "sunscald": {"treatment": "Protect fruit from direct, intense sun (e.g., shade cloth).",
-                 "prevention": "Maintain healthy foliage to provide natural shade."},
-    "tomato-rust": {"treatment": "Use copper or sulfur fungicides.",
-                    "prevention": "Improve air circulation and reduce humidity."},
-    "healthy": {"treatment": "Maintain regular watering and fertilization schedule.",
-                "prevention": "Monitor plants weekly for early signs of disease."}
-}
+    print(f"Error opening the diagnosis history, diagnoses will not be recorded: {e}")
+    history = None
 
 # ==========================================
 # Translation Dictionary
@@ -102,6 +65,8 @@ translations = {
         "no_match": "No matching disease found",
         "reset_btn": "Reset",
         "exit_btn": "Exit",
+        "live_mode": "Live update",
+        "suggest_next": "Ask about next:",
     },
     "es": {
         "title": "Herramienta de Diagnóstico de Enfermedades del Tomate",
@@ -116,54 +81,14 @@ translations = {
         "no_match": "No se encontró ninguna enfermedad coincidente",
         "reset_btn": "Reiniciar",
         "exit_btn": "Salir",
+        "live_mode": "Actualización en vivo",
+        "suggest_next": "Preguntar a continuación:",
     }
 }
 
 current_lang = "en"
 
 
-# ==========================================
-# Core CLIPS Logic - Retrieves CF
-# ==========================================
-
-def get_clips_diagnosis(selected_symptoms):
-    """Asserts selected symptoms into CLIPS, runs, and retrieves CF for all asserted diseases."""
-    if not env:
-        return {}
-
-    env.reset()
-
-    for symptom in selected_symptoms:
-        try:
-            env.assert_string(f'(symptom (name {symptom}))')
-        except Exception as e:
-            print(f"Error asserting symptom {symptom}: {e}")
-
-    env.run()
-
-    clips_results = {}
-
-    for fact in env.facts():
-        if fact.template.name == "disease":
-            disease_name = fact["name"]
-
-            try:
-                # CF is 0.0 to 1.0, convert to percentage (0-100%)
-                confidence_factor = float(fact["confidence"]) * 100
-
-                # Take the MAX confidence (the strongest evidence)
-                if disease_name in clips_results:
-                    clips_results[disease_name] = max(clips_results[disease_name], confidence_factor)
-                else:
-                    clips_results[disease_name] = confidence_factor
-
-            except Exception as e:
-                print(f"Error processing CLIPS fact for {disease_name}: {e}")
-                clips_results[disease_name] = 0
-
-    return clips_results
-
-
 # ==========================================
 # Utility Functions
 # ==========================================
@@ -171,7 +96,7 @@ def get_clips_diagnosis(selected_symptoms):
 def reset_selections():
     """Clears all symptom selections and the results table."""
     symptom_listbox.selection_clear(0, tk.END)
-    diagnose()
+    request_diagnosis()
 
 
 def exit_app():
@@ -183,100 +108,208 @@ def exit_app():
 # Core Diagnosis Logic
 # ==========================================
 
-def diagnose():
-    if not clf:
-        print("ML Model not loaded. Cannot proceed with diagnosis.")
-        return
+class DiagnosisWorker:
+    """
+    Runs engine.diagnose() on a background thread so the Tk main loop never blocks.
+
+    Every submit() gets a new generation number. The thread always skips ahead to the newest
+    queued request, and results from a superseded generation are dropped, so only the
+    selection the operator currently has on screen is ever rendered. Tk is not thread-safe:
+    finished results wait in a queue that the main loop drains with app.after (see poll_results).
+
+    With an advisor, each result also carries the suggested next symptoms. They are ranked
+    after the diagnosis, so they never delay it, and ranking primes the engine cache with
+    every one-symptom-more selection, so ticking a suggestion is diagnosed from the cache.
+
+    Each result carries the engine.version that produced it (the engine reloads in place
+    on this thread) and whether it came from a Diagnose click, for the history.
+    """
+
+    def __init__(self, engine, advisor=None):
+        self.engine = engine
+        self.advisor = advisor
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.generation = 0
+        self.thread = threading.Thread(target=self._run, name="diagnosis-worker", daemon=True)
+        self.thread.start()
+
+    def submit(self, symptoms, explicit=False):
+        self.generation += 1
+        self.requests.put((self.generation, symptoms, explicit))
+
+    def latest(self):
+        """
+        The newest finished (symptoms, results, suggestions, error, version, explicit) that
+        is still current, or None.
+        """
+        latest = None
+        while True:
+            try:
+                generation, *finished = self.results.get_nowait()
+            except queue.Empty:
+                return latest
+            if generation == self.generation:
+                latest = tuple(finished)
+
+    def _run(self):
+        while True:
+            generation, symptoms, explicit = self.requests.get()
+            # Skip everything superseded while this thread was busy
+            while True:
+                try:
+                    generation, symptoms, explicit = self.requests.get_nowait()
+                except queue.Empty:
+                    break
+            if generation != self.generation:
+                continue
 
-    # 1. Get selected symptoms from the listbox
-    selected_symptoms_keys = [symptom_columns[i] for i in symptom_listbox.curselection()]
+            try:
+                # Timed as one top-level span (engine stages nest inside); see diagnosis_metrics.py
+                with metrics.span("gui_diagnose"):
+                    results = self.engine.diagnose(symptoms)
+                version = self.engine.version
+                suggestions = self.advisor.suggest(symptoms, top=SUGGESTIONS_SHOWN) if self.advisor else []
+                self.results.put((generation, symptoms, results, suggestions, None, version, explicit))
+            except Exception as e:
+                self.results.put((generation, symptoms, None, [], e, None, explicit))
 
-    # Clear previous results
-    for row in tree.get_children():
-        tree.delete(row)
 
-    # Handle the "Healthy" case when no symptoms are selected
-    if not selected_symptoms_keys:
-        info = disease_info.get("healthy", {"treatment": "-", "prevention": "-"})
+worker = DiagnosisWorker(engine, advisor) if engine else None
+current_suggestions = []
+pending_after_id = None
+pending_record_id = None
 
-        # Insert a single, clear row for Healthy (100% FTS)
-        # Values are: FTS, ML, CLIPS, Treatment, Prevention
-        tree.insert("", "end", text="Healthy",
-                    values=("100.0%", "100.0%", "100.0%", info["treatment"], info["prevention"]),
-                    tags=('high',))
-        return  # Exit the function early
 
-    # 2. Prepare input for ML Model
-    ml_input = {col: [1 if col in selected_symptoms_keys else 0] for col in symptom_columns}
-    ml_df = pd.DataFrame(ml_input, columns=symptom_columns)
+def diagnose():
+    """Diagnoses the current selection right away and records it (Diagnose button)."""
+    request_diagnosis(explicit=True)
 
-    # 3. Get ML Predictions
-    probabilities = clf.predict_proba(ml_df)[0]
-    ml_results = {disease: prob * 100 for disease, prob in zip(clf.classes_, probabilities)}
 
-    # 4. Get CLIPS Expert Diagnosis
-    clips_results = get_clips_diagnosis(selected_symptoms_keys)
+def request_diagnosis(explicit=False):
+    """Hands the current listbox selection to the background worker."""
+    global pending_after_id
+    if not worker:
+        print("ML Model not loaded. Cannot proceed with diagnosis.")
+        return
 
-    # 5. Combine ML and CLIPS Results & Calculate Final Trust Score (FTS)
-    W_ML = 0.6
-    W_CF = 0.4
+    if pending_after_id is not None:
+        app.after_cancel(pending_after_id)
+        pending_after_id = None
+    cancel_pending_record()
 
-    combined_results = []
+    selected_symptoms_keys = [symptom_columns[i] for i in symptom_listbox.curselection()]
+    worker.submit(selected_symptoms_keys, explicit)
 
-    all_unique_diseases = set(ml_results.keys()) | set(clips_results.keys())
 
-    for disease in all_unique_diseases:
-        if disease == "healthy":
-            continue
+def schedule_diagnosis(event=None):
+    """Debounced diagnosis for live mode: rapid listbox changes trigger a single run."""
+    global pending_after_id
+    cancel_pending_record()
+    if not live_mode.get():
+        return
+    if pending_after_id is not None:
+        app.after_cancel(pending_after_id)
+    pending_after_id = app.after(DEBOUNCE_MS, request_diagnosis)
+
+
+def poll_results():
+    """Renders the newest current result, if any, then polls again."""
+    finished = worker.latest() if worker else None
+    if finished is not None:
+        symptoms, combined_results, suggestions, error, version, explicit = finished
+        if error is not None:
+            print(f"Error during diagnosis: {error}")
+        else:
+            with metrics.span("gui_render"):
+                show_results(combined_results)
+                show_suggestions(suggestions)
+            if history:
+                if explicit:
+                    record_diagnosis(symptoms, combined_results, version)
+                else:
+                    schedule_record(symptoms, combined_results, version)
+    app.after(POLL_MS, poll_results)
+
+
+def record_diagnosis(symptoms, combined_results, version):
+    """Queues a shown diagnosis for the history (see diagnosis_history.py)."""
+    global pending_record_id
+    pending_record_id = None
+    history.record(symptoms, combined_results, version)
+
+
+def schedule_record(symptoms, combined_results, version):
+    """Records a live-mode result once it has stayed on screen for HISTORY_SETTLE_MS."""
+    global pending_record_id
+    cancel_pending_record()
+    pending_record_id = app.after(HISTORY_SETTLE_MS, record_diagnosis, symptoms, combined_results, version)
 
-        ml_conf = ml_results.get(disease, 0.0)
-        clips_conf = clips_results.get(disease, 0.0)
 
-        # Calculate Final Trust Score (FTS)
-        fts = (ml_conf * W_ML) + (clips_conf * W_CF)
+def cancel_pending_record():
+    global pending_record_id
+    if pending_record_id is not None:
+        app.after_cancel(pending_record_id)
+        pending_record_id = None
 
-        if fts >= 0.1:
-            combined_results.append({
-                "disease": disease,
-                "ml_conf": ml_conf,
-                "clips_conf": clips_conf,
-                "fts": fts
-            })
 
-    # Sort results by Final Trust Score (highest first)
-    combined_results.sort(key=lambda x: x["fts"], reverse=True)
+def show_suggestions(suggestions):
+    """Shows the most informative unselected symptoms to check next."""
+    global current_suggestions
+    current_suggestions = suggestions
+    names = ", ".join(s["symptom"].replace('-', ' ').title() for s in suggestions)
+    suggest_label.config(text=f"{translations[current_lang]['suggest_next']} {names or '-'}")
 
-    # 6. Display Results
 
+def result_rows(combined_results):
+    """(iid, text, values, tag) for each row the Treeview should show, in display order."""
     if not combined_results:
         # If symptoms were selected but nothing matched significantly
-        tree.insert("", "end", text=translations[current_lang]["no_match"],
-                    values=("-", "-", "-", "Monitor closely.", "Re-check symptoms."), tags=('low',))
-        return
+        return [("no-match", translations[current_lang]["no_match"],
+                 ("-", "-", "-", "Monitor closely.", "Re-check symptoms."), "low")]
 
-    # Insert results in Treeview
+    # One row per result (a single 'healthy' row when no symptoms are selected)
+    rows = []
     for result in combined_results:
         disease = result["disease"]
         ml_conf = result["ml_conf"]
         clips_conf = result["clips_conf"]
         fts = result["fts"]
 
-        info = disease_info.get(disease, {"treatment": "-", "prevention": "-"})
-
-        # Determine tag for coloring based on the Final Trust Score
-        if fts >= 75:
-            tag = "high"
-        elif fts >= 40:
-            tag = "medium"
-        else:
-            tag = "low"
+        info = engine.disease_info.get(disease, {"treatment": "-", "prevention": "-"})
+
+        # Disease Name goes in #0 (the 'text' argument), scores/info in the following columns,
+        # and the tag colors the row based on the Final Trust Score
+        rows.append((disease, disease.replace('-', ' ').title(),
+                     (f"{fts:.1f}%", f"{ml_conf:.1f}%", f"{clips_conf:.1f}%", info["treatment"],
+                      info["prevention"]),
+                     result["level"]))
+    return rows
+
+
+def show_results(combined_results):
+    """
+    Brings the Treeview in line with the given results by diffing against its current rows
+    (keyed by disease): stale rows are deleted, changed rows updated, rows moved into order
+    and only new diseases inserted, so toggling one symptom touches just a few items.
+    """
+    rows = result_rows(combined_results)
+    wanted = {iid for iid, _, _, _ in rows}
+
+    for iid in tree.get_children():
+        if iid not in wanted:
+            tree.delete(iid)
+
+    for index, (iid, text, values, tag) in enumerate(rows):
+        if not tree.exists(iid):
+            tree.insert("", index, iid=iid, text=text, values=values, tags=(tag,))
+            continue
 
-        # Insert the row with all values (Disease Name in #0, scores/info in subsequent columns)
-        # The disease name is inserted using the 'text' argument for column #0
-        tree.insert("", "end", text=disease.replace('-', ' ').title(),
-                    values=(f"{fts:.1f}%", f"{ml_conf:.1f}%", f"{clips_conf:.1f}%", info["treatment"],
-                            info["prevention"]),
-                    tags=(tag,))
+        item = tree.item(iid)
+        if item["text"] != text or tuple(map(str, item["values"])) != values or tuple(item["tags"]) != (tag,):
+            tree.item(iid, text=text, values=values, tags=(tag,))
+        if tree.index(iid) != index:
+            tree.move(iid, "", index)
 
 
 def update_language():
@@ -286,6 +319,8 @@ def update_language():
     diagnose_button.config(text=translations[current_lang]["diagnose_btn"])
     reset_button.config(text=translations[current_lang]["reset_btn"])
     exit_button.config(text=translations[current_lang]["exit_btn"])
+    live_check.config(text=translations[current_lang]["live_mode"])
+    show_suggestions(current_suggestions)
     lang_label.config(text=translations[current_lang].get("lang_label", "Language:"))
 
     # --- Treeview Column Configuration ---
@@ -401,9 +436,20 @@ diagnose_button.pack(side=tk.LEFT, padx=(0, 15))
 reset_button = ttk.Button(button_frame, text=translations[current_lang]["reset_btn"], command=reset_selections)
 reset_button.pack(side=tk.LEFT, padx=5)
 
+# Live mode re-diagnoses (debounced) whenever the selection changes
+live_mode = tk.BooleanVar(value=True)
+live_check = ttk.Checkbutton(button_frame, text=translations[current_lang]["live_mode"], variable=live_mode,
+                             command=schedule_diagnosis)
+live_check.pack(side=tk.LEFT, padx=15)
+symptom_listbox.bind("<<ListboxSelect>>", schedule_diagnosis)
+
 exit_button = ttk.Button(button_frame, text=translations[current_lang]["exit_btn"], command=exit_app)
 exit_button.pack(side=tk.RIGHT, padx=0)
 
+# Next symptoms to check, filled in after each diagnosis
+suggest_label = ttk.Label(main_frame, text=translations[current_lang]["suggest_next"], font=('Arial', 10, 'italic'))
+suggest_label.pack(pady=(0, 5), anchor='w')
+
 # ------------------------------------------
 # Results Table Section
 # ------------------------------------------
@@ -435,6 +481,7 @@ tree.configure(yscrollcommand=vsb.set)
 
 # Finalize setup
 update_language()
-diagnose()
+request_diagnosis()
+poll_results()
 
 app.mainloop()
@@ -0,0 +1,437 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+
+from diagnosis_cache import file_digest, file_signature
+from diagnosis_engine import DISEASE_INFO_FILE, RULES_FILE, DiagnosisEngine
+from diagnosis_metrics import metrics
+
+# ==========================================
+# Configuration
+# ==========================================
+WATCH_INTERVAL = 1.0  # seconds between checks of the watched files
+# A change is reloaded once the files have looked the same for this long, so a copy or an
+# editor that is still writing is not read half way
+SETTLE_SECONDS = 0.5
+RELOAD_HISTORY = 20  # reload attempts kept for stats()
+
+
+def file_signatures(paths):
+    return tuple(file_signature(path) for path in paths)
+
+
+# ==========================================
+# Engine Versions and Validation
+# ==========================================
+
+class EngineVersion:
+    """One loaded and validated DiagnosisEngine plus the files it was loaded from."""
+
+    def __init__(self, engine, signatures, load_ms, validate_ms, warnings):
+        self.engine = engine
+        self.number = None  # assigned when the version is swapped in
+        self.signatures = signatures
+        self.digests = {os.path.basename(path): file_digest(path) for path in engine.watched_files}
+        self.loaded_at = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        self.load_ms = load_ms
+        self.validate_ms = validate_ms
+        self.warnings = warnings
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def describe(self):
+        return {
+            "version": self.number,
+            "model_id": self.engine.model_id,
+            "files": self.digests,
+            "loaded_at": self.loaded_at,
+            "load_ms": self.load_ms,
+            "validate_ms": self.validate_ms,
+            "in_flight": self.in_flight,
+        }
+
+
+def validate_engine(engine, reference=None):
+    """
+    Checks a freshly loaded engine before it may serve. Returns (errors, warnings).
+
+    Errors: the rule report's errors (see rule_build.validate_rules), a rule that does not
+    fire on exactly its own conditions, ML probabilities that do not sum to 100%, or any
+    exception while diagnosing those canaries. Warnings: the rule report's warnings and
+    symptoms the reference (current) engine accepts but this one would reject.
+    """
+    from rule_compiler import parse_rules
+
+    errors = list(engine.rule_report["errors"])
+    warnings = list(engine.rule_report["warnings"])
+    if reference is not None:
+        dropped = [s for s in reference.symptom_columns if s not in engine.column_index]
+        if dropped:
+            warnings.append(f"symptoms no longer accepted: {', '.join(dropped)}")
+
+    with open(engine.rules_file, encoding="utf-8") as f:
+        rules = [rule for rule in parse_rules(f.read()) if all(s in engine.column_index for s in rule[1])]
+    if not rules:
+        return errors, warnings
+    try:
+        scores = engine.score([engine.normalize(symptoms) for _, symptoms, _, _ in rules])
+    except Exception as e:
+        errors.append(f"canary diagnosis failed: {type(e).__name__}: {e}")
+        return errors, warnings
+
+    for (name, _, disease, confidence), (ml_results, clips_results) in zip(rules, scores):
+        if clips_results.get(disease, -1.0) < confidence * 100 - 1e-6:
+            errors.append(f"rule {name} does not fire on its own conditions")
+        total = sum(ml_results.values())
+        if abs(total - 100.0) > 1e-3:
+            errors.append(f"ML probabilities for rule {name}'s conditions sum to {total:.3f}%")
+    return errors, warnings
+
+
+# ==========================================
+# Hot-Reloading Engine Handle
+# ==========================================
+
+class ReloadableEngine:
+    """
+    A DiagnosisEngine stand-in that swaps in a new model, rules or disease info without
+    stopping.
+
+    current is an EngineVersion. Each diagnose_batch() call takes current once and uses it
+    to the end, so a reload never changes the version under an in-flight batch; an old
+    engine is released when its last call returns. reload() builds and validates a new
+    engine while current keeps serving, then replaces current in one assignment. A
+    candidate that fails to load or validate is dropped and current stays (rollback);
+    rollback() returns to the previous version on request.
+
+    reload() runs on the caller's thread; request_reload() runs it in the background (the
+    service's /admin/reload and SIGHUP). With watch=True a thread polls the watched files
+    and reloads once a change has settled. The files of a rejected candidate are not
+    retried until they change again.
+    """
+
+    def __init__(self, watch=False, watch_interval=WATCH_INTERVAL, **engine_options):
+        self.engine_options = {"quiet": True, **engine_options, "auto_reload": False}
+        self.watch_interval = watch_interval
+        self.history = deque(maxlen=RELOAD_HISTORY)
+        self.previous = None
+        self.current = None
+        self._next_number = 1
+        self._rejected = None
+        self._reload_lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._reload_thread = None
+        self._stop = threading.Event()
+
+        version, errors = self._load()
+        if errors:
+            raise ValueError(f"Engine failed validation: {'; '.join(errors)}")
+        self._swap(version)
+
+        self._watcher = None
+        if watch:
+            self._watcher = threading.Thread(target=self._watch, name="reload-watcher", daemon=True)
+            self._watcher.start()
+
+    # ------------------------------------------
+    # Engine interface (always the current version)
+    # ------------------------------------------
+
+    @property
+    def engine(self):
+        return self.current.engine
+
+    @property
+    def symptom_columns(self):
+        return self.current.engine.symptom_columns
+
+    @property
+    def classes(self):
+        return self.current.engine.classes
+
+    @property
+    def cache(self):
+        return self.current.engine.cache
+
+    @property
+    def disease_info(self):
+        return self.current.engine.disease_info
+
+    @property
+    def version(self):
+        return self.current.engine.version
+
+    def normalize(self, symptoms):
+        return self.current.engine.normalize(symptoms)
+
+    def diagnose_batch(self, symptom_sets):
+        version = self.current
+        version.enter()
+        try:
+            return version.engine.diagnose_batch(symptom_sets)
+        finally:
+            version.leave()
+
+    def diagnose_batch_versioned(self, symptom_sets):
+        """diagnose_batch() plus the version and disease_info of the engine that ran it."""
+        version = self.current
+        version.enter()
+        try:
+            engine = version.engine
+            return engine.diagnose_batch(symptom_sets), engine.version, engine.disease_info
+        finally:
+            version.leave()
+
+    def diagnose(self, symptoms):
+        return self.diagnose_batch([symptoms])[0]
+
+    # ------------------------------------------
+    # Reloading
+    # ------------------------------------------
+
+    def _load(self):
+        """Builds and validates a candidate from the files on disk. Returns (version, errors)."""
+        # Signatures are taken before loading, so a change made meanwhile triggers another reload
+        files = self.current.engine.watched_files if self.current else None
+        signatures = file_signatures(files) if files else None
+
+        start = time.perf_counter()
+        try:
+            engine = DiagnosisEngine(**self.engine_options)
+        except Exception as e:
+            return None, [f"cannot load: {type(e).__name__}: {e}"]
+        loaded = time.perf_counter()
+        errors, warnings = validate_engine(engine, self.current.engine if self.current else None)
+        validated = time.perf_counter()
+
+        if signatures is None or list(files) != engine.watched_files:
+            signatures = file_signatures(engine.watched_files)
+        version = EngineVersion(engine, signatures, (loaded - start) * 1000, (validated - loaded) * 1000, warnings)
+        return version, errors
+
+    def _swap(self, version):
+        version.number = self._next_number
+        self._next_number += 1
+        self.previous, self.current = self.current, version
+
+    def reload(self, reason="api"):
+        """
+        Loads and validates what is on disk now and swaps it in if it is valid and differs
+        from the current version. Returns the attempt's record (status is "swapped",
+        "unchanged" or "rejected", plus timings and the version in effect).
+        """
+        with self._reload_lock:
+            start = time.perf_counter()
+            candidate, errors = self._load()
+            record = {"reason": reason, "at": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+            if candidate is not None:
+                record.update(load_ms=candidate.load_ms, validate_ms=candidate.validate_ms,
+                              warnings=candidate.warnings)
+
+            if errors:
+                self._rejected = candidate.signatures if candidate else file_signatures(self.engine.watched_files)
+                record.update(status="rejected", errors=errors)
+                print(f"Warning: reload ({reason}) rejected, version {self.current.number} stays in effect: "
+                      f"{errors[0]}")
+            elif candidate.digests == self.current.digests:
+                # Touched but not changed: keep the warm version (and its cache)
+                self.current.signatures = candidate.signatures
+                self._rejected = None
+                record["status"] = "unchanged"
+            else:
+                self._swap(candidate)
+                self._rejected = None
+                record["status"] = "swapped"
+
+            elapsed = time.perf_counter() - start
+            record["total_ms"] = elapsed * 1000
+            record["version"] = self.current.describe()
+            self.history.append(record)
+            if metrics.enabled:
+                metrics.observe("reload", elapsed)
+                metrics.count(f"reloads_{record['status']}")
+            if record["status"] == "swapped":
+                print(f"Reloaded ({reason}) in {elapsed * 1000:.0f} ms: version {self.current.number} in effect")
+            return record
+
+    def request_reload(self, reason="signal"):
+        """Starts reload() on a background thread unless one is running. Returns True if started."""
+        with self._thread_lock:
+            if self._reload_thread is not None and self._reload_thread.is_alive():
+                return False
+            self._reload_thread = threading.Thread(target=self.reload, args=(reason,), name="engine-reload",
+                                                   daemon=True)
+            self._reload_thread.start()
+            return True
+
+    def rollback(self):
+        """Puts the previous version back in effect. Returns the record, or None without one."""
+        with self._reload_lock:
+            if self.previous is None:
+                return None
+            self.previous, self.current = self.current, self.previous
+            # The rolled-back files stay on disk; do not reload them again until they change
+            self._rejected = file_signatures(self.current.engine.watched_files)
+            record = {"reason": "rollback", "at": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "status": "rolled_back",
+                      "version": self.current.describe()}
+            self.history.append(record)
+            print(f"Rolled back to version {self.current.number}")
+            return record
+
+    def _watch(self):
+        pending = None  # (signatures, first seen) of a change waiting to settle
+        while not self._stop.wait(self.watch_interval):
+            try:
+                signatures = file_signatures(self.current.engine.watched_files)
+                if signatures in (self.current.signatures, self._rejected):
+                    pending = None
+                    continue
+                if pending is None or pending[0] != signatures:
+                    pending = (signatures, time.monotonic())
+                    continue
+                if time.monotonic() - pending[1] >= SETTLE_SECONDS:
+                    pending = None
+                    self.reload("watch")
+            except Exception as e:
+                print(f"Error in reload watcher: {e}")
+
+    def close(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+
+    def stats(self):
+        statuses = {}
+        for record in self.history:
+            statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+        return {
+            "version": self.current.describe(),
+            "previous_version": self.previous.describe() if self.previous else None,
+            "watching": self._watcher is not None,
+            "reloads": statuses,
+            "last_reload": self.history[-1] if self.history else None,
+        }
+
+
+# ==========================================
+# Live Reload Check
+# ==========================================
+
+def wait_for(condition, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def verify(watch_interval=0.2):
+    """
+    Serves diagnoses from a watching ReloadableEngine on temporary copies of the rules and
+    disease info while they are edited, broken and fixed. Checks every swap and rejection
+    and that no in-flight diagnosis fails.
+    """
+    from model_artifact import ARTIFACT_DIR
+
+    with open(RULES_FILE, encoding="utf-8") as f:
+        rules_source = f.read()
+    with open(DISEASE_INFO_FILE, encoding="utf-8") as f:
+        info = json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        rules_file = os.path.join(tmp, "rules_model.clp")
+        info_file = os.path.join(tmp, "disease_info.json")
+        artifact_dir = os.path.join(tmp, "model.artifact")
+        shutil.copy(RULES_FILE, rules_file)
+        shutil.copy(DISEASE_INFO_FILE, info_file)
+        shutil.copytree(ARTIFACT_DIR, artifact_dir)
+
+        def write(path, text):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+
+        handle = ReloadableEngine(watch=True, watch_interval=watch_interval, ml_backend="flat",
+                                  rules_backend="compiled", rules_file=rules_file, info_file=info_file,
+                                  artifact_dir=artifact_dir, model_file=os.path.join(tmp, "unused.pkl"),
+                                  fusion_config_file=os.path.join(tmp, "fusion_config.json"), cache_size=256)
+        columns = handle.symptom_columns
+        stop = threading.Event()
+        served = {"batches": 0, "errors": 0}
+
+        def client():
+            rng = random.Random(42)
+            while not stop.is_set():
+                try:
+                    handle.diagnose_batch([rng.sample(columns, rng.randint(1, 5)) for _ in range(32)])
+                    served["batches"] += 1
+                except Exception as e:
+                    served["errors"] += 1
+                    print(f"Error: in-flight diagnosis failed: {e}")
+
+        clients = [threading.Thread(target=client, daemon=True) for _ in range(2)]
+        for thread in clients:
+            thread.start()
+
+        checks = []
+
+        def step(name, edit, expect_status, condition=lambda: True):
+            before = len(handle.history)
+            edit()
+            ok = wait_for(lambda: len(handle.history) > before) and handle.history[-1]["status"] == expect_status
+            ok = ok and condition()
+            record = handle.history[-1] if len(handle.history) > before else {}
+            checks.append(ok)
+            print(f"{'ok ' if ok else 'FAIL'} {name}: {record.get('status', 'no reload')} in "
+                  f"{record.get('total_ms', 0):.0f} ms, version {handle.current.number} in effect")
+
+        new_text = "Updated treatment text."
+        step("new treatment text", lambda: write(info_file, json.dumps(
+            {**info, "early-blight": {**info["early-blight"], "treatment": new_text}}, indent=2)),
+            "swapped", lambda: handle.disease_info["early-blight"]["treatment"] == new_text)
+        step("rule with an unknown symptom", lambda: write(
+            rules_file, rules_source + "\n(defrule broken (logical (symptom (name no-such-symptom)))\n"
+                                       "   => (assert (disease (name early-blight) (confidence 0.5))))\n"),
+            "rejected", lambda: handle.current.number == 2)
+        step("rules fixed with a new CF", lambda: write(
+            rules_file, rules_source.replace("(confidence 0.65)", "(confidence 0.6)", 1)),
+            "swapped", lambda: handle.current.number == 3)
+        step("malformed disease info", lambda: write(info_file, "{not json"), "rejected",
+             lambda: handle.current.number == 3)
+        step("manual rollback", handle.rollback, "rolled_back", lambda: handle.current.number == 2)
+
+        stop.set()
+        for thread in clients:
+            thread.join()
+        handle.close()
+
+    ok = all(checks) and served["errors"] == 0
+    print(f"{served['batches']} batches served during the reloads, {served['errors']} failed.")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hot reload of the model, rules and disease info.")
+    parser.add_argument("--verify", action="store_true", help="edit temporary copies while serving and check reloads")
+    args = parser.parse_args()
+
+    if args.verify:
+        raise SystemExit(0 if verify() else 1)
+    started = time.perf_counter()
+    reloadable = ReloadableEngine(ml_backend="flat", rules_backend="compiled")
+    print(f"Loaded and validated in {(time.perf_counter() - started) * 1000:.0f} ms:")
+    print(json.dumps(reloadable.current.describe(), indent=2))
@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+
+from diagnosis_service import HOST, PORT
+
+
+async def request(reader, writer, method, path, payload=None):
+    """Sends one keep-alive HTTP request and returns (status, decoded JSON body)."""
+    body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+    writer.write((f"{method} {path} HTTP/1.1\r\nHost: {HOST}\r\n"
+                  f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def client(host, port, symptom_sets, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for symptoms in symptom_sets:
+            start = time.perf_counter()
+            status, _ = await request(reader, writer, "POST", "/diagnose", {"symptoms": symptoms})
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def run_load_test(host, port, concurrency, requests_per_client, max_symptoms, distinct, seed):
+    reader, writer = await asyncio.open_connection(host, port)
+    _, health = await request(reader, writer, "GET", "/health")
+    columns = health["symptoms"]
+    _, before = await request(reader, writer, "GET", "/stats")
+
+    # A fixed pool of symptom combinations, so repeat traffic (and the cache) is realistic
+    rng = random.Random(seed)
+    pool = [rng.sample(columns, rng.randint(1, max_symptoms)) for _ in range(distinct)]
+    workloads = [[rng.choice(pool) for _ in range(requests_per_client)] for _ in range(concurrency)]
+
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, workload, latencies, errors) for workload in workloads))
+    elapsed = time.perf_counter() - start
+
+    _, stats = await request(reader, writer, "GET", "/stats")
+    writer.close()
+
+    # Server counters are cumulative; report this run's share
+    batches = stats["batching"]["batches"] - before["batching"]["batches"]
+    served = stats["batching"]["requests"] - before["batching"]["requests"]
+    stats["batching"]["run_batches"] = batches
+    stats["batching"]["run_mean_batch_size"] = served / batches if batches else 0.0
+
+    ms = np.array(latencies) * 1000
+    report = {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "seconds": elapsed,
+        "requests_per_second": len(latencies) / elapsed,
+        "latency_ms": {"mean": float(ms.mean()), "p50": float(np.percentile(ms, 50)),
+                       "p95": float(np.percentile(ms, 95)), "p99": float(np.percentile(ms, 99)),
+                       "max": float(ms.max())},
+        "server": stats,
+    }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the local diagnosis service.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 64],
+                        help="concurrent clients; several values run one test each")
+    parser.add_argument("--requests", type=int, default=200, help="requests per client")
+    parser.add_argument("--max-symptoms", type=int, default=5)
+    parser.add_argument("--distinct", type=int, default=10000, help="distinct symptom combinations")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    for level in args.concurrency:
+        result = asyncio.run(run_load_test(args.host, args.port, level, args.requests,
+                                           args.max_symptoms, args.distinct, args.seed))
+        latency = result["latency_ms"]
+        print(f"concurrency={level:4d}  {result['requests_per_second']:8.1f} req/s  "
+              f"p50={latency['p50']:.1f}ms p95={latency['p95']:.1f}ms p99={latency['p99']:.1f}ms  "
+              f"errors={result['errors']}  mean batch={result['server']['batching']['run_mean_batch_size']:.1f}")
+        print(json.dumps(result))
@@ -0,0 +1,282 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+import numpy as np
+
+from diagnosis_cache import file_digest
+from forest_export import FlatForest
+
+# ==========================================
+# Configuration
+# ==========================================
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ARTIFACT_DIR = os.path.join(BASE_DIR, "tomato_disease_model.artifact")
+MANIFEST_NAME = "manifest.json"
+FORMAT_VERSION = 1
+
+# Cold-start budgets for a short-lived process (see report_cold_start)
+IMPORT_BUDGET_MS = 300
+FIRST_DIAGNOSIS_BUDGET_MS = 150
+
+
+# ==========================================
+# Artifact Layout
+# ==========================================
+# <ARTIFACT_DIR>/manifest.json          format version, schema, classes, metadata, array files,
+#                                      and the pickled model it was built from (source)
+# <ARTIFACT_DIR>/<model_id>.<name>.npy  raw forest node arrays, memory-mappable with np.load
+#                                      (plus symptom_counts: per-disease symptom counts of
+#                                      the training rows, used by symptom_advisor.py)
+#
+# Array files carry the model id, and the manifest is replaced last with os.replace, so a
+# reader always sees one complete model: either the old manifest and its arrays or the new.
+
+def artifact_dir_for(model_file):
+    """The artifact served for a pickled model, next to it (model.pkl -> model.artifact)."""
+    return os.path.splitext(model_file)[0] + ".artifact"
+
+
+def manifest_path(artifact_dir=ARTIFACT_DIR):
+    return os.path.join(artifact_dir, MANIFEST_NAME)
+
+
+def source_record(model_file):
+    """Identifies the pickled model an artifact is built from, for matches_source()."""
+    st = os.stat(model_file)
+    return {"file": os.path.basename(model_file), "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+            "digest": file_digest(model_file)}
+
+
+def matches_source(manifest, model_file):
+    """
+    Whether the artifact was built from model_file as it is on disk now. Without a
+    model_file to compare with, the artifact stands on its own.
+    """
+    if not model_file or not os.path.exists(model_file):
+        return True
+    source = manifest.get("source") or {}
+    st = os.stat(model_file)
+    if source.get("size") != st.st_size:
+        return False
+    # An unchanged mtime skips hashing; a file copied into place is compared by content
+    return source.get("mtime_ns") == st.st_mtime_ns or source.get("digest") == file_digest(model_file)
+
+
+def symptom_stats(X, y):
+    """
+    Per-disease counts of the training rows and of the rows showing each symptom, from a
+    (rows x symptom_columns) 0/1 matrix and its disease labels.
+    """
+    X = np.asarray(X) != 0
+    diseases, labels = np.unique(np.asarray(y).astype(str), return_inverse=True)
+    counts = np.zeros((len(diseases), X.shape[1]), dtype=np.int64)
+    for i in range(len(diseases)):
+        counts[i] = X[labels == i].sum(axis=0)
+    return {"diseases": diseases.tolist(), "rows": np.bincount(labels, minlength=len(diseases)).tolist(),
+            "counts": counts}
+
+
+def save_artifact(forest, symptom_columns, metadata=None, artifact_dir=ARTIFACT_DIR, stats=None, source_model=None):
+    """
+    Writes a FlatForest plus its symptom schema, training metadata and, if given, the
+    symptom_stats() of its training data and the pickled model it was exported from.
+    Returns the manifest.
+    """
+    symptom_columns = list(symptom_columns)
+    if forest.feature_names and forest.feature_names != symptom_columns:
+        raise ValueError("Forest features do not match the symptom columns")
+    if stats is not None and np.shape(stats["counts"]) != (len(stats["diseases"]), len(symptom_columns)):
+        raise ValueError("Symptom counts do not match the diseases and symptom columns")
+
+    os.makedirs(artifact_dir, exist_ok=True)
+    model_id = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    try:
+        previous_arrays = list(load_manifest(artifact_dir)["arrays"].values())
+    except (OSError, ValueError, KeyError):
+        previous_arrays = []
+
+    to_save = {name: array for name, array in forest.to_arrays().items()
+               if name not in ("classes", "feature_names", "max_depth")}
+    if stats is not None:
+        to_save["symptom_counts"] = stats["counts"]
+    arrays = {}
+    for name, array in to_save.items():
+        filename = f"{model_id}.{name}.npy"
+        np.save(os.path.join(artifact_dir, filename), np.ascontiguousarray(array))
+        arrays[name] = filename
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "model_id": model_id,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "symptom_columns": symptom_columns,
+        "classes": [str(c) for c in forest.classes_],
+        "n_estimators": forest.n_estimators,
+        "n_nodes": int(len(forest.feature)),
+        "max_depth": forest.max_depth,
+        "metadata": metadata or {},
+        "source": source_record(source_model) if source_model else None,
+        "arrays": arrays,
+    }
+    if stats is not None:
+        manifest["symptom_stats"] = {"diseases": list(stats["diseases"]), "rows": [int(n) for n in stats["rows"]]}
+
+    tmp_path = manifest_path(artifact_dir) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path(artifact_dir))
+
+    # The replaced model's arrays are no longer referenced; open memory maps stay valid on
+    # POSIX. Only files the old manifest listed are removed, never anything else in the directory
+    for filename in previous_arrays:
+        if os.path.basename(filename) == filename and filename not in arrays.values():
+            try:
+                os.remove(os.path.join(artifact_dir, filename))
+            except OSError:
+                pass
+    return manifest
+
+
+def load_manifest(artifact_dir=ARTIFACT_DIR):
+    with open(manifest_path(artifact_dir), encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported model artifact format: {manifest.get('format_version')}")
+    return manifest
+
+
+def load_artifact(artifact_dir=ARTIFACT_DIR, mmap=True):
+    """
+    Loads (forest, symptom_columns, manifest). Only NumPy is imported; with mmap the node
+    arrays are mapped read-only instead of read, so pages are shared between processes.
+    """
+    manifest = load_manifest(artifact_dir)
+    arrays = {name: np.load(os.path.join(artifact_dir, filename), mmap_mode="r" if mmap else None)
+              for name, filename in manifest["arrays"].items() if name != "symptom_counts"}
+    arrays["classes"] = np.array(manifest["classes"])
+    arrays["feature_names"] = np.array(manifest["symptom_columns"])
+    arrays["max_depth"] = np.array(manifest["max_depth"])
+    return FlatForest.from_arrays(arrays), manifest["symptom_columns"], manifest
+
+
+def load_symptom_stats(artifact_dir=ARTIFACT_DIR):
+    """
+    The symptom_stats() saved with the model, plus the symptom_columns its counts are over,
+    or None if the artifact has none (written before they were recorded).
+    """
+    manifest = load_manifest(artifact_dir)
+    if "symptom_stats" not in manifest:
+        return None
+    counts = np.load(os.path.join(artifact_dir, manifest["arrays"]["symptom_counts"]))
+    return {**manifest["symptom_stats"], "counts": counts, "symptom_columns": manifest["symptom_columns"]}
+
+
+def training_metadata(clf, X, y, source_file=None):
+    """Training details recorded in the manifest."""
+    import sklearn
+
+    params = clf.get_params()
+    return {
+        "sklearn_version": sklearn.__version__,
+        "n_samples": int(len(X)),
+        "class_counts": {str(k): int(v) for k, v in zip(*np.unique(np.asarray(y), return_counts=True))},
+        "params": {k: v for k, v in params.items() if isinstance(v, (int, float, str, bool, type(None)))},
+        "source_file": os.path.basename(source_file) if source_file else None,
+    }
+
+
+def build_from_model(model_file, artifact_dir=ARTIFACT_DIR, csv_file=None):
+    """Builds the artifact from an existing pickled model (and, if given, its training CSV)."""
+    import joblib
+
+    clf = joblib.load(model_file)
+    columns = getattr(clf, "feature_names_in_", None)
+    metadata = {"source_model": os.path.basename(model_file)}
+    if csv_file:
+        import pandas as pd
+
+        df = pd.read_csv(csv_file)
+        columns = df.columns[:-1]
+        metadata.update(training_metadata(clf, df, df["disease"], csv_file))
+        stats = symptom_stats(df[columns], df["disease"])
+    else:
+        stats = None
+    if columns is None:
+        raise ValueError("Model has no feature names; pass the training CSV to recover the schema")
+    return save_artifact(FlatForest.from_sklearn(clf), list(columns), metadata, artifact_dir, stats, model_file)
+
+
+# ==========================================
+# Cold-Start Budget
+# ==========================================
+
+COLD_START_SCRIPT = """
+import json, sys, time
+t0 = time.perf_counter()
+import diagnosis_engine
+t1 = time.perf_counter()
+engine = diagnosis_engine.DiagnosisEngine(ml_backend=sys.argv[1], rules_backend=sys.argv[2], quiet=True)
+t2 = time.perf_counter()
+engine.diagnose(engine.symptom_columns[:2])
+t3 = time.perf_counter()
+heavy = [m for m in ("pandas", "joblib", "sklearn", "clips") if m in sys.modules]
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "load_ms": (t2 - t1) * 1000,
+                  "first_diagnosis_ms": (t3 - t1) * 1000, "heavy_modules": heavy}))
+"""
+
+
+def measure_cold_start(ml_backend, rules_backend, runs=5):
+    """Median timings of fresh interpreters doing import -> load -> first diagnosis."""
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", COLD_START_SCRIPT, ml_backend, rules_backend],
+                             cwd=BASE_DIR, capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    result = {key: float(np.median([s[key] for s in samples]))
+              for key in ("import_ms", "load_ms", "first_diagnosis_ms")}
+    result["heavy_modules"] = samples[-1]["heavy_modules"]
+    return result
+
+
+def report_cold_start(runs=5):
+    """Prints cold-start timings for each configuration against the budgets. Returns True if within budget."""
+    ok = True
+    print(f"Budget: import <= {IMPORT_BUDGET_MS} ms, import-to-first-diagnosis <= {FIRST_DIAGNOSIS_BUDGET_MS} ms "
+          f"(artifact + compiled rules)")
+    for ml_backend, rules_backend in (("sklearn", "clips"), ("flat", "clips"), ("flat", "compiled")):
+        result = measure_cold_start(ml_backend, rules_backend, runs)
+        line = (f"  ml={ml_backend:<7} rules={rules_backend:<8} import {result['import_ms']:7.1f} ms  "
+                f"load {result['load_ms']:7.1f} ms  first diagnosis {result['first_diagnosis_ms']:7.1f} ms  "
+                f"heavy modules: {', '.join(result['heavy_modules']) or 'none'}")
+        if (ml_backend, rules_backend) == ("flat", "compiled"):
+            within = (result["import_ms"] <= IMPORT_BUDGET_MS
+                      and result["first_diagnosis_ms"] <= FIRST_DIAGNOSIS_BUDGET_MS)
+            ok = ok and within
+            line += "  [within budget]" if within else "  [OVER BUDGET]"
+        print(line)
+    return ok
+
+
+if __name__ == "__main__":
+    from diagnosis_engine import CSV_FILE, MODEL_FILE
+
+    parser = argparse.ArgumentParser(description="Build the self-describing model artifact or report cold start.")
+    parser.add_argument("--model", default=MODEL_FILE, help="pickled RandomForestClassifier")
+    parser.add_argument("--csv", default=CSV_FILE, help="training CSV (for schema and metadata)")
+    parser.add_argument("--output", help="artifact directory (default: next to --model)")
+    parser.add_argument("--report", action="store_true", help="measure import and first-diagnosis time")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.report:
+        raise SystemExit(0 if report_cold_start(args.runs) else 1)
+
+    output = args.output or artifact_dir_for(args.model)
+    built = build_from_model(args.model, output, args.csv)
+    print(f"Wrote model artifact {built['model_id']} ({built['n_estimators']} trees, "
+          f"{len(built['symptom_columns'])} symptoms, {len(built['classes'])} classes) to {output}")
@@ -0,0 +1,632 @@
+import argparse
+import atexit
+import collections
+import multiprocessing
+import os
+import random
+import signal
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+import numpy as np
+
+from diagnosis_engine import DiagnosisEngine, normalize_symptoms
+from forest_export import FlatForest
+from rule_compiler import CompiledRules
+
+# ==========================================
+# Configuration
+# ==========================================
+WORKERS = max(1, min(4, os.cpu_count() or 1))
+# Larger diagnose_batch() calls are split into jobs of this many rows, spread over the workers
+CHUNK_SIZE = 256
+# How often the supervisor looks for workers that died
+MONITOR_INTERVAL = 0.5
+START_TIMEOUT = 60.0
+SHUTDOWN_TIMEOUT = 5.0
+# Arrays in the shared block start on cache-line boundaries
+ALIGNMENT = 64
+
+# forkserver forks each worker from a small single-threaded server that has already imported
+# NumPy and the engine, so workers start quickly, share those pages, and can be replaced
+# safely while the supervisor thread runs. spawn is the portable fallback.
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+MEMORY_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+# ==========================================
+# Shared Model Block
+# ==========================================
+
+def share_arrays(arrays):
+    """
+    Copies a dict of arrays into one new SharedMemory block.
+    Returns (block, layout); layout is a small picklable dict attach_arrays() maps back to arrays.
+    """
+    offsets = {}
+    size = 0
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        size = -(-size // ALIGNMENT) * ALIGNMENT
+        offsets[name] = (size, array.dtype.str, array.shape)
+        size += array.nbytes
+
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for name, array in arrays.items():
+        offset, dtype, shape = offsets[name]
+        view = np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset)
+        view[...] = array
+        del view
+    return block, {"name": block.name, "arrays": offsets}
+
+
+def attach_arrays(layout):
+    """Maps a block made by share_arrays(). Returns (block, arrays) with read-only, zero-copy views."""
+    # Workers share their parent's resource tracker, which already tracks the block, so
+    # attaching here neither adds an owner nor unlinks it when the worker exits
+    block = shared_memory.SharedMemory(name=layout["name"])
+
+    arrays = {}
+    for name, (offset, dtype, shape) in layout["arrays"].items():
+        array = np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset)
+        array.flags.writeable = False
+        arrays[name] = array
+    return block, arrays
+
+
+def share_engine(engine):
+    """
+    Copies the forest node arrays and compiled rule tables of a flat/compiled engine into a
+    shared block. The layout also carries the schema, fusion settings and rule report, so a
+    worker needs nothing from disk.
+    """
+    if engine.ml_backend != "flat" or engine.compiled_rules is None:
+        raise ValueError("Only engines with ml_backend='flat' and rules_backend='compiled' can be shared")
+
+    arrays = {f"forest.{name}": array for name, array in engine.clf.to_arrays().items()}
+    arrays["forest.is_leaf"] = engine.clf.is_leaf
+    arrays.update({f"rules.{name}": array for name, array in engine.compiled_rules.to_arrays().items()})
+    block, layout = share_arrays(arrays)
+    layout.update(rules_file=engine.rules_file, symptom_columns=engine.symptom_columns,
+                  model_id=engine.model_id, fusion=engine.fusion, rule_report=engine.rule_report,
+                  disease_info=engine.disease_info, version=engine.version)
+    return block, layout
+
+
+def prefixed(arrays, prefix):
+    return {name[len(prefix):]: array for name, array in arrays.items() if name.startswith(prefix)}
+
+
+class SharedDiagnosisEngine(DiagnosisEngine):
+    """
+    A flat/compiled DiagnosisEngine whose forest and rule tables are views into a block
+    shared by share_engine() in another process. Nothing is read from disk or copied.
+    """
+
+    def __init__(self, layout):
+        self.layout = layout
+        super().__init__(rules_file=layout["rules_file"], rules_backend="compiled", ml_backend="flat",
+                         quiet=True)
+
+    def load(self):
+        self.block, arrays = attach_arrays(self.layout)
+        forest = prefixed(arrays, "forest.")
+        self.clf = FlatForest.from_arrays(forest)
+        self.clf.is_leaf = forest["is_leaf"]
+        self.compiled_rules = CompiledRules.from_arrays(prefixed(arrays, "rules."))
+
+        self.fusion = dict(self.layout["fusion"])
+        self.model_id = self.layout["model_id"]
+        self.symptom_columns = list(self.layout["symptom_columns"])
+        self.classes = self.clf.classes_.tolist()
+        self.column_index = {name: i for i, name in enumerate(self.symptom_columns)}
+        self.clips_pool = None
+        self.clips_session = None
+        self.rule_report = self.layout["rule_report"]
+        self.disease_info = self.layout["disease_info"]
+        self.version = self.layout["version"]
+
+
+# ==========================================
+# Worker Process
+# ==========================================
+
+def worker_main(layout, conn):
+    """Diagnoses the (job_id, symptom_sets) jobs the supervisor sends over conn until it sends None."""
+    # Ctrl+C reaches the whole process group; shutdown is the supervisor's job
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        engine = SharedDiagnosisEngine(layout)
+    except Exception as e:
+        conn.send(("failed", None, f"{type(e).__name__}: {e}"))
+        return
+    conn.send(("ready", None, None))
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:  # the supervisor is gone
+            break
+        if job is None:
+            break
+        job_id, symptom_sets = job
+        try:
+            conn.send(("done", job_id, engine.diagnose_batch(symptom_sets)))
+        except Exception as e:
+            conn.send(("error", job_id, (type(e).__name__, str(e))))
+
+
+class Worker:
+    """One worker process, the supervisor's end of its pipe and the job it is running."""
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.ready = False
+        self.job = None
+        self.jobs_done = 0
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+
+# ==========================================
+# Prefork Supervisor
+# ==========================================
+
+class PreforkPool:
+    """
+    Prefork diagnosis workers that share one copy of the model.
+
+    The parent loads the flat forest and compiled rules once and copies their arrays into a
+    single shared memory block; every worker evaluates straight from that block, so the node
+    and rule arrays are in RAM once however many workers run (see memory_report()).
+
+    A supervisor thread owns one pipe per worker and hands each queued job to the next idle
+    worker. It watches the worker processes as well, so a worker that dies only fails the
+    job it was running and is replaced; nothing shared between workers can be left locked.
+    Offers the DiagnosisEngine calls the service uses (normalize, diagnose_batch,
+    symptom_columns, cache), so it can stand in for an engine.
+    """
+
+    def __init__(self, workers=WORKERS, chunk_size=CHUNK_SIZE, start_timeout=START_TIMEOUT, **engine_options):
+        if workers < 1:
+            raise ValueError("A prefork pool needs at least 1 worker")
+        engine = DiagnosisEngine(ml_backend="flat", rules_backend="compiled", quiet=True, **engine_options)
+        self.block, self.layout = share_engine(engine)
+        self.symptom_columns = engine.symptom_columns
+        self.column_index = engine.column_index
+        self.classes = engine.classes
+        self.model_id = engine.model_id
+        self.disease_info = engine.disease_info
+        self.version = engine.version
+        self.cache = None
+        del engine
+
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.restarts = 0
+        self._context = multiprocessing.get_context(START_METHOD)
+        if START_METHOD == "forkserver":
+            self._context.set_forkserver_preload(["prefork_pool"])
+
+        self._workers = []
+        self._pending = collections.deque()  # (job_id, symptom_sets, future) waiting for a worker
+        self._running = {}  # job_id -> future
+        self._next_job = 0
+        self._lock = threading.Lock()
+        self._closing = False
+        # submit() and close() write a byte here to wake the supervisor
+        self._wake_reader, self._wake_writer = multiprocessing.Pipe(duplex=False)
+
+        try:
+            for _ in range(workers):
+                self._start_worker()
+            self._wait_ready(start_timeout)
+        except Exception:
+            self._stop_workers()
+            self._release()
+            raise
+        self._supervisor = threading.Thread(target=self._supervise, name="prefork-supervisor", daemon=True)
+        self._supervisor.start()
+        # Runs before multiprocessing's own exit hook terminates the workers, which would
+        # otherwise look like crashes to the supervisor
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _start_worker(self):
+        conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=worker_main, args=(self.layout, child_conn),
+                                        name="prefork-worker", daemon=True)
+        process.start()
+        child_conn.close()
+        worker = Worker(process, conn)
+        self._workers.append(worker)
+        return worker
+
+    def _wait_ready(self, timeout):
+        deadline = time.monotonic() + timeout
+        while not all(worker.ready for worker in self._workers):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Prefork workers not ready within {timeout}s")
+            for worker, message in self._poll(remaining):
+                if message is None:
+                    raise RuntimeError(f"Prefork worker {worker.pid} exited with code "
+                                       f"{worker.process.exitcode} during startup")
+                if message[0] == "failed":
+                    raise RuntimeError(f"Prefork worker {worker.pid} failed to start: {message[2]}")
+                worker.ready = True
+
+    # ------------------------------------------
+    # Job submission
+    # ------------------------------------------
+
+    def normalize(self, symptoms):
+        """Validates symptom names and returns them de-duplicated in column order."""
+        return normalize_symptoms(symptoms, self.symptom_columns, self.column_index)
+
+    def submit(self, symptom_sets):
+        """Queues one job for the next idle worker. Returns a Future of its diagnose_batch() result."""
+        future = Future()
+        with self._lock:
+            if self._closing:
+                raise RuntimeError("Prefork pool is closed")
+            job_id = self._next_job
+            self._next_job += 1
+            self._pending.append((job_id, list(symptom_sets), future))
+            self._wake_writer.send_bytes(b"")
+        return future
+
+    def diagnose_batch(self, symptom_sets):
+        """Diagnoses a list of symptom collections, split into CHUNK_SIZE jobs across the workers."""
+        symptom_sets = list(symptom_sets)
+        futures = [self.submit(symptom_sets[i:i + self.chunk_size])
+                   for i in range(0, len(symptom_sets), self.chunk_size)]
+        return [result for future in futures for result in future.result()]
+
+    def diagnose_batch_versioned(self, symptom_sets):
+        """diagnose_batch() plus the version and disease_info, which are fixed for the pool's lifetime."""
+        return self.diagnose_batch(symptom_sets), self.version, self.disease_info
+
+    def diagnose(self, symptoms):
+        return self.diagnose_batch([symptoms])[0]
+
+    # ------------------------------------------
+    # Supervisor thread
+    # ------------------------------------------
+
+    def _supervise(self):
+        while True:
+            self._dispatch()
+            with self._lock:
+                if self._closing and not self._pending and not self._running:
+                    return
+            for worker, message in self._poll(MONITOR_INTERVAL):
+                if worker not in self._workers:  # already replaced
+                    continue
+                if message is None:
+                    self._replace(worker)
+                else:
+                    self._handle(worker, message)
+
+    def _poll(self, timeout):
+        """Waits for worker messages or exits. Returns (worker, message) pairs; None means it died."""
+        handles = {}
+        for worker in self._workers:
+            handles[worker.conn] = worker
+            handles[worker.process.sentinel] = worker
+
+        events = []
+        for handle in wait(list(handles) + [self._wake_reader], timeout):
+            if handle is self._wake_reader:
+                while self._wake_reader.poll():
+                    self._wake_reader.recv_bytes()
+                continue
+            worker = handles[handle]
+            if handle is worker.conn:
+                try:
+                    events.append((worker, worker.conn.recv()))
+                except (EOFError, OSError):
+                    events.append((worker, None))
+            elif not worker.conn.poll():  # exited with nothing left to read
+                events.append((worker, None))
+        return events
+
+    def _dispatch(self):
+        """Sends queued jobs to idle workers, one job per worker at a time."""
+        assigned = []
+        with self._lock:
+            if not self._workers:
+                failed, self._pending = list(self._pending), collections.deque()
+            else:
+                failed = []
+                # The least used idle worker goes first, so every worker stays warm
+                idle = sorted((worker for worker in self._workers if worker.ready and worker.job is None),
+                              key=lambda worker: worker.jobs_done)
+                for worker in idle:
+                    if not self._pending:
+                        break
+                    job_id, symptom_sets, future = self._pending.popleft()
+                    worker.job = job_id
+                    self._running[job_id] = future
+                    assigned.append((worker, (job_id, symptom_sets)))
+        for _, _, future in failed:
+            future.set_exception(RuntimeError("No prefork workers are running"))
+        for worker, job in assigned:
+            try:
+                worker.conn.send(job)
+            except OSError:
+                pass  # the worker is gone; _poll() reports it and its job is failed there
+
+    def _handle(self, worker, message):
+        kind, job_id, value = message
+        if kind == "ready":
+            worker.ready = True
+            return
+        if kind == "failed":
+            print(f"Error: prefork worker {worker.pid} failed to start: {value}")
+            self._workers.remove(worker)
+            return
+
+        with self._lock:
+            future = self._running.pop(job_id, None)
+        worker.job = None
+        worker.jobs_done += 1
+        if future is None:
+            return
+        if kind == "done":
+            future.set_result(value)
+        else:
+            name, text = value
+            future.set_exception(ValueError(text) if name == "ValueError" else RuntimeError(f"{name}: {text}"))
+
+    def _replace(self, worker):
+        self._workers.remove(worker)
+        worker.conn.close()
+        worker.process.join()
+        exitcode = worker.process.exitcode
+        if worker.job is not None:
+            with self._lock:
+                future = self._running.pop(worker.job, None)
+            if future is not None:
+                future.set_exception(RuntimeError(f"Prefork worker {worker.pid} exited (code {exitcode}) "
+                                                  "while diagnosing"))
+        if self._closing:
+            return
+        if not worker.ready:
+            # Restarting a worker that cannot start would only spin
+            print(f"Error: prefork worker {worker.pid} exited with code {exitcode} during startup")
+            return
+
+        print(f"Warning: prefork worker {worker.pid} exited with code {exitcode}; starting a replacement")
+        self.restarts += 1
+        try:
+            self._start_worker()
+        except Exception as e:
+            print(f"Error: could not start a replacement worker: {e}")
+
+    # ------------------------------------------
+    # Shutdown
+    # ------------------------------------------
+
+    def _stop_workers(self):
+        for worker in self._workers:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for worker in self._workers:
+            worker.process.join(max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join()
+            worker.conn.close()
+        self._workers = []
+
+    def _release(self):
+        self._wake_reader.close()
+        self._wake_writer.close()
+        self.block.close()
+        self.block.unlink()
+
+    def close(self):
+        """Lets the workers finish every submitted job, stops them and frees the shared block."""
+        with self._lock:
+            if self._closing:
+                return
+            self._closing = True
+            self._wake_writer.send_bytes(b"")
+        atexit.unregister(self.close)
+        self._supervisor.join()
+        self._stop_workers()
+        self._release()
+
+    # ------------------------------------------
+    # Reporting
+    # ------------------------------------------
+
+    def stats(self):
+        workers = list(self._workers)
+        with self._lock:
+            pending, running = len(self._pending), len(self._running)
+        return {
+            "workers": len(workers),
+            "start_method": START_METHOD,
+            "restarts": self.restarts,
+            "pending_jobs": pending,
+            "running_jobs": running,
+            "jobs_done": {str(worker.pid): worker.jobs_done for worker in workers},
+            "shared_block_bytes": self.block.size,
+        }
+
+    def memory_report(self):
+        """Memory of the supervisor and every worker (see memory_report())."""
+        pids = [("supervisor", os.getpid())] + [("worker", worker.pid) for worker in list(self._workers)]
+        report = memory_report(pids)
+        report["shared_block_bytes"] = self.block.size
+        return report
+
+
+# ==========================================
+# Memory Reporting
+# ==========================================
+
+def process_memory(pid):
+    """
+    RSS, PSS, shared and private memory of a process in kB from /proc/<pid>/smaps_rollup, or
+    None where that is not available. PSS divides each shared page between the processes
+    mapping it, so summing PSS over processes counts the shared model once.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", encoding="ascii") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    values = dict.fromkeys(MEMORY_FIELDS, 0)
+    for line in lines:
+        name, _, rest = line.partition(":")
+        if name in values:
+            values[name] = int(rest.split()[0])
+    return {
+        "rss_kb": values["Rss"],
+        "pss_kb": values["Pss"],
+        "shared_kb": values["Shared_Clean"] + values["Shared_Dirty"],
+        "private_kb": values["Private_Clean"] + values["Private_Dirty"],
+    }
+
+
+def memory_report(pids):
+    """Per-process memory for (role, pid) pairs plus RSS and PSS totals."""
+    processes = []
+    for role, pid in pids:
+        memory = process_memory(pid)
+        if memory is not None:
+            processes.append({"role": role, "pid": pid, **memory})
+    return {
+        "processes": processes,
+        "total_rss_kb": sum(p["rss_kb"] for p in processes),
+        "total_pss_kb": sum(p["pss_kb"] for p in processes),
+    }
+
+
+def print_memory_report(title, report):
+    print(title)
+    if not report["processes"]:
+        print("  (per-process memory needs /proc/<pid>/smaps_rollup; not available here)")
+        return
+    print(f"  {'role':<11}{'pid':>8}{'RSS MB':>10}{'PSS MB':>10}{'shared MB':>11}{'private MB':>12}")
+    for p in report["processes"]:
+        print(f"  {p['role']:<11}{p['pid']:>8}{p['rss_kb'] / 1024:>10.1f}{p['pss_kb'] / 1024:>10.1f}"
+              f"{p['shared_kb'] / 1024:>11.1f}{p['private_kb'] / 1024:>12.1f}")
+    print(f"  {'total':<19}{report['total_rss_kb'] / 1024:>10.1f}{report['total_pss_kb'] / 1024:>10.1f}")
+
+
+# ==========================================
+# Verification and Memory Comparison
+# ==========================================
+
+def random_symptom_sets(columns, n_sets, seed=42):
+    rng = random.Random(seed)
+    return [rng.sample(columns, rng.randint(1, 8)) for _ in range(n_sets)]
+
+
+def verify(workers=WORKERS, n_sets=2000):
+    """Checks the pool's results against an in-process flat/compiled engine."""
+    engine = DiagnosisEngine(ml_backend="flat", rules_backend="compiled", quiet=True)
+    symptom_sets = random_symptom_sets(engine.symptom_columns, n_sets)
+    expected = engine.diagnose_batch(symptom_sets)
+
+    with PreforkPool(workers) as pool:
+        start = time.perf_counter()
+        results = pool.diagnose_batch(symptom_sets)
+        elapsed = time.perf_counter() - start
+        stats = pool.stats()
+
+    mismatches = sum(result != reference for result, reference in zip(results, expected))
+    print(f"{n_sets} symptom sets over {workers} worker(s) in {elapsed * 1000:.1f} ms: "
+          f"{mismatches} mismatch(es); jobs per worker {sorted(stats['jobs_done'].values())}")
+    return mismatches == 0
+
+
+def standalone_worker(engine_options, ready, stop):
+    """A worker that loads its own engine, as each process would without the shared block."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    engine = DiagnosisEngine(quiet=True, **engine_options)
+    engine.diagnose_batch(random_symptom_sets(engine.symptom_columns, 500))
+    ready.put(os.getpid())
+    stop.wait()
+
+
+def compare_memory(workers=WORKERS, baseline_backend="sklearn", n_sets=2000):
+    """
+    Total memory of the prefork pool vs the same number of workers that each load their
+    own engine (ml_backend=baseline_backend, compiled rules). Both warm up first.
+    """
+    context = multiprocessing.get_context(START_METHOD)
+    ready, stop = context.Queue(), context.Event()
+    standalone = [context.Process(target=standalone_worker, name="standalone-worker", daemon=True,
+                                  args=({"ml_backend": baseline_backend, "rules_backend": "compiled"}, ready, stop))
+                  for _ in range(workers)]
+    for process in standalone:
+        process.start()
+    try:
+        pids = [ready.get(timeout=START_TIMEOUT) for _ in standalone]
+        independent = memory_report([("worker", pid) for pid in pids])
+    finally:
+        stop.set()
+        for process in standalone:
+            process.join()
+
+    with PreforkPool(workers) as pool:
+        columns = pool.symptom_columns
+        # One job per worker at a time, so every worker touches the whole model
+        for _ in range(4):
+            futures = [pool.submit(random_symptom_sets(columns, n_sets // workers, seed=i)) for i in range(workers)]
+            for future in futures:
+                future.result()
+        shared = pool.memory_report()
+        workers_only = memory_report([(p["role"], p["pid"]) for p in shared["processes"] if p["role"] == "worker"])
+
+    print_memory_report(f"{workers} independent worker(s), each loading its own {baseline_backend} model:",
+                        independent)
+    print_memory_report(f"Prefork pool, {workers} worker(s) on one {shared['shared_block_bytes'] / 1024:.0f} kB "
+                        "shared model block:", shared)
+    if independent["processes"] and workers_only["processes"]:
+        saved = independent["total_pss_kb"] - workers_only["total_pss_kb"]
+        print(f"Worker PSS: {workers_only['total_pss_kb'] / 1024:.1f} MB shared vs "
+              f"{independent['total_pss_kb'] / 1024:.1f} MB independent ({saved / 1024:+.1f} MB saved, "
+              f"{shared['total_pss_kb'] / 1024:.1f} MB including the supervisor)")
+    return independent, shared
+
+
+if __name__ == "__main__":
+    # Use the importable module, so worker processes unpickle the same classes and functions
+    import prefork_pool
+
+    parser = argparse.ArgumentParser(description="Prefork diagnosis workers sharing one copy of the model.")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--sets", type=int, default=2000, help="symptom sets to diagnose")
+    parser.add_argument("--verify", action="store_true", help="compare pool results with an in-process engine")
+    parser.add_argument("--compare", action="store_true", help="compare memory with independently loaded workers")
+    parser.add_argument("--baseline", choices=("sklearn", "flat"), default="sklearn",
+                        help="model backend of the independent workers in --compare")
+    args = parser.parse_args()
+
+    ok = True
+    if args.verify or not args.compare:
+        ok = prefork_pool.verify(args.workers, args.sets)
+    if args.compare:
+        prefork_pool.compare_memory(args.workers, args.baseline, args.sets)
+    raise SystemExit(0 if ok else 1)
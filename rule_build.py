@@ -0,0 +1,188 @@
+import argparse
+import difflib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from diagnosis_engine import (RULES_FILE, disease_info, load_rules, rules_image_is_current, rules_image_path,
+                              rules_image_stamp)
+from rule_compiler import parse_rules, rules_without_logical_support
+
+# ==========================================
+# Configuration
+# ==========================================
+BENCHMARK_RUNS = 50
+
+
+# ==========================================
+# Schema Validation
+# ==========================================
+
+def likely_alias(name, candidates):
+    """A candidate that is probably the same disease/symptom under another name, or None."""
+    candidates = list(candidates)
+    # e.g. mosaic-virus vs tomato-mosaic-virus
+    for candidate in candidates:
+        if candidate.endswith("-" + name) or name.endswith("-" + candidate):
+            return candidate
+    matches = difflib.get_close_matches(name, candidates, n=1, cutoff=0.8)
+    return matches[0] if matches else None
+
+
+def close_match(name, candidates):
+    alias = likely_alias(name, candidates)
+    return f" (did you mean {alias}?)" if alias else ""
+
+
+def validate_rules(rules_file, symptom_columns, classes, info=None, rules_backend="incremental"):
+    """
+    Checks the rules against the model schema. Returns {"errors", "warnings", "notes"} lists.
+
+    Errors: the source does not parse, a rule uses a symptom the model has no column for
+    (the rule can never fire), or, for the incremental backend, a rule's conditions are
+    outside (logical ...) (its conclusion would outlive a retracted symptom; the other
+    backends only warn). Warnings: a model class no rule concludes, a rule disease that
+    looks like a model class under another name (the two scores never meet in the fusion,
+    so one is always 0%), or a disease without a treatment/prevention entry in disease_info.
+    Notes: rule diseases the model does not cover at all, scored by the rules alone.
+    """
+    info = disease_info if info is None else info
+    errors, warnings, notes = [], [], []
+    try:
+        with open(rules_file, encoding="utf-8") as f:
+            source = f.read()
+        rules = parse_rules(source)
+    except (OSError, ValueError) as e:
+        return {"errors": [f"cannot parse {rules_file}: {e}"], "warnings": [], "notes": []}
+
+    columns = set(symptom_columns)
+    for name, symptoms, _, _ in rules:
+        for symptom in symptoms:
+            if symptom not in columns:
+                errors.append(f"rule {name}: unknown symptom {symptom}{close_match(symptom, columns)}")
+    for name in rules_without_logical_support(source):
+        message = f"rule {name}: conditions are not inside (logical ...)"
+        if rules_backend == "incremental":
+            errors.append(message)
+        else:
+            warnings.append(f"{message}; the incremental backend would keep its diseases")
+
+    classes = [str(c) for c in classes]
+    rule_diseases = list(dict.fromkeys(disease for _, _, disease, _ in rules))
+    for disease in rule_diseases:
+        if disease not in classes:
+            alias = likely_alias(disease, classes)
+            if alias:
+                warnings.append(f"rule disease {disease} is not a model class (did you mean {alias}?)")
+            else:
+                notes.append(f"rule disease {disease} has no model class; it is scored by the rules alone")
+    for disease in classes:
+        if disease not in rule_diseases:
+            warnings.append(f"model class {disease} has no rule{close_match(disease, rule_diseases)}")
+    for disease in dict.fromkeys(rule_diseases + classes):
+        if disease not in info:
+            warnings.append(f"disease {disease} has no disease_info entry{close_match(disease, info)}")
+    return {"errors": errors, "warnings": warnings, "notes": notes}
+
+
+def print_report(report, notes=False):
+    # stderr, so tools that print JSON to stdout (benchmarks.py) stay machine-readable
+    for message in report["errors"]:
+        print(f"Error: {message}", file=sys.stderr)
+    for message in report["warnings"]:
+        print(f"Warning: {message}", file=sys.stderr)
+    if notes:
+        for message in report["notes"]:
+            print(f"Note: {message}", file=sys.stderr)
+
+
+# ==========================================
+# Binary Rule Image
+# ==========================================
+
+def build_image(rules_file=RULES_FILE):
+    """Writes the bsave image of rules_file plus the stamp load_rules() checks before bloading it."""
+    image = rules_image_path(rules_file)
+    env = load_rules(rules_file, quiet=True, use_image=False)
+    # Keeps the slot constraints (type/range) in the image instead of warning they are dropped
+    env.eval("(set-dynamic-constraint-checking TRUE)")
+
+    tmp_image = image + ".tmp"
+    env.save(tmp_image, binary=True)
+    os.replace(tmp_image, image)
+    with open(image + ".json.tmp", "w", encoding="utf-8") as f:
+        json.dump(rules_image_stamp(rules_file), f, indent=2)
+    os.replace(image + ".json.tmp", image + ".json")
+    return image
+
+
+def build(rules_file=RULES_FILE, strict=False, force=False, rules_backend="incremental"):
+    """Validates rules_file against the deployed model and, if clean enough, writes the image."""
+    from diagnosis_engine import DiagnosisEngine
+
+    schema_engine = DiagnosisEngine(rules_file=rules_file, ml_backend="flat", rules_backend="compiled",
+                                    quiet=True)
+    report = validate_rules(rules_file, schema_engine.symptom_columns, schema_engine.classes,
+                            rules_backend=rules_backend)
+    print_report(report, notes=True)
+    print(f"{len(report['errors'])} error(s), {len(report['warnings'])} warning(s).")
+
+    failed = report["errors"] or (strict and report["warnings"])
+    if failed and not force:
+        print("Rule image not written.")
+        return False
+    image = build_image(rules_file)
+    print(f"Wrote rule image {image} ({os.path.getsize(image):,} bytes).")
+    return True
+
+
+# ==========================================
+# Load-Time Benchmark
+# ==========================================
+
+def benchmark(rules_file=RULES_FILE, runs=BENCHMARK_RUNS):
+    """Median time to create an environment with the rules from source vs from the image."""
+    if not rules_image_is_current(rules_file):
+        build_image(rules_file)
+
+    timings = {}
+    for name, use_image in (("source (env.load)", False), ("image (bload)", True)):
+        load_rules(rules_file, quiet=True, use_image=use_image)
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            load_rules(rules_file, quiet=True, use_image=use_image)
+            samples.append(time.perf_counter() - start)
+        timings[name] = float(np.median(samples) * 1000)
+        print(f"{name:>18}: {timings[name]:7.3f} ms median over {runs} loads")
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate the rules against the model and build the rule image.")
+    parser.add_argument("--rules", default=RULES_FILE)
+    parser.add_argument("--check", action="store_true", help="validate only, do not write the image")
+    parser.add_argument("--strict", action="store_true", help="treat warnings as errors")
+    parser.add_argument("--force", action="store_true", help="write the image despite errors")
+    parser.add_argument("--benchmark", action="store_true", help="compare source and image load time")
+    parser.add_argument("--runs", type=int, default=BENCHMARK_RUNS)
+    parser.add_argument("--backend", choices=("clips", "compiled", "incremental"), default="incremental",
+                        help="rules backend to validate for (only incremental requires (logical ...))")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.rules, args.runs)
+    elif args.check:
+        from diagnosis_engine import DiagnosisEngine
+
+        check_engine = DiagnosisEngine(rules_file=args.rules, ml_backend="flat", rules_backend="compiled",
+                                       quiet=True)
+        check_report = validate_rules(args.rules, check_engine.symptom_columns, check_engine.classes,
+                                      rules_backend=args.backend)
+        print_report(check_report, notes=True)
+        raise SystemExit(1 if check_report["errors"] or (args.strict and check_report["warnings"]) else 0)
+    else:
+        raise SystemExit(0 if build(args.rules, args.strict, args.force, args.backend) else 1)
@@ -0,0 +1,315 @@
+import argparse
+import random
+
+import numpy as np
+
+from diagnosis_engine import RULES_FILE, DiagnosisEngine, get_clips_diagnosis, load_rules
+
+# ==========================================
+# Configuration
+# ==========================================
+RULE_ARRAY_FIELDS = ("masks", "sizes", "rule_disease", "cf", "cf_percent", "group_starts")
+
+
+# ==========================================
+# CLIPS Source Parsing
+# ==========================================
+
+def tokenize(source):
+    """Splits CLIPS source into parentheses, strings and atoms, dropping ';' comments."""
+    tokens = []
+    i = 0
+    n = len(source)
+    while i < n:
+        ch = source[i]
+        if ch.isspace():
+            i += 1
+        elif ch == ";":
+            while i < n and source[i] != "\n":
+                i += 1
+        elif ch in "()":
+            tokens.append(ch)
+            i += 1
+        elif ch == '"':
+            j = i + 1
+            while j < n and source[j] != '"':
+                j += 2 if source[j] == "\\" else 1
+            tokens.append(source[i:j + 1])
+            i = j + 1
+        else:
+            j = i
+            while j < n and not source[j].isspace() and source[j] not in '();"':
+                j += 1
+            tokens.append(source[i:j])
+            i = j
+    return tokens
+
+
+def parse_constructs(source):
+    """Parses CLIPS source into nested lists, one per top-level construct."""
+    constructs = []
+    stack = []
+    for token in tokenize(source):
+        if token == "(":
+            stack.append([])
+        elif token == ")":
+            if not stack:
+                raise ValueError("Unbalanced ')' in CLIPS source")
+            expr = stack.pop()
+            if stack:
+                stack[-1].append(expr)
+            else:
+                constructs.append(expr)
+        elif stack:
+            stack[-1].append(token)
+        else:
+            raise ValueError(f"Unexpected token outside a construct: {token}")
+    if stack:
+        raise ValueError("Unbalanced '(' in CLIPS source")
+    return constructs
+
+
+def slot_value(fact, slot, default=None):
+    """Returns the value of (slot value) inside a parsed fact pattern such as (disease (name x))."""
+    for item in fact[1:]:
+        if isinstance(item, list) and len(item) == 2 and item[0] == slot:
+            return item[1]
+    return default
+
+
+def split_rule(construct):
+    """Splits a parsed defrule into (name, LHS patterns, RHS actions), skipping its comment string."""
+    name = construct[1]
+    body = [item for item in construct[2:] if not (isinstance(item, str) and item.startswith('"'))]
+    if "=>" not in body:
+        raise ValueError(f"Rule {name} has no '=>'")
+    split = body.index("=>")
+    return name, body[:split], body[split + 1:]
+
+
+def flatten_logical(lhs):
+    """The LHS patterns with any (logical ...) conditional element unwrapped."""
+    patterns = []
+    for pattern in lhs:
+        if isinstance(pattern, list) and pattern and pattern[0] == "logical":
+            patterns.extend(pattern[1:])
+        else:
+            patterns.append(pattern)
+    return patterns
+
+
+def rules_without_logical_support(source):
+    """
+    Names of the defrules whose patterns are not all inside a (logical ...) element. Their
+    disease facts would outlive a retracted symptom, which incremental sessions rely on.
+    """
+    names = []
+    for construct in parse_constructs(source):
+        if construct and construct[0] == "defrule":
+            name, lhs, _ = split_rule(construct)
+            if any(not (isinstance(pattern, list) and pattern and pattern[0] == "logical") for pattern in lhs):
+                names.append(name)
+    return names
+
+
+def parse_rules(source):
+    """
+    Extracts (rule name, symptom names, disease, CF) tuples from the defrules in the source.
+    Only the shape used by rules_model.clp is supported: a conjunction of (symptom (name X))
+    patterns, optionally wrapped in (logical ...), whose RHS asserts
+    (disease (name D) (confidence c)).
+    """
+    rules = []
+    for construct in parse_constructs(source):
+        if not construct or construct[0] != "defrule":
+            continue
+
+        name, lhs, rhs = split_rule(construct)
+
+        symptoms = []
+        for pattern in flatten_logical(lhs):
+            if not isinstance(pattern, list) or pattern[0] != "symptom" or slot_value(pattern, "name") is None:
+                raise ValueError(f"Rule {name} has an unsupported pattern: {pattern}")
+            symptoms.append(slot_value(pattern, "name"))
+
+        conclusions = [action[1] for action in rhs
+                       if isinstance(action, list) and action[0] == "assert"
+                       and isinstance(action[1], list) and action[1][0] == "disease"]
+        if len(conclusions) != 1:
+            raise ValueError(f"Rule {name} must assert exactly one disease fact")
+        disease = slot_value(conclusions[0], "name")
+        confidence = float(slot_value(conclusions[0], "confidence", "0.0"))
+
+        rules.append((name, symptoms, disease, confidence))
+    return rules
+
+
+# ==========================================
+# Compiled Rule Matrix
+# ==========================================
+
+class CompiledRules:
+    """
+    Rule x symptom bitmask matrix plus CF vector for the rules in rules_model.clp.
+
+    A rule fires for an input row when every symptom it requires is set, i.e. when
+    X @ masks.T equals the rule's condition count. Rules are stored grouped by
+    disease so the per-disease maximum CF is a single np.maximum.reduceat.
+    """
+
+    def __init__(self, rules, symptom_columns):
+        self.symptom_columns = list(symptom_columns)
+        column_index = {name: i for i, name in enumerate(self.symptom_columns)}
+
+        # Diseases in order of first appearance, rules grouped by disease
+        self.diseases = list(dict.fromkeys(disease for _, _, disease, _ in rules))
+        disease_index = {name: i for i, name in enumerate(self.diseases)}
+        rules = sorted(rules, key=lambda rule: disease_index[rule[2]])
+
+        self.rule_names = [name for name, _, _, _ in rules]
+        self.masks = np.zeros((len(rules), len(self.symptom_columns)), dtype=np.int32)
+        self.sizes = np.zeros(len(rules), dtype=np.int32)
+        self.rule_disease = np.array([disease_index[disease] for _, _, disease, _ in rules], dtype=np.intp)
+        self.cf = np.array([confidence for _, _, _, confidence in rules], dtype=np.float64)
+        self.unknown_symptoms = {}
+
+        for r, (name, symptoms, _, _) in enumerate(rules):
+            symptoms = set(symptoms)
+            unknown = sorted(s for s in symptoms if s not in column_index)
+            for symptom in symptoms - set(unknown):
+                self.masks[r, column_index[symptom]] = 1
+            # A symptom outside the columns is never asserted, so the rule can never fire
+            self.sizes[r] = len(symptoms) + (1 if unknown else 0)
+            if unknown:
+                self.unknown_symptoms[name] = unknown
+
+        self.group_starts = np.searchsorted(self.rule_disease, np.arange(len(self.diseases)))
+        # CF is 0.0 to 1.0, reported as a percentage like get_clips_diagnosis()
+        self.cf_percent = self.cf * 100
+
+    def to_arrays(self):
+        """The rule tables and their names as a dict of NumPy arrays (see from_arrays)."""
+        arrays = {field: getattr(self, field) for field in RULE_ARRAY_FIELDS}
+        arrays["rule_names"] = np.array(self.rule_names, dtype=str)
+        arrays["diseases"] = np.array(self.diseases, dtype=str)
+        arrays["symptom_columns"] = np.array(self.symptom_columns, dtype=str)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuilds compiled rules around existing arrays (e.g. views into shared memory) without copying."""
+        compiled = cls.__new__(cls)
+        for field in RULE_ARRAY_FIELDS:
+            setattr(compiled, field, arrays[field])
+        compiled.rule_names = [str(name) for name in arrays["rule_names"]]
+        compiled.diseases = [str(name) for name in arrays["diseases"]]
+        compiled.symptom_columns = [str(name) for name in arrays["symptom_columns"]]
+        # Unknown rule symptoms are reported by rule_build.validate_rules(), not carried here
+        compiled.unknown_symptoms = {}
+        return compiled
+
+    def fired(self, X):
+        """Returns the (rows x rules) boolean matrix of rules whose conditions are all met."""
+        X = np.asarray(X, dtype=np.int32)
+        return (X @ self.masks.T) == self.sizes
+
+    def evaluate(self, X):
+        """
+        Evaluates a (rows x symptom_columns) 0/1 matrix.
+        Returns (cf, matched): the max CF percentage per disease and whether any rule of
+        that disease fired, both shaped (rows x diseases) over self.diseases.
+        """
+        X = np.asarray(X)
+        if not len(self.rule_names):
+            empty = np.zeros((len(X), 0))
+            return empty, empty.astype(bool)
+
+        scores = np.where(self.fired(X), self.cf_percent, -np.inf)
+        cf = np.maximum.reduceat(scores, self.group_starts, axis=1)
+        matched = cf > -np.inf
+        cf[~matched] = 0.0
+        return cf, matched
+
+    def diagnose_batch(self, X):
+        """Returns one {disease: CF%} dict per row, matching get_clips_diagnosis() output."""
+        cf, matched = self.evaluate(X)
+        results = []
+        for cf_row, matched_row in zip(cf, matched):
+            results.append({self.diseases[d]: float(cf_row[d]) for d in np.flatnonzero(matched_row)})
+        return results
+
+
+def compile_rules(symptom_columns, rules_file=RULES_FILE):
+    """Parses rules_file and compiles it against the given symptom columns."""
+    with open(rules_file, encoding="utf-8") as f:
+        return CompiledRules(parse_rules(f.read()), symptom_columns)
+
+
+# ==========================================
+# Equivalence Check Against the CLIPS Runtime
+# ==========================================
+
+def verification_cases(compiled, n_random=500, seed=42):
+    """
+    Symptom sets covering every rule: each rule's exact conditions, the same with each
+    condition dropped (must not fire), every pair of rules together, and random sets.
+    """
+    columns = compiled.symptom_columns
+    rule_sets = [[columns[i] for i in np.flatnonzero(mask)] for mask in compiled.masks]
+
+    cases = [[]]
+    for symptoms in rule_sets:
+        cases.append(symptoms)
+        for dropped in symptoms:
+            cases.append([s for s in symptoms if s != dropped])
+    for i, first in enumerate(rule_sets):
+        for second in rule_sets[i + 1:]:
+            cases.append(sorted(set(first) | set(second)))
+
+    rng = random.Random(seed)
+    for _ in range(n_random):
+        cases.append(rng.sample(columns, rng.randint(1, min(8, len(columns)))))
+    return cases
+
+
+def verify_against_clips(rules_file=RULES_FILE, n_random=500, seed=42):
+    """
+    Runs every verification case through both CLIPS and the compiled evaluator.
+    Returns the list of (symptoms, clips_result, compiled_result) mismatches.
+    """
+    engine = DiagnosisEngine(rules_file=rules_file)
+    env = load_rules(rules_file, quiet=True)
+    compiled = compile_rules(engine.symptom_columns, rules_file)
+
+    cases = verification_cases(compiled, n_random, seed)
+    compiled_results = compiled.diagnose_batch(engine.encode(cases))
+
+    mismatches = []
+    for symptoms, compiled_result in zip(cases, compiled_results):
+        clips_result = get_clips_diagnosis(env, symptoms)
+        if clips_result != compiled_result:
+            mismatches.append((symptoms, clips_result, compiled_result))
+
+    print(f"Checked {len(cases)} symptom sets over {len(compiled.rule_names)} rules: "
+          f"{len(mismatches)} mismatch(es).")
+    for symptoms, clips_result, compiled_result in mismatches[:10]:
+        print(f"  {symptoms}\n    CLIPS:    {clips_result}\n    compiled: {compiled_result}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile rules_model.clp into a NumPy rule matrix.")
+    parser.add_argument("--rules", default=RULES_FILE, help="CLIPS rules file")
+    parser.add_argument("--verify", action="store_true", help="check the compiled rules against CLIPS")
+    parser.add_argument("--random", type=int, default=500, help="random symptom sets to verify")
+    args = parser.parse_args()
+
+    if args.verify:
+        raise SystemExit(1 if verify_against_clips(args.rules, args.random) else 0)
+
+    engine = DiagnosisEngine(rules_file=args.rules)
+    compiled = compile_rules(engine.symptom_columns, args.rules)
+    print(f"Compiled {len(compiled.rule_names)} rules over {len(compiled.symptom_columns)} symptoms "
+          f"for {len(compiled.diseases)} diseases.")
+    for rule, unknown in compiled.unknown_symptoms.items():
+        print(f"Warning: rule {rule} uses unknown symptom(s) {unknown} and can never fire.")
@@ -0,0 +1,359 @@
+import argparse
+import os
+import random
+import time
+
+import numpy as np
+
+from diagnosis_cache import DiagnosisCache, symptom_bitmask
+from diagnosis_engine import CSV_FILE, DiagnosisEngine
+from diagnosis_metrics import metrics
+from model_artifact import load_symptom_stats, symptom_stats
+
+# ==========================================
+# Configuration
+# ==========================================
+TOP_SUGGESTIONS = 5
+ADVISOR_CACHE_SIZE = 4096  # memoized rankings, one per distinct selection
+LIKELIHOOD_ALPHA = 1.0  # Laplace smoothing of P(symptom | disease)
+MAX_QUESTIONS = 15  # question budget per simulated session in --benchmark
+
+
+# ==========================================
+# Disease Distribution Helpers
+# ==========================================
+
+def entropy(p):
+    """Shannon entropy in bits of each row of a probability matrix."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        terms = np.where(p > 0, p * np.log2(p), 0.0)
+    return -terms.sum(axis=-1)
+
+
+def csv_symptom_stats(csv_file=CSV_FILE):
+    """model_artifact.symptom_stats() of a labelled CSV, with the symptom_columns they are over."""
+    import pandas as pd
+
+    df = pd.read_csv(csv_file)
+    columns = [name for name in df.columns if name != "disease"]
+    return {**symptom_stats(df[columns], df["disease"]), "symptom_columns": columns}
+
+
+def symptom_likelihoods(diseases, symptom_columns, compiled_rules, stats=None, alpha=LIKELIHOOD_ALPHA):
+    """
+    The (diseases x symptoms) matrix of P(symptom present | disease), Laplace smoothed.
+
+    Counts come from the training rows summarized in stats (load_symptom_stats() or
+    csv_symptom_stats()) plus one pseudo-row per rule (its conditions present), so diseases
+    only the rules know about still get likelihoods. A disease with neither rows nor rules
+    gets 0.5 for every symptom.
+    """
+    index = {disease: i for i, disease in enumerate(diseases)}
+    counts = np.zeros((len(diseases), len(symptom_columns)))
+    rows = np.zeros(len(diseases))
+
+    if stats is not None:
+        position = {name: j for j, name in enumerate(stats["symptom_columns"])}
+        target = [j for j, name in enumerate(symptom_columns) if name in position]
+        source = [position[symptom_columns[j]] for j in target]
+        for disease, n, disease_counts in zip(stats["diseases"], stats["rows"], stats["counts"]):
+            if disease in index:
+                counts[index[disease], target] += np.asarray(disease_counts)[source]
+                rows[index[disease]] += n
+
+    for mask, rule_disease in zip(compiled_rules.masks, compiled_rules.rule_disease):
+        # Not every rule disease is ranked (e.g. a rule concluding "healthy")
+        i = index.get(compiled_rules.diseases[rule_disease])
+        if i is not None:
+            counts[i] += mask
+            rows[i] += 1
+
+    return (counts + alpha) / (rows[:, None] + 2 * alpha)
+
+
+# ==========================================
+# Next-Symptom Advisor
+# ==========================================
+
+class SymptomAdvisor:
+    """
+    Ranks the unselected symptoms by how much asking about them is expected to narrow
+    down the diagnosis.
+
+    The current selection and one "and this symptom is present" row per candidate are
+    scored together: one predict_proba call and one compiled-rules evaluation over a
+    (1 + candidates) x symptoms matrix. A row's disease distribution is its FTS
+    (w_ml * ML + w_cf * CF, as in fuse_scores) normalized over the model classes and rule
+    diseases. Unselected symptoms already count as absent, so a "no" leaves the
+    distribution unchanged and the expected information gain of asking is
+
+        P(present) * (H(current) - H(current + symptom))
+
+    with P(present) = sum over diseases of P(disease) * P(symptom | disease) from
+    symptom_likelihoods(). The gain is negative for a symptom whose presence would spread
+    the distribution out (e.g. one shared by the leading diseases); those rank last.
+
+    The training-row counts behind the likelihoods come from the model artifact; csv_file
+    recounts them from a CSV instead (also the fallback for artifacts without them).
+
+    Rankings are memoized per selection (keyed by symptom bitmask). The candidate rows'
+    scores also go into the engine's result cache when it has one, so diagnosing after
+    picking a suggested symptom is a cache hit. Ranking holds engine.reading(), so a
+    reload cannot swap the model between scoring and caching. Rebuilds its tables when
+    the engine reloads its model or fusion settings.
+    """
+
+    def __init__(self, engine, csv_file=None, cache_size=ADVISOR_CACHE_SIZE):
+        self.engine = engine
+        self.csv_file = csv_file
+        self.memo = DiagnosisCache(cache_size)
+        self._clf = None
+        self._fusion = None
+        with engine.reading():
+            self._prepare()
+
+    def _prepare(self):
+        """(Re)builds the disease index and likelihoods if the engine loaded a new model."""
+        engine = self.engine
+        if engine.clf is self._clf and engine.fusion == self._fusion:
+            return
+        if engine.compiled_rules is not None:
+            self.rules = engine.compiled_rules
+        else:
+            from rule_compiler import compile_rules
+            self.rules = compile_rules(engine.symptom_columns, engine.rules_file)
+
+        self.diseases = [d for d in dict.fromkeys(engine.classes + self.rules.diseases) if d != "healthy"]
+        index = {disease: i for i, disease in enumerate(self.diseases)}
+        # Columns of the distribution each model class / rule disease feeds (-1: not scored)
+        self.class_columns = np.array([index.get(d, -1) for d in engine.classes])
+        self.rule_columns = np.array([index.get(d, -1) for d in self.rules.diseases])
+        self.likelihoods = symptom_likelihoods(self.diseases, engine.symptom_columns, self.rules,
+                                               self.symptom_stats())
+
+        self.memo.clear()
+        self._clf = engine.clf
+        self._fusion = dict(engine.fusion)
+
+    def symptom_stats(self):
+        """Training-row counts saved with the model, or counted from the CSV without them."""
+        if self.csv_file is None:
+            try:
+                stats = load_symptom_stats(self.engine.artifact_dir)
+            except (OSError, ValueError):
+                stats = None
+            if stats is not None:
+                return stats
+        csv_file = self.csv_file or self.engine.csv_file
+        return csv_symptom_stats(csv_file) if csv_file and os.path.exists(csv_file) else None
+
+    def distribution(self, proba, cf):
+        """Normalized FTS over self.diseases for each row of predict_proba and rule CF output."""
+        fts = np.zeros((len(proba), len(self.diseases)))
+        scored = self.class_columns >= 0
+        fts[:, self.class_columns[scored]] += self._fusion["w_ml"] * 100 * proba[:, scored]
+        scored = self.rule_columns >= 0
+        fts[:, self.rule_columns[scored]] += self._fusion["w_cf"] * cf[:, scored]
+
+        total = fts.sum(axis=1, keepdims=True)
+        uniform = np.full_like(fts, 1.0 / max(len(self.diseases), 1))
+        return np.where(total > 0, fts / np.where(total > 0, total, 1.0), uniform)
+
+    def candidate_matrix(self, symptoms):
+        """The selection as row 0 plus one row per unselected symptom with that symptom set."""
+        base = np.zeros(len(self.engine.symptom_columns), dtype=np.uint8)
+        base[[self.engine.column_index[s] for s in symptoms]] = 1
+        candidates = np.flatnonzero(base == 0)
+        X = np.repeat(base[None, :], len(candidates) + 1, axis=0)
+        X[np.arange(1, len(candidates) + 1), candidates] = 1
+        return X, candidates
+
+    def rank(self, symptoms, exclude=()):
+        """
+        Unselected symptoms, most informative first, as {"symptom", "gain" (bits, may be
+        negative), "p_present"} dicts. exclude drops symptoms already answered "absent".
+        """
+        with self.engine.reading():
+            symptoms = self.engine.normalize(symptoms)
+            excluded = set(self.engine.normalize(exclude))
+            self._prepare()
+
+            key = symptom_bitmask(self.engine.column_index[s] for s in symptoms)
+            ranking = self.memo.get(key)
+            if ranking is None:
+                with metrics.span("advise"):
+                    ranking = self._rank(symptoms)
+                self.memo.put(key, ranking)
+        return [dict(row) for row in ranking if row["symptom"] not in excluded]
+
+    def suggest(self, symptoms, exclude=(), top=TOP_SUGGESTIONS):
+        return self.rank(symptoms, exclude)[:top]
+
+    def _rank(self, symptoms):
+        X, candidates = self.candidate_matrix(symptoms)
+        if not len(candidates):
+            return ()
+        with metrics.span("advise_predict_proba"):
+            proba = self.engine.clf.predict_proba(X)
+        with metrics.span("advise_rules"):
+            cf, matched = self.rules.evaluate(X)
+
+        p = self.distribution(proba, cf)
+        h = entropy(p)
+        p_present = self.likelihoods[:, candidates].T @ p[0]
+        gain = p_present * (h[0] - h[1:])
+        self._prime_engine_cache(X[1:], proba[1:], cf[1:], matched[1:])
+
+        columns = self.engine.symptom_columns
+        order = sorted(range(len(candidates)), key=lambda i: (-gain[i], candidates[i]))
+        return tuple({"symptom": columns[candidates[i]], "gain": float(gain[i]), "p_present": float(p_present[i])}
+                     for i in order)
+
+    def candidate_scores(self, X, proba, cf, matched):
+        """(ml_results, clips_results) per row, in the form DiagnosisEngine.score() returns."""
+        classes = self.engine.classes
+        scores = []
+        for proba_row, cf_row, matched_row in zip(proba, cf, matched):
+            ml_results = {disease: float(prob) * 100 for disease, prob in zip(classes, proba_row)}
+            clips_results = {self.rules.diseases[d]: float(cf_row[d]) for d in np.flatnonzero(matched_row)}
+            scores.append((ml_results, clips_results))
+        return scores
+
+    def _prime_engine_cache(self, X, proba, cf, matched):
+        cache = self.engine.cache
+        if cache is None:
+            return
+        for row, value in zip(X, self.candidate_scores(X, proba, cf, matched)):
+            cache.put(symptom_bitmask(np.flatnonzero(row)), value)
+
+
+# ==========================================
+# Verification and Session Benchmark
+# ==========================================
+
+def random_selections(columns, n_selections=20, seed=42):
+    rng = random.Random(seed)
+    return [rng.sample(columns, rng.randint(0, 5)) for _ in range(n_selections)]
+
+
+def verify(n_selections=20, seed=42):
+    """
+    Checks the batched candidate scores against engine.score() run once per candidate with
+    the CLIPS rules backend. Returns the number of mismatching candidates.
+    """
+    engine = DiagnosisEngine(ml_backend="flat", rules_backend="clips", quiet=True)
+    advisor = SymptomAdvisor(engine)
+
+    mismatches = checked = 0
+    for selection in random_selections(engine.symptom_columns, n_selections, seed):
+        symptoms = engine.normalize(selection)
+        X, candidates = advisor.candidate_matrix(symptoms)
+        proba = engine.clf.predict_proba(X[1:])
+        cf, matched = advisor.rules.evaluate(X[1:])
+        batched = advisor.candidate_scores(X[1:], proba, cf, matched)
+        for row, scores in zip(X[1:], batched):
+            expected = engine.score([engine.decode([row])[0]])[0]
+            checked += 1
+            if scores[1] != expected[1] or not all(np.isclose(scores[0][d], expected[0][d]) for d in expected[0]):
+                mismatches += 1
+    print(f"Checked {checked} hypothetical rows over {n_selections} selections: {mismatches} mismatch(es).")
+    return mismatches
+
+
+def run_session(engine, truth, choose, max_questions=MAX_QUESTIONS):
+    """
+    Asks up to max_questions symptoms (choose(selected, asked) picks the next one), answering
+    from the truth row. Returns how many questions it took until the engine's top diagnosis
+    was the true disease, or None if it never was.
+    """
+    selected, asked = [], []
+    for question in range(max_questions + 1):
+        results = engine.diagnose(selected) if selected else []
+        if results and results[0]["disease"] == truth["disease"]:
+            return question
+        if question == max_questions:
+            return None
+        symptom = choose(selected, asked)
+        if symptom is None:
+            return None
+        asked.append(symptom)
+        if truth[symptom]:
+            selected.append(symptom)
+    return None
+
+
+def benchmark(csv_file=CSV_FILE, max_questions=MAX_QUESTIONS):
+    """
+    Replays every CSV row as a patient: the advisor's top suggestion vs the listbox order.
+    Reports questions to the right top diagnosis, ranking latency and memo hit rate, and the
+    cost of one batched ranking against 48 sequential diagnose() calls.
+    """
+    import pandas as pd
+
+    engine = DiagnosisEngine(ml_backend="flat", rules_backend="compiled", quiet=True, cache_size=4096)
+    advisor = SymptomAdvisor(engine, csv_file)
+    rows = pd.read_csv(csv_file).to_dict("records")
+    columns = engine.symptom_columns
+
+    timings = []
+
+    def advised(selected, asked):
+        start = time.perf_counter()
+        ranking = advisor.rank(selected, exclude=[s for s in asked if s not in selected])
+        timings.append(time.perf_counter() - start)
+        return ranking[0]["symptom"] if ranking else None
+
+    def listbox_order(selected, asked):
+        return next((s for s in columns if s not in asked), None)
+
+    outcomes = {}
+    for name, choose in (("advisor", advised), ("listbox order", listbox_order)):
+        counts = [run_session(engine, row, choose, max_questions) for row in rows]
+        reached = [count for count in counts if count is not None]
+        outcomes[name] = counts
+        print(f"{name:>14}: right top diagnosis for {len(reached)}/{len(rows)} patients within {max_questions} "
+              f"questions, mean {np.mean(reached) if reached else float('nan'):.2f} questions")
+
+    stats = advisor.memo.stats()
+    timings_ms = np.array(timings) * 1000
+    print(f"Ranking: {len(timings)} calls, memo hit rate {stats['hit_rate']:.0%}, "
+          f"median {np.median(timings_ms):.3f} ms, p95 {np.percentile(timings_ms, 95):.3f} ms, "
+          f"max {timings_ms.max():.3f} ms")
+
+    selection = [s for s in columns if rows[0][s]][:2]
+    engine_sequential = DiagnosisEngine(ml_backend="flat", rules_backend="compiled", quiet=True)
+    cold = SymptomAdvisor(engine_sequential, csv_file)
+    start = time.perf_counter()
+    for _ in range(20):
+        cold.memo.clear()
+        cold.rank(selection)
+    batched = (time.perf_counter() - start) / 20
+    start = time.perf_counter()
+    for symptom in columns:
+        if symptom not in selection:
+            engine_sequential.diagnose(selection + [symptom])
+    sequential = time.perf_counter() - start
+    print(f"One uncached ranking: {batched * 1000:.2f} ms batched vs {sequential * 1000:.2f} ms for "
+          f"{len(columns) - len(selection)} sequential diagnose() calls")
+    return outcomes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rank the next symptom to ask about by expected information gain.")
+    parser.add_argument("symptoms", nargs="*", help="symptoms selected so far")
+    parser.add_argument("--exclude", nargs="*", default=[], help="symptoms already answered absent")
+    parser.add_argument("--top", type=int, default=TOP_SUGGESTIONS)
+    parser.add_argument("--verify", action="store_true", help="check batched scores against CLIPS")
+    parser.add_argument("--benchmark", action="store_true", help="replay the CSV rows as interactive sessions")
+    args = parser.parse_args()
+
+    if args.verify:
+        raise SystemExit(1 if verify() else 0)
+    if args.benchmark:
+        benchmark()
+        raise SystemExit(0)
+
+    advisor_engine = DiagnosisEngine(ml_backend="flat", rules_backend="compiled", quiet=True)
+    for suggestion in SymptomAdvisor(advisor_engine).suggest(args.symptoms, args.exclude, args.top):
+        print(f"{suggestion['symptom']:<32} gain {suggestion['gain']:.3f} bits, "
+              f"P(present) {suggestion['p_present']:.2f}")
@@ -0,0 +1,288 @@
+import argparse
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+from diagnosis_engine import BASE_DIR, CSV_FILE
+
+# ==========================================
+# Configuration
+# ==========================================
+DATASET_EXT = ".tds"
+DATASET_FILE = os.path.join(BASE_DIR, "tomato_disease_symptoms_extended" + DATASET_EXT)
+MAGIC = b"TDS1"
+FORMAT_VERSION = 1
+HEADER_BYTES = 64 * 1024  # reserved up front so new labels/row counts never move the records
+LABEL_DTYPE = np.dtype("<u2")
+
+
+# ==========================================
+# File Layout
+# ==========================================
+# [0:4)              magic b"TDS1"
+# [4:8)              little-endian uint32 length of the JSON schema that follows
+# [8:HEADER_BYTES)   JSON schema: format_version, symptom_columns, labels (the dictionary),
+#                    n_rows, record_bytes; zero padded
+# [HEADER_BYTES:)    n_rows fixed-size records: the symptom bits packed 8 per byte
+#                    (np.packbits, big bit order) followed by a uint16 label code
+#
+# Appending writes new records after the last committed one and only then rewrites the
+# schema with the new n_rows (and any new labels), so a reader never sees a partial record;
+# anything past n_rows is left over from an interrupted append and gets overwritten.
+
+def record_dtype(n_columns):
+    return np.dtype([("bits", np.uint8, ((n_columns + 7) // 8,)), ("label", LABEL_DTYPE)])
+
+
+def read_schema(path):
+    with open(path, "rb") as f:
+        head = f.read(8)
+        if len(head) < 8 or head[:4] != MAGIC:
+            raise ValueError(f"{path} is not a symptom dataset file")
+        (length,) = struct.unpack("<I", head[4:])
+        schema = json.loads(f.read(length).decode("utf-8"))
+    if schema.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported symptom dataset format: {schema.get('format_version')}")
+    return schema
+
+
+def write_schema(f, schema):
+    payload = json.dumps(schema).encode("utf-8")
+    if 8 + len(payload) > HEADER_BYTES:
+        raise ValueError("Dataset header is full (too many labels); rewrite the file with --from-csv")
+    f.seek(0)
+    f.write(MAGIC + struct.pack("<I", len(payload)) + payload)
+    f.write(b"\0" * (HEADER_BYTES - 8 - len(payload)))
+
+
+def encode_records(X, labels, schema):
+    """Packs a 0/1 matrix and label strings into records, extending schema["labels"] in place."""
+    X = np.asarray(X)
+    if X.ndim != 2 or X.shape[1] != len(schema["symptom_columns"]):
+        raise ValueError(f"Expected {len(schema['symptom_columns'])} symptom columns, got shape {X.shape}")
+    if not np.isin(X, (0, 1)).all():
+        raise ValueError("Symptom values must be 0 or 1")
+
+    codes = {label: i for i, label in enumerate(schema["labels"])}
+    for label in labels:
+        if label not in codes:
+            codes[label] = len(schema["labels"])
+            schema["labels"].append(label)
+    if len(schema["labels"]) > np.iinfo(LABEL_DTYPE).max + 1:
+        raise ValueError("Too many distinct disease labels for a uint16 code")
+
+    records = np.empty(len(X), dtype=record_dtype(X.shape[1]))
+    records["bits"] = np.packbits(X.astype(np.uint8), axis=1)
+    records["label"] = [codes[label] for label in labels]
+    return records
+
+
+# ==========================================
+# Writing
+# ==========================================
+
+def write_dataset(path, X, labels, symptom_columns):
+    """Creates (or replaces) a dataset file from a 0/1 matrix and its disease labels."""
+    schema = {"format_version": FORMAT_VERSION, "symptom_columns": [str(c) for c in symptom_columns],
+              "labels": [], "n_rows": 0, "record_bytes": record_dtype(len(symptom_columns)).itemsize}
+    records = encode_records(X, [str(label) for label in labels], schema)
+    schema["n_rows"] = len(records)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write_schema(f, schema)
+        f.write(records.tobytes())
+    os.replace(tmp_path, path)
+    return schema
+
+
+def append_records(path, X, labels, symptom_columns=None):
+    """
+    Appends rows to an existing dataset without rewriting it. If symptom_columns is given,
+    X's columns are reordered to the file's schema (they must be the same set).
+    """
+    schema = read_schema(path)
+    X = np.asarray(X)
+    if symptom_columns is not None:
+        symptom_columns = [str(c) for c in symptom_columns]
+        if set(symptom_columns) != set(schema["symptom_columns"]):
+            raise ValueError("Appended rows have different symptom columns than the dataset")
+        order = [symptom_columns.index(c) for c in schema["symptom_columns"]]
+        X = X[:, order]
+
+    records = encode_records(X, [str(label) for label in labels], schema)
+    with open(path, "r+b") as f:
+        f.seek(HEADER_BYTES + schema["n_rows"] * schema["record_bytes"])
+        f.write(records.tobytes())
+        f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+        # Commit: the new rows count only once the schema says so
+        schema["n_rows"] += len(records)
+        write_schema(f, schema)
+    return schema
+
+
+def convert_csv(csv_file=CSV_FILE, path=DATASET_FILE, chunk_rows=100_000):
+    """Converts a symptom CSV (0/1 columns plus 'disease') chunk by chunk. Returns the schema."""
+    import pandas as pd
+
+    columns = pd.read_csv(csv_file, nrows=0).columns.tolist()
+    symptom_columns = [c for c in columns if c != "disease"]
+    dtypes = {c: np.uint8 for c in symptom_columns}
+
+    schema = None
+    for chunk in pd.read_csv(csv_file, dtype=dtypes, chunksize=chunk_rows):
+        X = chunk[symptom_columns].to_numpy()
+        labels = chunk["disease"].astype(str).tolist()
+        if schema is None:
+            schema = write_dataset(path, X, labels, symptom_columns)
+        else:
+            schema = append_records(path, X, labels)
+    if schema is None:
+        schema = write_dataset(path, np.zeros((0, len(symptom_columns)), np.uint8), [], symptom_columns)
+    return schema
+
+
+# ==========================================
+# Loading
+# ==========================================
+
+def load_records(path=DATASET_FILE, mmap=True):
+    """Returns (records, schema); records is the structured record array, memory-mapped by default."""
+    schema = read_schema(path)
+    n_columns = len(schema["symptom_columns"])
+    dtype = record_dtype(n_columns)
+    if schema["n_rows"] == 0:
+        records = np.empty(0, dtype=dtype)
+    elif mmap:
+        records = np.memmap(path, dtype=dtype, mode="r", offset=HEADER_BYTES, shape=(schema["n_rows"],))
+    else:
+        with open(path, "rb") as f:
+            f.seek(HEADER_BYTES)
+            records = np.fromfile(f, dtype=dtype, count=schema["n_rows"])
+    return records, schema
+
+
+def load_dataset(path=DATASET_FILE, mmap=True):
+    """
+    Returns (X, labels, symptom_columns): X is a uint8 0/1 matrix unpacked straight from the
+    (memory-mapped) records and labels the decoded disease strings. No text is parsed.
+    """
+    records, schema = load_records(path, mmap)
+    X = np.unpackbits(records["bits"], axis=1, count=len(schema["symptom_columns"]))
+    labels = np.array(schema["labels"], dtype=str)[records["label"]] if len(records) else np.array([], dtype=str)
+    return X, labels, schema["symptom_columns"]
+
+
+def load_dataframe(path=DATASET_FILE, mmap=True):
+    """
+    The DataFrame train_and_save_model() expects: uint8 symptom columns plus 'disease' as a
+    Categorical built directly from the stored label codes and dictionary.
+    """
+    import pandas as pd
+
+    records, schema = load_records(path, mmap)
+    X = np.unpackbits(records["bits"], axis=1, count=len(schema["symptom_columns"]))
+    df = pd.DataFrame(X, columns=schema["symptom_columns"], copy=False)
+    df["disease"] = pd.Categorical.from_codes(np.asarray(records["label"], dtype=np.int32), schema["labels"])
+    return df
+
+
+# ==========================================
+# Round-Trip Check and Load Benchmark
+# ==========================================
+
+def verify(csv_file=CSV_FILE, path=None):
+    """Converts csv_file, appends it a second time and checks both reads against pandas."""
+    import tempfile
+
+    import pandas as pd
+
+    expected = pd.read_csv(csv_file)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = path or os.path.join(tmp, "check" + DATASET_EXT)
+        convert_csv(csv_file, path)
+        df = load_dataframe(path)
+        ok = df.astype(expected.dtypes.to_dict()).equals(expected) and list(df.columns) == list(expected.columns)
+
+        shuffled = expected[expected.columns[::-1]]
+        append_records(path, shuffled.drop(columns="disease").to_numpy(), shuffled["disease"],
+                       shuffled.columns.drop("disease"))
+        twice = load_dataframe(path, mmap=False)
+        ok = ok and twice.astype(expected.dtypes.to_dict()).equals(
+            pd.concat([expected, expected], ignore_index=True))
+    print(f"Round trip of {len(expected)} rows (convert + append): {'ok' if ok else 'MISMATCH'}")
+    return ok
+
+
+def benchmark(n_rows=1_000_000, seed=42):
+    """Load time and file size of a synthetic dataset as CSV (pd.read_csv) vs this format."""
+    import tempfile
+
+    import pandas as pd
+
+    from diagnosis_engine import read_symptom_columns
+
+    columns = read_symptom_columns()
+    rng = np.random.default_rng(seed)
+    X = (rng.random((n_rows, len(columns))) < 0.1).astype(np.uint8)
+    labels = np.array([f"disease-{i}" for i in range(12)])[rng.integers(0, 12, n_rows)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "bench.csv")
+        df = pd.DataFrame(X, columns=columns)
+        df["disease"] = labels
+        df.to_csv(csv_path, index=False)
+        del df
+        binary_path = os.path.join(tmp, "bench" + DATASET_EXT)
+        write_dataset(binary_path, X, labels, columns)
+
+        start = time.perf_counter()
+        parsed = pd.read_csv(csv_path)
+        csv_seconds = time.perf_counter() - start
+        csv_bytes = int(parsed.memory_usage(deep=True).sum())
+        del parsed
+
+        start = time.perf_counter()
+        loaded = load_dataframe(binary_path)
+        binary_seconds = time.perf_counter() - start
+        binary_bytes = int(loaded.memory_usage(deep=True).sum())
+
+        print(f"{n_rows:,} rows x {len(columns)} symptoms")
+        print(f"  CSV      {os.path.getsize(csv_path) / 1e6:8.1f} MB on disk, load {csv_seconds:6.2f}s, "
+              f"{csv_bytes / 1e6:8.1f} MB in memory")
+        print(f"  {DATASET_EXT:<8} {os.path.getsize(binary_path) / 1e6:8.1f} MB on disk, load {binary_seconds:6.2f}s, "
+              f"{binary_bytes / 1e6:8.1f} MB in memory")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bit-packed, memory-mappable symptom dataset files.")
+    parser.add_argument("dataset", nargs="?", default=DATASET_FILE, help=f"{DATASET_EXT} file")
+    parser.add_argument("--from-csv", metavar="CSV", help="create the dataset from a symptom CSV")
+    parser.add_argument("--append", metavar="CSV", help="append the rows of a symptom CSV")
+    parser.add_argument("--verify", action="store_true", help="round-trip check against the shipped CSV")
+    parser.add_argument("--benchmark", type=int, metavar="ROWS", help="compare load time with CSV")
+    args = parser.parse_args()
+
+    if args.verify:
+        raise SystemExit(0 if verify() else 1)
+    if args.benchmark:
+        benchmark(args.benchmark)
+        raise SystemExit(0)
+
+    if args.from_csv:
+        convert_csv(args.from_csv, args.dataset)
+    elif args.append:
+        import pandas as pd
+
+        new_rows = pd.read_csv(args.append)
+        append_records(args.dataset, new_rows.drop(columns="disease").to_numpy(), new_rows["disease"].astype(str),
+                       new_rows.columns.drop("disease"))
+
+    info = read_schema(args.dataset)
+    print(f"{args.dataset}: {info['n_rows']:,} rows, {len(info['symptom_columns'])} symptoms, "
+          f"{len(info['labels'])} labels, {info['record_bytes']} bytes per record")
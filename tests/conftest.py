@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The modules under test live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pytest_configure(config):
+    # tomato_disease_model.pkl may have been pickled by another scikit-learn release
+    config.addinivalue_line("filterwarnings", "ignore::sklearn.exceptions.InconsistentVersionWarning")
@@ -0,0 +1,28 @@
+import pytest
+
+from clips_session import IncrementalClipsSession, rule_walk_sequences, toggle_sequences
+from diagnosis_engine import CSV_FILE, RULES_FILE, get_clips_diagnosis, load_rules, read_symptom_columns
+
+SEED = 42
+
+
+@pytest.fixture(scope="module")
+def env():
+    return load_rules(RULES_FILE, quiet=True)
+
+
+@pytest.mark.parametrize("make_sequences", [
+    lambda: rule_walk_sequences(RULES_FILE, SEED),
+    lambda: toggle_sequences(read_symptom_columns(CSV_FILE), n_sequences=20, steps=40, seed=SEED),
+], ids=["rule-walks", "random-toggles"])
+def test_incremental_matches_reset(env, make_sequences):
+    session = IncrementalClipsSession(RULES_FILE, quiet=True)
+    mismatches = []
+    for sequence in make_sequences():
+        session.reset()
+        for selected in sequence:
+            incremental = session.diagnose(selected)
+            expected = get_clips_diagnosis(env, selected)
+            if incremental != expected:
+                mismatches.append((selected, expected, incremental))
+    assert mismatches == []
@@ -0,0 +1,76 @@
+import os
+import shutil
+import threading
+
+import pytest
+
+from diagnosis_engine import RULES_FILE, DiagnosisEngine
+
+SYMPTOMS = ["yellow-leaves", "brown-spots"]
+
+
+def replace_file(path, text):
+    # Written aside and renamed over, as a deploy would, so no reader sees a half-written file
+    staged = path.with_suffix(".tmp")
+    staged.write_text(text)
+    os.replace(staged, path)
+
+
+def test_reload_under_load_never_mixes_versions(tmp_path):
+    rules_file = tmp_path / "rules_model.clp"
+    shutil.copy(RULES_FILE, rules_file)
+    original = rules_file.read_text()
+    edited = original.replace("(confidence 0.65)", "(confidence 0.55)", 1)
+    assert edited != original
+
+    engine = DiagnosisEngine(rules_file=str(rules_file), rules_backend="compiled", ml_backend="flat",
+                             quiet=True, cache_size=64)
+    expected = {}
+    for text in (edited, original):
+        replace_file(rules_file, text)
+        results, version, _ = engine.diagnose_batch_versioned([SYMPTOMS])
+        expected[version["rules"]] = results[0]
+    assert len(expected) == 2
+
+    stop = threading.Event()
+    failures = []
+
+    def diagnose():
+        while not stop.is_set():
+            try:
+                results, version, _ = engine.diagnose_batch_versioned([SYMPTOMS])
+                if results[0] != expected[version["rules"]]:
+                    failures.append((version, results[0]))
+            except Exception as e:
+                failures.append(e)
+
+    threads = [threading.Thread(target=diagnose) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for i in range(20):
+        replace_file(rules_file, edited if i % 2 == 0 else original)
+        engine.diagnose_batch([SYMPTOMS])
+    stop.set()
+    for thread in threads:
+        thread.join()
+    assert failures == []
+
+
+def test_failed_reload_is_retried(tmp_path):
+    rules_file = tmp_path / "rules_model.clp"
+    shutil.copy(RULES_FILE, rules_file)
+    original = rules_file.read_text()
+    engine = DiagnosisEngine(rules_file=str(rules_file), rules_backend="compiled", ml_backend="flat",
+                             quiet=True, cache_size=64)
+    before = engine.diagnose(SYMPTOMS)
+
+    replace_file(rules_file, original + "\n(defrule half-written\n")
+    with pytest.raises(Exception):
+        engine.diagnose(SYMPTOMS)
+    with pytest.raises(Exception):
+        engine.diagnose(SYMPTOMS)
+
+    replace_file(rules_file, original.replace("(confidence 0.65)", "(confidence 0.55)", 1))
+    after = engine.diagnose(SYMPTOMS)
+    assert after != before
+    assert after == engine.diagnose(SYMPTOMS)
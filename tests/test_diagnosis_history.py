@@ -0,0 +1,17 @@
+from diagnosis_engine import healthy_result
+from diagnosis_history import HistoryStore
+
+VERSION = {"model": "m", "rules": "r"}
+
+
+def test_healthy_diagnoses_are_recorded(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    try:
+        store.record([], healthy_result(), VERSION, timestamp=100.0)
+        store.record([], [], VERSION, timestamp=101.0)
+        store.flush()
+        assert store.written == 2
+        assert store.disease_totals(0, 200) == {"healthy": 2}
+        assert [row["symptoms"] for row in store.recent()] == [[], []]
+    finally:
+        store.close()
@@ -0,0 +1,40 @@
+import asyncio
+import json
+
+from diagnosis_service import DiagnosisService
+
+
+class FailingEngine:
+    """Accepts every known symptom, then fails the batch the way an engine bug would."""
+
+    symptom_columns = ["yellow-leaves"]
+
+    def normalize(self, symptoms):
+        if any(symptom not in self.symptom_columns for symptom in symptoms):
+            raise ValueError("Unknown symptom")
+        return list(symptoms)
+
+    def diagnose_batch_versioned(self, symptom_sets):
+        raise ValueError("internal failure")
+
+
+def diagnose(symptoms):
+    async def run():
+        service = DiagnosisService(FailingEngine())
+        service.batcher.start()
+        try:
+            return await service._route("POST", "/diagnose", json.dumps({"symptoms": symptoms}).encode())
+        finally:
+            await service.batcher.stop()
+    return asyncio.run(run())
+
+
+def test_bad_input_is_a_client_error():
+    assert diagnose(["not-a-symptom"])[0] == 400
+    assert diagnose("yellow-leaves")[0] == 400
+
+
+def test_engine_failure_is_a_server_error():
+    status, payload = diagnose(["yellow-leaves"])
+    assert status == 500
+    assert "internal failure" in payload["error"]
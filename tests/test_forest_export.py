@@ -0,0 +1,63 @@
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+
+from sklearn.ensemble import RandomForestClassifier
+
+from diagnosis_engine import CSV_FILE, MODEL_FILE, DiagnosisEngine
+from forest_export import FlatForest, forest_source, load_forest
+
+TOLERANCE = 1e-9
+
+
+@pytest.fixture(scope="module")
+def clf():
+    return joblib.load(MODEL_FILE)
+
+
+@pytest.fixture(scope="module")
+def rows():
+    df = pd.read_csv(CSV_FILE)
+    X_data = df.drop("disease", axis=1).to_numpy(dtype=np.uint8)
+    rng = np.random.default_rng(42)
+    X_random = (rng.random((2000, X_data.shape[1])) < 0.1).astype(np.uint8)
+    return pd.DataFrame(np.vstack([X_data, X_random]), columns=df.columns[:-1])
+
+
+def test_flat_forest_matches_sklearn(clf, rows):
+    forest = FlatForest.from_sklearn(clf)
+    expected = clf.predict_proba(rows)
+    actual = forest.predict_proba(rows.to_numpy())
+    assert list(forest.classes_) == list(clf.classes_)
+    np.testing.assert_allclose(actual, expected, rtol=0, atol=TOLERANCE)
+
+
+def test_round_trip_through_arrays(clf, rows):
+    forest = FlatForest.from_sklearn(clf)
+    restored = FlatForest.from_arrays(forest.to_arrays())
+    X = rows.to_numpy()
+    np.testing.assert_allclose(restored.predict_proba(X), forest.predict_proba(X), rtol=0, atol=TOLERANCE)
+
+
+@pytest.fixture
+def small_model(tmp_path):
+    df = pd.read_csv(CSV_FILE)
+    small = RandomForestClassifier(n_estimators=3, random_state=0).fit(df.drop("disease", axis=1), df["disease"])
+    model_file = str(tmp_path / "small.pkl")
+    joblib.dump(small, model_file)
+    return model_file
+
+
+def test_export_of_another_model_is_not_used(clf, small_model, tmp_path):
+    forest_file = str(tmp_path / "forest.npz")
+    FlatForest.from_sklearn(clf).save(forest_file, source_model=MODEL_FILE)
+    assert forest_source(forest_file) is not None
+
+    assert load_forest(forest_file, model_file=MODEL_FILE).n_estimators == clf.n_estimators
+    assert load_forest(forest_file, model_file=small_model).n_estimators == 3
+
+
+def test_flat_engine_without_artifact_serves_model_file(small_model):
+    engine = DiagnosisEngine(model_file=small_model, rules_backend="compiled", ml_backend="flat", quiet=True)
+    assert engine.clf.n_estimators == 3
@@ -0,0 +1,45 @@
+import os
+
+import joblib
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from diagnosis_engine import CSV_FILE, DiagnosisEngine
+from model_artifact import artifact_dir_for, build_from_model, load_manifest, matches_source
+
+
+def save_forest(model_file, n_estimators):
+    df = pd.read_csv(CSV_FILE)
+    clf = RandomForestClassifier(n_estimators=n_estimators, random_state=0)
+    clf.fit(df.drop("disease", axis=1), df["disease"])
+    # Saved aside and renamed over, as a retrained model is copied into place
+    joblib.dump(clf, model_file + ".tmp")
+    os.replace(model_file + ".tmp", model_file)
+
+
+@pytest.fixture
+def model_file(tmp_path):
+    model_file = str(tmp_path / "small.pkl")
+    save_forest(model_file, 3)
+    build_from_model(model_file, artifact_dir_for(model_file), CSV_FILE)
+    return model_file
+
+
+def test_flat_engine_serves_the_artifact_of_its_model_file(model_file):
+    engine = DiagnosisEngine(model_file=model_file, rules_backend="compiled", ml_backend="flat", quiet=True)
+    assert engine.artifact_dir == artifact_dir_for(model_file)
+    assert engine.clf.n_estimators == 3
+
+
+def test_retrained_model_rebuilds_a_stale_artifact(model_file):
+    engine = DiagnosisEngine(model_file=model_file, rules_backend="compiled", ml_backend="flat", quiet=True,
+                             cache_size=16)
+    old_model = engine.version["model"]
+    save_forest(model_file, 5)
+    assert not matches_source(load_manifest(engine.artifact_dir), model_file)
+
+    engine.diagnose(engine.symptom_columns[:2])
+    assert engine.clf.n_estimators == 5
+    assert engine.version["model"] != old_model
+    assert matches_source(load_manifest(engine.artifact_dir), model_file)
@@ -0,0 +1,45 @@
+import pytest
+
+from diagnosis_engine import RULES_FILE, DiagnosisEngine, get_clips_diagnosis, load_rules
+from rule_compiler import compile_rules, parse_rules, verification_cases
+
+
+@pytest.fixture(scope="module")
+def engine():
+    return DiagnosisEngine(ml_backend="flat", rules_backend="compiled", quiet=True)
+
+
+@pytest.fixture(scope="module")
+def env():
+    return load_rules(RULES_FILE, quiet=True)
+
+
+@pytest.fixture(scope="module")
+def compiled(engine):
+    return compile_rules(engine.symptom_columns, RULES_FILE)
+
+
+def test_compiled_cf_matches_clips(engine, env, compiled):
+    cases = verification_cases(compiled, n_random=500, seed=42)
+    compiled_results = compiled.diagnose_batch(engine.encode(cases))
+
+    mismatches = [(symptoms, clips_result, compiled_result)
+                  for symptoms, compiled_result in zip(cases, compiled_results)
+                  for clips_result in [get_clips_diagnosis(env, symptoms)]
+                  if clips_result != compiled_result]
+    assert mismatches == []
+
+
+def test_every_rule_fires_on_its_own_conditions(compiled):
+    with open(RULES_FILE, encoding="utf-8") as f:
+        rules = parse_rules(f.read())
+    columns = set(compiled.symptom_columns)
+    for name, symptoms, disease, confidence in rules:
+        if not set(symptoms) <= columns:
+            continue
+        X = [[1 if s in symptoms else 0 for s in compiled.symptom_columns]]
+        assert compiled.diagnose_batch(X)[0][disease] >= confidence * 100, name
+
+
+def test_no_symptoms_fires_nothing(engine, compiled):
+    assert compiled.diagnose_batch(engine.encode([[]])) == [{}]
@@ -0,0 +1,58 @@
+import json
+import shutil
+
+import numpy as np
+import pytest
+
+from diagnosis_engine import CSV_FILE, MODEL_FILE, RULES_FILE, DiagnosisEngine
+from model_artifact import build_from_model, load_symptom_stats, manifest_path
+from symptom_advisor import SymptomAdvisor, csv_symptom_stats, symptom_likelihoods
+
+
+@pytest.fixture(scope="module")
+def artifact_dir(tmp_path_factory):
+    artifact_dir = tmp_path_factory.mktemp("artifact")
+    build_from_model(MODEL_FILE, str(artifact_dir), CSV_FILE)
+    return artifact_dir
+
+
+@pytest.fixture(scope="module")
+def engine(artifact_dir):
+    return DiagnosisEngine(rules_backend="compiled", ml_backend="flat", quiet=True, artifact_dir=str(artifact_dir))
+
+
+def test_artifact_likelihoods_match_csv(engine, artifact_dir):
+    advisor = SymptomAdvisor(engine)
+    expected = symptom_likelihoods(advisor.diseases, engine.symptom_columns, advisor.rules,
+                                   csv_symptom_stats(CSV_FILE))
+    assert load_symptom_stats(str(artifact_dir)) is not None
+    np.testing.assert_array_equal(advisor.likelihoods, expected)
+
+
+def test_artifact_without_stats_falls_back_to_csv(engine, artifact_dir, tmp_path):
+    manifest = json.loads(open(manifest_path(str(artifact_dir)), encoding="utf-8").read())
+    del manifest["symptom_stats"]
+    with open(manifest_path(str(tmp_path)), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    assert load_symptom_stats(str(tmp_path)) is None
+
+    with_stats = SymptomAdvisor(engine)
+    engine.artifact_dir = str(tmp_path)
+    try:
+        np.testing.assert_array_equal(SymptomAdvisor(engine).likelihoods, with_stats.likelihoods)
+    finally:
+        engine.artifact_dir = str(artifact_dir)
+
+
+def test_rule_concluding_healthy_is_not_ranked(artifact_dir, tmp_path):
+    rules_file = tmp_path / "rules_model.clp"
+    shutil.copy(RULES_FILE, rules_file)
+    with open(rules_file, "a", encoding="utf-8") as f:
+        f.write("\n(defrule all-clear\n   (logical (symptom (name yellow-leaves)))\n   =>\n"
+                "   (assert (disease (name healthy) (confidence 0.10))))\n")
+    engine = DiagnosisEngine(rules_file=str(rules_file), rules_backend="compiled", ml_backend="flat", quiet=True,
+                             artifact_dir=str(artifact_dir))
+    advisor = SymptomAdvisor(engine)
+    assert "healthy" in advisor.rules.diseases
+    assert "healthy" not in advisor.diseases
+    assert advisor.suggest(["yellow-leaves"])
@@ -1,42 +1,159 @@
 import pandas as pd
-from sklearn.model_selection import train_test_split, cross_val_score, StratifiedKFold
+from sklearn.model_selection import train_test_split, StratifiedKFold
 from sklearn.ensemble import RandomForestClassifier
 import joblib
 import numpy as np
+import argparse
+import hashlib
+import json
 import os
+import time
+from contextlib import contextmanager
+
+from forest_export import FlatForest
+from model_artifact import artifact_dir_for, save_artifact, symptom_stats, training_metadata
+from symptom_dataset import DATASET_EXT, load_dataframe
 
 # --- Configuration ---
 CSV_FILE = "tomato_disease_symptoms_extended.csv"
 MODEL_FILE = "tomato_disease_model.pkl"
 MIN_SAMPLES_PER_CLASS = 5  # Set the minimum number of rows required for a disease class
+N_ESTIMATORS = 500
+N_SPLITS = 5
+N_JOBS = -1  # -1 = all cores, for both tree fitting (threads) and CV folds (processes)
+ADD_TREES = 50  # Trees added per warm-start retrain
+MAX_TREES = N_ESTIMATORS  # Warm starts replace the oldest trees beyond this, so latency stays flat
+CV_CACHE_FILE = "cv_cache.json"  # Fold scores keyed by data + params, reused across runs
+
+
+# ==========================================
+# Phase Timing
+# ==========================================
+
+@contextmanager
+def phase(timings, name):
+    """Records the wall time of the with-block under timings[name]."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = time.perf_counter() - start
+
+
+def print_timings(timings):
+    print("\nWall time per phase:")
+    for name, seconds in timings.items():
+        print(f"  {name:<12} {seconds:8.2f}s")
+    print(f"  {'total':<12} {sum(timings.values()):8.2f}s")
+
+
+# ==========================================
+# Cached, Parallel Cross-Validation
+# ==========================================
+
+def data_fingerprint(X, y):
+    """SHA-256 over the feature matrix, column names and labels."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(list(X.columns)).encode())
+    # uint8 regardless of source, so the same data read from CSV or a .tds file shares a key
+    digest.update(np.ascontiguousarray(X.to_numpy(dtype=np.uint8)).tobytes())
+    digest.update("\n".join(map(str, y)).encode())
+    return digest.hexdigest()
 
 
-def train_and_save_model():
+def fit_fold(X, y, train_idx, test_idx, params):
+    """Fits one fold's forest single-threaded (folds already run in parallel) and scores it."""
+    try:
+        fold_clf = RandomForestClassifier(**params, n_jobs=1)
+        fold_clf.fit(X.iloc[train_idx], y.iloc[train_idx])
+        return float(fold_clf.score(X.iloc[test_idx], y.iloc[test_idx]))
+    except Exception as e:
+        print(f"Warning: fold failed: {e}")
+        return float("nan")
+
+
+def cached_cross_validation(X, y, params, n_jobs=N_JOBS, cache_file=CV_CACHE_FILE):
+    """
+    Stratified K-fold accuracy with folds fitted in parallel worker processes.
+    Each fold's score is cached under (data fingerprint, params, fold), so re-running on
+    unchanged data reuses every fold instead of refitting it. Failed folds score NaN.
+    """
+    cache = {}
+    if cache_file and os.path.exists(cache_file):
+        with open(cache_file, encoding="utf-8") as f:
+            cache = json.load(f)
+
+    cv_splitter = StratifiedKFold(n_splits=N_SPLITS, shuffle=True, random_state=42)
+    folds = list(cv_splitter.split(X, y))
+    base_key = f"{data_fingerprint(X, y)}:{json.dumps(params, sort_keys=True)}:{N_SPLITS}"
+    keys = [f"{base_key}:{i}" for i in range(len(folds))]
+
+    todo = [i for i, key in enumerate(keys) if key not in cache]
+    print(f"Reusing {len(folds) - len(todo)} cached fold(s), fitting {len(todo)}.")
+    if todo:
+        scores = joblib.Parallel(n_jobs=min(n_jobs if n_jobs > 0 else os.cpu_count(), len(todo)))(
+            joblib.delayed(fit_fold)(X, y, folds[i][0], folds[i][1], params) for i in todo)
+        for i, score in zip(todo, scores):
+            if not np.isnan(score):
+                cache[keys[i]] = score
+        if cache_file:
+            with open(cache_file, "w", encoding="utf-8") as f:
+                json.dump(cache, f)
+        fresh = dict(zip(todo, scores))
+    else:
+        fresh = {}
+
+    return np.array([cache.get(key, fresh.get(i, float("nan"))) for i, key in enumerate(keys)])
+
+
+# ==========================================
+# Training
+# ==========================================
+
+def train_and_save_model(csv_file=CSV_FILE, model_file=MODEL_FILE, n_estimators=N_ESTIMATORS,
+                         artifact_dir=None, n_jobs=N_JOBS, warm_start=False, add_trees=ADD_TREES,
+                         max_trees=MAX_TREES, cross_validate=True, cv_cache_file=CV_CACHE_FILE):
     """
     Loads data, trains a Random Forest Classifier, and saves the model.
     Uses StratifiedKFold for robust accuracy reporting on imbalanced data.
+
+    Trees are fitted on n_jobs threads and CV folds in n_jobs processes. With warm_start,
+    the previous model_file is extended by add_trees trees fitted on the current data
+    instead of training the whole forest again; past max_trees its oldest trees are
+    replaced. Cross-validation scores the configured n_estimators either way, so a warm
+    start on unchanged data reuses the cached folds. The serving artifact goes to artifact_dir,
+    by default next to the model (tomato_disease_model.pkl -> tomato_disease_model.artifact).
+    csv_file may also be a bit-packed .tds dataset (symptom_dataset.py), which is memory-mapped
+    and unpacked to uint8 columns instead of parsed.
+    Returns the fitted classifier (None if training could not run).
     """
-    try:
-        # Load data
-        df = pd.read_csv(CSV_FILE)
-    except FileNotFoundError:
-        print(f"Error: {CSV_FILE} not found. Please ensure it is uploaded.")
-        return
+    if artifact_dir is None:
+        artifact_dir = artifact_dir_for(model_file)
+    timings = {}
+
+    with phase(timings, "load"):
+        try:
+            # Load data
+            df = load_dataframe(csv_file) if csv_file.endswith(DATASET_EXT) else pd.read_csv(csv_file)
+        except FileNotFoundError:
+            print(f"Error: {csv_file} not found. Please ensure it is uploaded.")
+            return None
 
     # --- NEW: Data Filtering Step ---
-    print(f"Original number of samples: {len(df)}")
+    with phase(timings, "filter"):
+        print(f"Original number of samples: {len(df)}")
 
-    # 1. Count the occurrences of each disease
-    class_counts = df['disease'].value_counts()
+        # 1. Count the occurrences of each disease
+        class_counts = df['disease'].value_counts()
 
-    # 2. Identify classes that meet the minimum sample requirement
-    valid_classes = class_counts[class_counts >= MIN_SAMPLES_PER_CLASS].index.tolist()
+        # 2. Identify classes that meet the minimum sample requirement
+        valid_classes = class_counts[class_counts >= MIN_SAMPLES_PER_CLASS].index.tolist()
 
-    # 3. Filter the DataFrame to keep only rows with valid diseases
-    df_filtered = df[df['disease'].isin(valid_classes)]
+        # 3. Filter the DataFrame to keep only rows with valid diseases
+        df_filtered = df[df['disease'].isin(valid_classes)]
 
-    print(f"Number of disease classes kept: {len(valid_classes)}")
-    print(f"Filtered number of samples (min {MIN_SAMPLES_PER_CLASS} rows): {len(df_filtered)}")
+        print(f"Number of disease classes kept: {len(valid_classes)}")
+        print(f"Filtered number of samples (min {MIN_SAMPLES_PER_CLASS} rows): {len(df_filtered)}")
     # --- END Data Filtering Step ---
 
     # Prepare data using the filtered DataFrame
@@ -46,40 +163,110 @@ def train_and_save_model():
     # If all data was filtered out, exit
     if len(df_filtered) == 0:
         print("Error: No diseases met the minimum sample requirement. Cannot train model.")
-        return
+        return None
 
     # 1. Train Classifier with increased estimators
-    print("Training Random Forest Classifier (n_estimators=500)...")
-    clf = RandomForestClassifier(n_estimators=500, random_state=42)
-    clf.fit(X, y)  # Fit on all data before saving for best final model
+    with phase(timings, "fit"):
+        clf = load_for_warm_start(model_file, X, y) if warm_start else None
+        warm_started = clf is not None
+        if warm_started:
+            added = min(add_trees, max_trees)
+            kept = min(len(clf.estimators_), max_trees - added)
+            retired = len(clf.estimators_) - kept
+            print(f"Warm-starting from {model_file}: {len(clf.estimators_)} -> {kept + added} trees "
+                  f"({added} added, {retired} oldest replaced)...")
+            clf.estimators_ = clf.estimators_[retired:]
+            clf.set_params(warm_start=True, n_estimators=kept + added, n_jobs=n_jobs,
+                           random_state=warm_start_seed(X, y, clf.estimators_))
+        else:
+            print(f"Training Random Forest Classifier (n_estimators={n_estimators})...")
+            clf = RandomForestClassifier(n_estimators=n_estimators, random_state=42, n_jobs=n_jobs)
+        clf.fit(X, y)  # Fit on all data before saving for best final model
+
+        # Saved models predict one row at a time; thread fan-out would only add overhead there
+        clf.set_params(warm_start=False, n_jobs=None)
 
     # 2. Perform Stratified Cross-Validation (CV) for robust evaluation
-    print("Performing 5-Fold Stratified Cross-Validation for robust accuracy...")
-    try:
-        # Use StratifiedKFold to handle imbalanced classes gracefully
-        cv_splitter = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
-        cv_scores = cross_val_score(clf, X, y, cv=cv_splitter, scoring='accuracy')
+    if cross_validate:
+        with phase(timings, "cv"):
+            print(f"Performing {N_SPLITS}-Fold Stratified Cross-Validation for robust accuracy...")
+            params = {"n_estimators": n_estimators, "random_state": 42}
+            cv_scores = cached_cross_validation(X, y, params, n_jobs, cv_cache_file)
+            valid_scores = cv_scores[~np.isnan(cv_scores)]
 
-        print(f"Cross-Validation Scores: {cv_scores}")
-        print(f"Average CV Accuracy: {np.mean(cv_scores):.4f}")
-    except Exception as e:
-        print(f"Warning: Could not perform Stratified Cross-Validation. Error: {e}")
-        # Fallback to single split test accuracy if CV fails
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-        clf_test = RandomForestClassifier(n_estimators=500, random_state=42)
-        clf_test.fit(X_train, y_train)
-        print(f"Fallback Test Accuracy (80/20 split): {clf_test.score(X_test, y_test):.4f}")
+            if len(valid_scores):
+                print(f"Cross-Validation Scores: {cv_scores}")
+                print(f"Average CV Accuracy: {np.mean(valid_scores):.4f} ({len(valid_scores)}/{N_SPLITS} folds)")
+            else:
+                print("Warning: Could not perform Stratified Cross-Validation.")
+                # Fallback to single split test accuracy if every fold fails
+                X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+                clf_test = RandomForestClassifier(n_estimators=n_estimators, random_state=42, n_jobs=n_jobs)
+                clf_test.fit(X_train, y_train)
+                print(f"Fallback Test Accuracy (80/20 split): {clf_test.score(X_test, y_test):.4f}")
 
     # 3. Save trained model (using the one fitted on all data)
-    joblib.dump(clf, MODEL_FILE)
+    with phase(timings, "save"):
+        joblib.dump(clf, model_file)
 
-    print(f"\nModel saved successfully as {MODEL_FILE}!")
+        # Write the self-describing artifact (schema, classes, metadata, flat forest) used at serve time
+        metadata = training_metadata(clf, X, y, csv_file)
+        metadata["phase_seconds"] = dict(timings)
+        metadata["warm_started"] = warm_started
+        # Over every labelled row, also diseases dropped from training (the rules may know them)
+        stats = symptom_stats(df[X.columns], df["disease"])
+        manifest = save_artifact(FlatForest.from_sklearn(clf), X.columns, metadata, artifact_dir, stats, model_file)
+
+    print(f"\nModel saved successfully as {model_file}!")
+    print(f"Model artifact {manifest['model_id']} written for serving.")
 
     # For debugging: print the feature columns the model expects
     print(f"\nModel Feature Columns ({len(X.columns)}):")
     print(X.columns.tolist())
 
+    print_timings(timings)
+    return clf
+
+
+def warm_start_seed(X, y, trees):
+    """
+    random_state for the trees added to a warm-started forest. It changes with the data and
+    with the trees kept, so added trees do not repeat the seeds of kept or earlier ones.
+    """
+    seeds = json.dumps([int(tree.random_state) for tree in trees])
+    return int(hashlib.sha256(f"{data_fingerprint(X, y)}:{seeds}".encode()).hexdigest()[:8], 16)
+
+
+def load_for_warm_start(model_file, X, y):
+    """The previous model if it can be extended with the current data, otherwise None."""
+    try:
+        clf = joblib.load(model_file)
+    except (FileNotFoundError, EOFError) as e:
+        print(f"Warning: no previous model to warm-start from ({e}); training from scratch.")
+        return None
+
+    if list(getattr(clf, "feature_names_in_", [])) != list(X.columns):
+        print("Warning: symptom columns changed since the previous model; training from scratch.")
+        return None
+    if set(clf.classes_) != set(y.unique()):
+        print("Warning: disease classes changed since the previous model; training from scratch.")
+        return None
+    return clf
+
 
 # Run the training process
 if __name__ == "__main__":
-    train_and_save_model()
+    parser = argparse.ArgumentParser(description="Train the tomato disease Random Forest.")
+    parser.add_argument("--csv", default=CSV_FILE, help=f"symptom CSV or {DATASET_EXT} dataset")
+    parser.add_argument("--model", default=MODEL_FILE)
+    parser.add_argument("--trees", type=int, default=N_ESTIMATORS, help="n_estimators for a fresh model")
+    parser.add_argument("--jobs", type=int, default=N_JOBS, help="parallel jobs (-1 = all cores)")
+    parser.add_argument("--warm-start", action="store_true", help="extend the previous model with new trees")
+    parser.add_argument("--add-trees", type=int, default=ADD_TREES, help="trees added when warm-starting")
+    parser.add_argument("--max-trees", type=int, default=MAX_TREES,
+                        help="warm starts replace the oldest trees beyond this many")
+    parser.add_argument("--no-cv", action="store_true", help="skip cross-validation")
+    args = parser.parse_args()
+
+    train_and_save_model(args.csv, args.model, args.trees, n_jobs=args.jobs, warm_start=args.warm_start,
+                         add_trees=args.add_trees, max_trees=args.max_trees, cross_validate=not args.no_cv)